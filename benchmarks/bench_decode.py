@@ -0,0 +1,76 @@
+"""
+Benchmark of parallel tile decoding in OSMManager.create_osm_image().
+
+Builds a mosaic of locally cached synthetic tiles with a NumpyImageManager,
+decoding with 1, 2, 4, ... threads up to the number of CPUs, and prints the
+time taken and the speedup over the serial loop. No network is used.
+
+    python benchmarks/bench_decode.py --side 16
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+from osmviz.manager import NumpyImageManager, OSMManager
+
+URL = "http://osmviz.invalid/{z}/{x}/{y}.png"
+ZOOM = 12
+
+
+def make_tiles(osm, side: int) -> tuple[float, float, float, float]:
+    """
+    Caches side x side synthetic tiles, with some texture so that they
+    take a realistic time to decode, and returns bounds covering them.
+    """
+    rng = np.random.default_rng(0)
+    x0, y0 = 2000, 1200
+    for x in range(x0, x0 + side):
+        for y in range(y0, y0 + side):
+            base = rng.integers(0, 256, (16, 16, 3), dtype=np.uint8)
+            pixels = np.kron(base, np.ones((16, 16, 1), dtype=np.uint8))
+            pixels[::7] //= 2
+            key = osm.get_tile_key((x, y), ZOOM)
+            Image.fromarray(pixels).save(osm.tile_store.get_filename(key))
+    max_lat, min_lon = osm.tile_nw_lat_lon((x0 + 0.5, y0 + 0.5), ZOOM)
+    min_lat, max_lon = osm.tile_nw_lat_lon((x0 + side - 0.5, y0 + side - 0.5), ZOOM)
+    return min_lat, max_lat, min_lon, max_lon
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--side", type=int, default=16, help="tiles per side")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per setting")
+    parser.add_argument(
+        "--max-decoders", type=int, default=os.cpu_count(), help="most threads"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cache:
+        osm = OSMManager(image_manager=NumpyImageManager(), url=URL, cache=cache)
+        bounds = make_tiles(osm, args.side)
+        print(f"{args.side * args.side} tiles, {os.cpu_count()} CPUs")
+
+        decoders = 1
+        serial = None
+        while decoders <= args.max_decoders:
+            osm.decoders = decoders
+            best = float("inf")
+            for _ in range(args.repeat):
+                osm.manager.destroy_image()
+                start = time.perf_counter()
+                osm.create_osm_image(bounds, ZOOM)
+                best = min(best, time.perf_counter() - start)
+            serial = serial or best
+            print(f"decoders={decoders:3d}  {best:7.3f}s  x{serial / best:.2f}")
+            decoders *= 2
+
+
+if __name__ == "__main__":
+    main()
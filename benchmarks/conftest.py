@@ -0,0 +1,69 @@
+"""
+Benchmarks, run with pytest-benchmark:
+
+    python -m pytest benchmarks
+    python -m pytest benchmarks --benchmark-autosave
+    python -m pytest benchmarks --benchmark-compare
+
+Compare against a saved run to catch regressions. No network is used:
+tiles come from a local synthetic tile server, and Pygame draws to
+off-screen surfaces with SDL's dummy video driver.
+
+The peak memory allocated by Python during one extra call of each
+benchmarked function is saved in its extra_info as peak_bytes. Frame
+benchmarks also save the CPU time per frame as cpu_seconds; their OPS
+column is the frame rate.
+"""
+
+from __future__ import annotations
+
+import os
+import time
+import tracemalloc
+
+import pytest
+from tile_server import serve_tiles
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+
+@pytest.fixture(scope="session")
+def tile_server():
+    with serve_tiles(textured=True) as server:
+        yield server
+
+
+@pytest.fixture()
+def record_peak_memory(benchmark):
+    """
+    A function calling func(*args) once more, saving the peak memory it
+    allocated in the benchmark's extra_info.
+    """
+
+    def record(func, *args) -> None:
+        tracemalloc.start()
+        try:
+            func(*args)
+            benchmark.extra_info["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return record
+
+
+@pytest.fixture()
+def record_cpu_time(benchmark):
+    """
+    A function calling func() calls more times, saving the mean CPU time
+    (of all threads of the process) per call in the benchmark's
+    extra_info.
+    """
+
+    def record(func, calls: int = 10) -> None:
+        start = time.process_time()
+        for _ in range(calls):
+            func()
+        benchmark.extra_info["cpu_seconds"] = (time.process_time() - start) / calls
+
+    return record
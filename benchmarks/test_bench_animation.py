@@ -0,0 +1,175 @@
+"""
+Benchmarks of drawing Simulation frames with many TrackingViz actors
+(following functions of time, or Trajectory objects), or one
+TrackingVizGroup of as many objects, off-screen. Frames are drawn whole
+by draw_frame(), or incrementally by update_frame() (for either kind of
+actor) while the actors move a pixel or so per frame, or are paused.
+Positions are also looked up in a TrackingVizGroup of long tracks.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+import pygame
+import pytest
+
+from osmviz.animation import Simulation, TrackingViz, TrackingVizGroup
+from osmviz.trajectory import Trajectory
+
+IMAGE = "test/images/train.png"
+SCREEN = (1280, 800)
+
+
+def make_routes(actors: int):
+    """
+    Returns the (lat, lon) starts and ends of actors' straight routes.
+    """
+    rng = np.random.default_rng(0)
+    starts = rng.uniform((60.0, 24.8), (60.3, 25.2), (actors, 2))
+    ends = rng.uniform((60.0, 24.8), (60.3, 25.2), (actors, 2))
+    return starts, ends
+
+
+def make_simulation(actors: int) -> Simulation:
+    """
+    Returns a Simulation of actors moving in straight lines over 1000s.
+    """
+    starts, ends = (routes.tolist() for routes in make_routes(actors))
+    vizs = []
+    for (lat1, lon1), (lat2, lon2) in zip(starts, ends):
+
+        def get_lat_lon(t, lat1=lat1, lon1=lon1, lat2=lat2, lon2=lon2):
+            f = t / 1000
+            return lat1 + f * (lat2 - lat1), lon1 + f * (lon2 - lon1)
+
+        box = (min(lat1, lat2), max(lat1, lat2), min(lon1, lon2), max(lon1, lon2))
+        vizs.append(TrackingViz("actor", IMAGE, get_lat_lon, (0, 1000), box))
+    return Simulation(vizs, [], 0)
+
+
+def make_trajectory_simulation(actors: int) -> Simulation:
+    """
+    Returns the Simulation of make_simulation(), with Trajectory tracks.
+    """
+    starts, ends = (routes.tolist() for routes in make_routes(actors))
+    vizs = [
+        TrackingViz("actor", IMAGE, Trajectory([(0, *start), (1000, *end)]))
+        for start, end in zip(starts, ends)
+    ]
+    return Simulation(vizs, [], 0)
+
+
+@pytest.mark.parametrize("actors", [10, 1000, 100_000])
+def test_draw_frame_trajectory(
+    benchmark, record_peak_memory, record_cpu_time, actors
+) -> None:
+    sim = make_trajectory_simulation(actors)
+    surface = pygame.Surface(SCREEN)
+    background = pygame.Surface(SCREEN)
+    get_xy = sim.make_get_xy(sim.bounding_box, SCREEN)
+    frames = iter(range(10**9))
+
+    def run():
+        sim.set_time(next(frames) % 1000)
+        return sim.draw_frame(surface, background, get_xy, (640, 400))
+
+    benchmark.pedantic(run, rounds=10 if actors > 1000 else 50, warmup_rounds=1)
+    record_peak_memory(run)
+    record_cpu_time(run, 1 if actors > 1000 else 10)
+
+
+@pytest.mark.parametrize("actors", [10, 1000, 100_000])
+def test_draw_frame(benchmark, record_peak_memory, record_cpu_time, actors) -> None:
+    sim = make_simulation(actors)
+    surface = pygame.Surface(SCREEN)
+    background = pygame.Surface(SCREEN)
+    bounds = sim.bounding_box
+    frames = iter(range(10**9))
+
+    def get_xy(lat, lon):
+        return sim.get_xy(lat, lon, bounds, SCREEN)
+
+    def run():
+        sim.set_time(next(frames) % 1000)
+        return sim.draw_frame(surface, background, get_xy, (640, 400))
+
+    benchmark.pedantic(run, rounds=10 if actors > 1000 else 50, warmup_rounds=1)
+    record_peak_memory(run)
+    record_cpu_time(run, 1 if actors > 1000 else 10)
+
+
+def make_group_simulation(actors: int) -> Simulation:
+    """
+    Returns the Simulation of make_simulation(), with one TrackingVizGroup.
+    """
+    starts, ends = make_routes(actors)
+    tracks = np.empty((actors, 2, 3))
+    tracks[:, :, 0] = 0, 1000
+    tracks[:, 0, 1:] = starts
+    tracks[:, 1, 1:] = ends
+    group = TrackingVizGroup(tracks, IMAGE, labels=["actor"] * actors)
+    return Simulation([group], [], 0)
+
+
+@pytest.mark.parametrize("actors", [10, 1000, 100_000])
+def test_draw_frame_group(
+    benchmark, record_peak_memory, record_cpu_time, actors
+) -> None:
+    sim = make_group_simulation(actors)
+    surface = pygame.Surface(SCREEN)
+    background = pygame.Surface(SCREEN)
+    get_xy = sim.make_get_xy(sim.bounding_box, SCREEN)
+    frames = iter(range(10**9))
+
+    def run():
+        sim.set_time(next(frames) % 1000)
+        return sim.draw_frame(surface, background, get_xy, (640, 400))
+
+    benchmark.pedantic(run, rounds=10 if actors > 1000 else 50, warmup_rounds=1)
+    record_peak_memory(run)
+    record_cpu_time(run, 1 if actors > 1000 else 10)
+
+
+@pytest.mark.parametrize("samples", [100, 10_000])
+def test_group_lat_lon_at_time(benchmark, record_cpu_time, samples) -> None:
+    # 1000 objects, each with a track of samples over 1000s
+    rng = np.random.default_rng(0)
+    tracks = np.empty((1000, samples, 3))
+    tracks[:, :, 0] = np.sort(rng.uniform(0, 1000, (1000, samples)))
+    tracks[:, [0, -1], 0] = 0, 1000
+    tracks[:, :, 1:] = rng.uniform((60.0, 24.8), (60.3, 25.2), (1000, samples, 2))
+    group = TrackingVizGroup(tracks, IMAGE)
+    frames = iter(range(10**9))
+
+    def run():
+        return group.get_lat_lon_at_time(next(frames) % 1000)
+
+    index, _, _ = benchmark.pedantic(run, rounds=50, warmup_rounds=1)
+    assert len(index) == 1000
+    record_cpu_time(run)
+
+
+@pytest.mark.parametrize("speed", [1, 0], ids=["moving", "paused"])
+@pytest.mark.parametrize("actors", [10, 1000])
+@pytest.mark.parametrize(
+    "make",
+    [make_trajectory_simulation, make_group_simulation],
+    ids=["trajectory", "group"],
+)
+def test_update_frame(
+    benchmark, record_peak_memory, record_cpu_time, make, actors, speed
+) -> None:
+    sim = make(actors)
+    surface = pygame.Surface(SCREEN)
+    background = pygame.Surface(SCREEN)
+    get_xy = sim.make_get_xy(sim.bounding_box, SCREEN)
+    frames = iter(range(10**9))
+    sim.update_frame(surface, background, get_xy)
+
+    def run():
+        sim.set_time(next(frames) * speed % 1000)
+        return sim.update_frame(surface, background, get_xy, (640, 400))
+
+    benchmark.pedantic(run, rounds=50, warmup_rounds=1)
+    record_peak_memory(run)
+    record_cpu_time(run)
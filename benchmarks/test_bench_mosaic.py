@@ -0,0 +1,74 @@
+"""
+Benchmarks of OSMManager.create_osm_image() at several grid sizes, with
+the tiles:
+  - cold: downloaded from the local tile server into an empty cache
+  - warm_disk: read from the disk cache
+  - warm_memory: already decoded, in a TileMemoryCache
+"""
+
+from __future__ import annotations
+
+import itertools
+
+import pytest
+
+from osmviz.cache import TileMemoryCache
+from osmviz.manager import OSMManager, PILImageManager
+
+ZOOM = 12
+# Top left tile of the mosaics
+ORIGIN = (2000, 1200)
+SIDES = [2, 4, 8]
+STATES = ["cold", "warm_disk", "warm_memory"]
+
+
+def grid_bounds(osm, side: int):
+    """
+    Returns bounds covering exactly side x side tiles from ORIGIN.
+    """
+    x0, y0 = ORIGIN
+    max_lat, min_lon = osm.tile_nw_lat_lon((x0 + 0.5, y0 + 0.5), ZOOM)
+    min_lat, max_lon = osm.tile_nw_lat_lon((x0 + side - 0.5, y0 + side - 0.5), ZOOM)
+    return min_lat, max_lat, min_lon, max_lon
+
+
+@pytest.mark.parametrize("state", STATES)
+@pytest.mark.parametrize("side", SIDES)
+def test_create_osm_image(
+    benchmark, record_peak_memory, tile_server, tmp_path, side, state
+) -> None:
+    counter = itertools.count()
+    tile_cache = TileMemoryCache() if state == "warm_memory" else None
+    warm = OSMManager(
+        image_manager=PILImageManager("RGB", tile_cache),
+        url=tile_server.url,
+        cache=str(tmp_path / "warm"),
+        verbose=False,
+    )
+    bounds = grid_bounds(warm, side)
+    if state != "cold":
+        warm.create_osm_image(bounds, ZOOM)
+        warm.manager.destroy_image()
+
+    def setup():
+        if state == "cold":
+            cache = tmp_path / f"cold{next(counter)}"
+            cache.mkdir()
+            osm = OSMManager(
+                image_manager=PILImageManager("RGB"),
+                url=tile_server.url,
+                cache=str(cache),
+                verbose=False,
+            )
+        else:
+            osm = warm
+        return (osm,), {}
+
+    def run(osm):
+        img, _ = osm.create_osm_image(bounds, ZOOM)
+        osm.manager.destroy_image()
+        return img
+
+    img = benchmark.pedantic(run, setup=setup, rounds=5, warmup_rounds=1)
+    assert img.size == (256 * side, 256 * side)
+    record_peak_memory(run, *setup()[0])
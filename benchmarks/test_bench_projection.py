@@ -0,0 +1,44 @@
+"""
+Benchmarks of the Web Mercator projection
+"""
+
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from osmviz import projection
+
+N = 10_000
+
+
+@pytest.fixture(scope="module")
+def lat_lons():
+    rng = np.random.default_rng(0)
+    return rng.uniform(-85, 85, N), rng.uniform(-180, 180, N)
+
+
+def test_get_tile_coord(benchmark, lat_lons) -> None:
+    lats, lons = lat_lons
+    points = list(zip(lats.tolist(), lons.tolist()))
+
+    def run():
+        return [projection.get_tile_coord(lon, lat, 14) for lat, lon in points]
+
+    result = benchmark(run)
+    assert len(result) == N
+
+
+def test_get_tile_coord_array(benchmark, lat_lons) -> None:
+    lats, lons = lat_lons
+
+    xtile, _ = benchmark(projection.get_tile_coord_array, lons, lats, 14)
+    assert len(xtile) == N
+
+
+def test_get_xy_array(benchmark, lat_lons) -> None:
+    lats, lons = lat_lons
+    bounds = (-85, 85, -180, 180)
+
+    x, _ = benchmark(projection.get_xy_array, lats, lons, bounds, (1280, 800))
+    assert len(x) == N
@@ -6,6 +6,7 @@ on a map using TrackingViz objects.
 from __future__ import annotations
 
 from osmviz.animation import Simulation, TrackingViz
+from osmviz.trajectory import Trajectory
 
 # The goal is to show 10 trains racing eastward across the US.
 
@@ -24,35 +25,18 @@ num_trains = 10
 track_vizs = []
 
 
-def make_interpolator(begin_ll, end_ll, begin_t, end_t):
-    def ret(t):
-        if t < begin_t:
-            return begin_ll
-        elif t > end_t:
-            return end_ll
-        else:
-            blat, blon = begin_ll
-            elat, elon = end_ll
-            frac = float(t) / (end_t - begin_t)
-            return blat + frac * (elat - blat), blon + frac * (elon - blon)
-
-    return ret
-
-
 for i in range(num_trains):
     lat = bottom_lat + i * (top_lat - bottom_lat) / (num_trains - 1)
 
-    loc_at_time = make_interpolator(
-        (lat, left_lon), (lat, right_lon), begin_time, end_time
-    )
+    # Where the train is at each time; positions in between are interpolated
+    track = Trajectory([(begin_time, lat, left_lon), (end_time, lat, right_lon)])
 
     tviz = TrackingViz(
         f"Train {i+1}",
         image_f,
-        loc_at_time,
-        (begin_time, end_time),
-        (30, 46, -119, -68.5),
-        1,
+        track,
+        bounding_box=(30, 46, -119, -68.5),
+        drawing_order=1,
     )  # drawing order doesn't really matter here
 
     track_vizs.append(tviz)
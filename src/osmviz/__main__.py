@@ -0,0 +1,159 @@
+"""
+Command line interface:
+
+    python -m osmviz seed --bbox MIN_LAT MAX_LAT MIN_LON MAX_LON --zoom 10-14
+
+Run with --help for all options.
+"""
+
+# Copyright (c) 2010 Colin Bick, Robert Damphousse
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+from __future__ import annotations
+
+import argparse
+import json
+
+from .cache import DiskTileCache, MBTilesTileStore, TileStore
+from .manager import ImageManager, OSMManager
+
+
+def zoom_range(value: str) -> list[int]:
+    """
+    Parses "12" or "10-14" into a list of zoom levels.
+    """
+    first, _, last = value.partition("-")
+    try:
+        return list(range(int(first), int(last or first) + 1))
+    except ValueError:
+        msg = f"invalid zoom range: {value!r}"
+        raise argparse.ArgumentTypeError(msg)
+
+
+def polygon_file(filename: str) -> list[list[tuple[float, float]]]:
+    """
+    Reads a JSON file of a polygon, a list of [lat, lon] points, or of a
+    list of polygons, into a list of polygons.
+    """
+    try:
+        with open(filename) as f:
+            polygons = json.load(f)
+        if polygons and not isinstance(polygons[0][0], list):
+            polygons = [polygons]
+        polygons = [[(float(lat), float(lon)) for lat, lon in p] for p in polygons]
+    except (OSError, ValueError, TypeError, IndexError) as e:
+        msg = f"invalid polygon file {filename!r}: {e}"
+        raise argparse.ArgumentTypeError(msg)
+    if not all(len(polygon) >= 3 for polygon in polygons):
+        msg = f"invalid polygon file {filename!r}: polygons need 3 points or more"
+        raise argparse.ArgumentTypeError(msg)
+    return polygons
+
+
+def seed(args) -> int:
+    boxes = [tuple(args.bbox)] if args.bbox else []
+    polygons = [polygon for polygons in args.polygons or [] for polygon in polygons]
+
+    tile_store: TileStore | None
+    if args.mbtiles:
+        tile_store = MBTilesTileStore(args.mbtiles)
+    elif args.disk_cache:
+        tile_store = DiskTileCache(args.disk_cache)
+    else:
+        tile_store = None
+
+    osm = OSMManager(
+        image_manager=ImageManager(),
+        cache=args.cache,
+        server=args.server,
+        url=args.url,
+        scale=args.scale,
+        workers=args.workers,
+        max_per_host=args.workers,
+        tile_store=tile_store,
+    )
+    try:
+        report = osm.seed_tiles(
+            args.zoom,
+            boxes,
+            polygons,
+            rate=args.rate,
+            progress_file=args.progress_file,
+        )
+    finally:
+        osm.close()
+        if tile_store is not None:
+            tile_store.close()
+    return 1 if report.failed else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m osmviz")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    seed_parser = subparsers.add_parser(
+        "seed", help="download the tiles of an area ahead of time"
+    )
+    seed_parser.add_argument(
+        "--bbox",
+        nargs=4,
+        type=float,
+        metavar=("MIN_LAT", "MAX_LAT", "MIN_LON", "MAX_LON"),
+        help="bounding box to seed",
+    )
+    seed_parser.add_argument(
+        "--polygons",
+        action="append",
+        type=polygon_file,
+        metavar="FILE",
+        help="JSON file of a polygon ([[lat, lon], ...]) or a list of polygons",
+    )
+    seed_parser.add_argument(
+        "--zoom", type=zoom_range, required=True, help="zoom level(s), e.g. 10-14"
+    )
+    seed_parser.add_argument("--server", help="tile server URL")
+    seed_parser.add_argument(
+        "--url",
+        action="append",
+        help="tile URL template, may use {a|b|c} for mirrors; repeat for more mirrors",
+    )
+    seed_parser.add_argument("--scale", type=int, help="high-resolution scale")
+    seed_parser.add_argument("--cache", help="directory of flat tile files")
+    store_group = seed_parser.add_mutually_exclusive_group()
+    store_group.add_argument("--disk-cache", help="DiskTileCache directory")
+    store_group.add_argument("--mbtiles", help="MBTiles file")
+    seed_parser.add_argument(
+        "--workers", type=int, default=2, help="concurrent downloads (default 2)"
+    )
+    seed_parser.add_argument(
+        "--rate", type=float, help="maximum number of tiles downloaded per second"
+    )
+    seed_parser.add_argument(
+        "--progress-file", help="file recording progress, to resume a seed"
+    )
+    seed_parser.set_defaults(func=seed)
+
+    args = parser.parse_args(argv)
+    if args.command == "seed" and not (args.bbox or args.polygons):
+        seed_parser.error("nothing to seed: give --bbox and/or --polygons")
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,189 @@
+"""
+An asyncio interface to OSMManager, for use in event loops:
+  - Downloads and decoding run in a thread pool, so the loop never blocks
+  - A semaphore limits the number of tiles downloading at once
+  - Each tile download has a timeout, and any call can be cancelled
+
+Many renders can be in flight at once: their tiles download concurrently,
+while their images are assembled one at a time by the image manager.
+
+    async with AsyncOSMManager(image_manager=PILImageManager("RGB")) as osm:
+        img, bounds = await osm.create_osm_image(bounds, zoom)
+"""
+
+# Copyright (c) 2010 Colin Bick, Robert Damphousse
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .manager import OSMManager
+
+
+class AsyncOSMManager:
+    """
+    Wraps an OSMManager with coroutines for fetching tiles and creating
+    images. The OSMManager itself is available as osm_manager, for its
+    other (non-blocking) methods.
+
+    A download which times out or is cancelled is abandoned rather than
+    interrupted: its thread runs on until the connection pool's socket
+    timeout, but nothing waits for it.
+    """
+
+    def __init__(self, concurrency=8, timeout=30.0, executor=None, **kwargs) -> None:
+        """
+        Creates an AsyncOSMManager.
+        Arguments:
+            concurrency - maximum number of tiles downloading at once.
+            timeout - seconds to wait for each tile, or None to wait
+                 as long as it takes.
+            executor - concurrent.futures.Executor in which to download
+                 and decode tiles. Default: a new thread pool of
+                 concurrency threads, owned by this manager.
+            Other keyword arguments are as for OSMManager.
+        """
+        self.osm_manager = OSMManager(**kwargs)
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(concurrency)
+        if executor:
+            self.executor = executor
+            self._owns_executor = False
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=concurrency)
+            self._owns_executor = True
+        # The image manager holds one image at a time
+        self._image_lock = threading.Lock()
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def fetch_tile(self, tile_coord, zoom, timeout=None):
+        """
+        Given x, y coord of the tile, and the zoom level, retrieves the
+        tile if necessary, as OSMManager.retrieve_tile_image() does, and
+        returns its local filename (or file object).
+        timeout overrides the manager's timeout for this tile.
+        Raises TimeoutError (asyncio.TimeoutError before Python 3.11)
+        if the tile takes too long.
+        """
+        async with self._semaphore:
+            return await asyncio.wait_for(
+                self._run(self.osm_manager.retrieve_tile_image, tile_coord, zoom),
+                timeout or self.timeout,
+            )
+
+    async def fetch_tiles(self, tile_coords, zoom):
+        """
+        Given a collection of x, y tile coords and the zoom level,
+        retrieves all the tiles concurrently.
+        Returns a dict mapping each tile coord to its local filename (or
+        file object). If any tile fails, the others are cancelled.
+        """
+        tile_coords = list(tile_coords)
+        tasks = [
+            asyncio.ensure_future(self.fetch_tile(tile_coord, zoom))
+            for tile_coord in tile_coords
+        ]
+        try:
+            sources = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        return dict(zip(tile_coords, sources))
+
+    def _build_image(self, size, filenames, zoom, origin, crops=None):
+        """
+        Pastes the retrieved tiles into a new image, and returns it.
+        Runs in the executor.
+        """
+        manager = self.osm_manager.manager
+        with self._image_lock:
+            manager.prepare_image(*size)
+            try:
+                self.osm_manager._paste_tiles(
+                    list(filenames), zoom, origin, crops=crops, filenames=filenames
+                )
+                return manager.get_image()
+            finally:
+                # The image now belongs to the caller
+                manager.destroy_image()
+
+    async def create_osm_image(self, bounds, zoom):
+        """
+        Given bounding lat_lons (in degrees), and an OSM zoom level,
+        creates an image constructed from OSM tiles.
+        Returns (img, bounds) as OSMManager.create_osm_image() does.
+        """
+        osm = self.osm_manager
+        start = time.perf_counter()
+        min_x, min_y, max_x, max_y = osm.get_tile_range(bounds, zoom)
+        size, new_bounds = osm.get_osm_image_bounds(bounds, zoom)
+        tile_coords = [
+            (x, y) for x in range(min_x, max_x + 1) for y in range(min_y, max_y + 1)
+        ]
+        # Tiles retrieved first must stay in the store until pasted
+        keys = [osm.get_tile_key(tile_coord, zoom) for tile_coord in tile_coords]
+        with osm.tile_store.pin_tiles(keys):
+            filenames = await self.fetch_tiles(tile_coords, zoom)
+            img = await self._run(
+                self._build_image, size, filenames, zoom, (min_x, min_y)
+            )
+        osm.stats.add_time("render", time.perf_counter() - start)
+        return img, new_bounds
+
+    async def render_osm_image(self, bounds, size, zoom=None, max_zoom=19):
+        """
+        Given bounding lat_lons (in degrees) and an image (width, height)
+        in pixels, creates an image of exactly that size covering exactly
+        those bounds, as OSMManager.render_osm_image() does.
+        """
+        osm = self.osm_manager
+        start = time.perf_counter()
+        if zoom is None:
+            zoom = osm.get_render_zoom(bounds, size, max_zoom)
+        crops = osm.get_render_crops(bounds, size, zoom)
+        keys = [osm.get_tile_key(tile_coord, zoom) for tile_coord in crops]
+        with osm.tile_store.pin_tiles(keys):
+            filenames = await self.fetch_tiles(crops, zoom)
+            img = await self._run(self._build_image, size, filenames, zoom, None, crops)
+        osm.stats.add_time("render", time.perf_counter() - start)
+        return img
+
+    def close(self) -> None:
+        """
+        Closes the OSMManager's connections, and shuts down the executor
+        if this manager created it.
+        """
+        self.osm_manager.close()
+        if self._owns_executor:
+            self.executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.close()
@@ -4,7 +4,9 @@ OpenStreetMap Animation Tool:
   - Requires pygame.
 
 Basic idea:
-  1. Create TrackingViz objects or your own custom SimViz's
+  1. Create TrackingViz objects, a TrackingVizGroup for many objects
+     (or a PagedTrackingViz for logs too large for memory), or your own
+     custom SimViz's
   2. Create a Simulation object with those Viz's
   3. Call the Simulation's run() method
   4. Run the simulation:
@@ -51,12 +53,21 @@ Keyboard input is accepted to control the speed of the simulation.
 # THE SOFTWARE.
 from __future__ import annotations
 
+import itertools
+import subprocess
 import time
+from bisect import bisect_left, bisect_right
+from collections import deque
+from collections.abc import Iterator
 from functools import reduce
+from operator import itemgetter
+from typing import IO, cast
 
 import pygame
 
+from . import projection
 from .manager import OSMManager, PygameImageManager
+from .trajectory import Trajectory
 
 Inf = float("inf")
 
@@ -143,6 +154,37 @@ class SimViz:
         """
         raise NotImplementedError
 
+    def get_screen_rect(self):
+        """
+        To be overridden (optionally).
+        Returns the (x, y, width, height) rectangle of the surface
+        outside of which mouse_intersect() is always False, in the
+        current state. Default behavior is to return None, meaning
+        unknown, so that the Simulation tests every mouse position.
+        """
+        return
+
+    def get_screen_rects(self):
+        """
+        To be overridden (optionally).
+        Returns the list of (x, y, width, height) tuples of the parts
+        which draw_to_surface() draws, such as the objects of a group, in
+        the current state, so that Simulation.update_frame() can redraw
+        them apart. Default behavior is to return [get_screen_rect()], or
+        None if that is None, meaning unknown.
+        """
+        rect = self.get_screen_rect()
+        return None if rect is None else [tuple(rect)]
+
+    def draw_parts_to_surface(self, surf, parts):
+        """
+        To be overridden (optionally).
+        Draws the parts of this viz with the given indices in the list
+        returned by get_screen_rects(), as draw_to_surface() does.
+        Default behavior is to draw the whole viz.
+        """
+        self.draw_to_surface(surf)
+
 
 class TrackingViz(SimViz):
     """
@@ -151,11 +193,11 @@ class TrackingViz(SimViz):
 
     def __init__(
         self,
-        label: str,
+        label: str | None,
         image: str,
         get_lat_lon_at_time_func,
-        time_window: tuple[float, float],
-        bounding_box: tuple[float, float, float, float],
+        time_window: tuple[float, float] | None = None,
+        bounding_box: tuple[float, float, float, float] | None = None,
         drawing_order: int = 0,
     ) -> None:
         """
@@ -164,11 +206,15 @@ class TrackingViz(SimViz):
             label - text to display when moused over, or None for no text
             image - filename of image to display on map
             get_lat_lon_at_time_func - a function that takes one argument (time)
-                 and returns (lat, lon)
+                 and returns (lat, lon), or a Trajectory. A Trajectory is
+                 faster, as it projects its fixes once and interpolates
+                 pixel positions from them.
             time_window - a tuple (begin_time, end_time) representing the times
-                 this object exists
+                 this object exists. May be None for a Trajectory, to use its
+                 time interval.
             bounding_box - a tuple (min_lat, max_lat, min_lon, max_lon)
-                 representing the farthest bounds that this object will reach
+                 representing the farthest bounds that this object will reach.
+                 May be None for a Trajectory, to use its bounding box.
             drawing_order - see SimViz.get_drawing_order()
         """
         SimViz.__init__(self, drawing_order)
@@ -176,6 +222,14 @@ class TrackingViz(SimViz):
         self.image = pygame.image.load(image)
         self.width = self.image.get_rect().width
         self.height = self.image.get_rect().height
+        self.trajectory: Trajectory | None = None
+        if isinstance(get_lat_lon_at_time_func, Trajectory):
+            self.trajectory = get_lat_lon_at_time_func
+            time_window = time_window or self.trajectory.get_time_interval()
+            bounding_box = bounding_box or self.trajectory.get_bounding_box()
+        if time_window is None or bounding_box is None:
+            msg = "time_window and bounding_box are needed without a Trajectory"
+            raise ValueError(msg)
         self.time_window = time_window
         self.bounding_box = bounding_box
         self.get_location_at_time = get_lat_lon_at_time_func
@@ -190,6 +244,9 @@ class TrackingViz(SimViz):
         return self.label
 
     def set_state(self, sim_time, get_xy) -> None:
+        if self.trajectory is not None:
+            self.xy = self.trajectory.get_xy_at_time(sim_time, get_xy)
+            return
         self.xy = None
         ll = self.get_location_at_time(sim_time)
         if ll is None:
@@ -211,6 +268,499 @@ class TrackingViz(SimViz):
         w, h = self.width, self.height
         return abs(x - mouse_x) < w / 2 and abs(y - mouse_y) < h / 2
 
+    def get_screen_rect(self):
+        if not self.xy:
+            return 0, 0, 0, 0
+        x, y = self.xy
+        w, h = self.width, self.height
+        return x - w / 2, y - h / 2, w, h
+
+
+class TrackingVizGroup(SimViz):
+    """
+    A SimViz which displays many moving images on the map, as many
+    TrackingViz's would, for fleets of thousands of objects.
+
+    Each object follows a track of (time, lat, lon) samples, between which
+    its position is interpolated linearly. All the tracks are held in
+    NumPy arrays, so that the positions of all the objects are
+    interpolated, projected and drawn at once, and each image file is
+    loaded only once. Finding the samples around a time costs a binary
+    search per object, however long the tracks. Requires NumPy.
+    """
+
+    def __init__(self, tracks, image, labels=None, drawing_order: int = 0) -> None:
+        """
+        Constructs a TrackingVizGroup.
+        Arguments:
+            tracks - a sequence of tracks, one per object, each an array of
+                 (time, lat, lon) rows in increasing time order. An object
+                 exists from the time of its first row to that of its last.
+            image - filename of the image to display for every object, or a
+                 sequence of filenames, one per object
+            labels - a sequence of text to display when each object is
+                 moused over (or None for no text), one per object, or
+                 None for no labels at all
+            drawing_order - see SimViz.get_drawing_order(). Within the
+                 group, objects are drawn in the order of tracks.
+        """
+        SimViz.__init__(self, drawing_order)
+        try:
+            import numpy
+        except ImportError:
+            msg = "NumPy could not be imported!"
+            raise ImportError(msg)
+        self.numpy = numpy
+
+        arrays = [numpy.asarray(track, float).reshape(-1, 3) for track in tracks]
+        lengths = numpy.array([len(array) for array in arrays], numpy.intp)
+        if not len(arrays) or not lengths.all():
+            msg = "Each track needs at least one (time, lat, lon) row"
+            raise ValueError(msg)
+        samples = numpy.concatenate(arrays)
+        self.times = numpy.ascontiguousarray(samples[:, 0])
+        self.lats = numpy.ascontiguousarray(samples[:, 1])
+        self.lons = numpy.ascontiguousarray(samples[:, 2])
+        # Indices of the first and last samples of each track
+        self.firsts = numpy.cumsum(lengths) - lengths
+        self.lasts = self.firsts + lengths - 1
+        steps = numpy.diff(self.times)
+        steps[self.lasts[:-1]] = 0  # from one track to the next
+        if (steps < 0).any():
+            msg = "Each track must be in increasing time order"
+            raise ValueError(msg)
+        self.begins = self.times[self.firsts]
+        self.ends = self.times[self.lasts]
+        # Sorted (track, time) keys of the samples, as one float each: the
+        # time from the earliest sample, plus an offset per track greater
+        # than any such time, so all the tracks are searched at once
+        self._t0 = float(self.begins.min())
+        stride = float(self.ends.max()) - self._t0 + 1
+        self._offsets = numpy.arange(len(arrays)) * stride
+        self._keys = numpy.repeat(self._offsets, lengths) + (self.times - self._t0)
+
+        names = [image] * len(arrays) if isinstance(image, str) else list(image)
+        if len(names) != len(arrays):
+            msg = "image needs one filename per track"
+            raise ValueError(msg)
+        icon_numbers: dict[str, int] = {}
+        self.icon_index = numpy.array(
+            [icon_numbers.setdefault(name, len(icon_numbers)) for name in names],
+            numpy.intp,
+        )
+        self.icons = [pygame.image.load(name) for name in icon_numbers]
+        sizes = numpy.array([icon.get_size() for icon in self.icons], float)
+        self.width = sizes[self.icon_index, 0]
+        self.height = sizes[self.icon_index, 1]
+        self.half_width = self.width / 2
+        self.half_height = self.height / 2
+
+        self.labels = [None] * len(arrays) if labels is None else list(labels)
+        if len(self.labels) != len(arrays):
+            msg = "labels needs one label per track"
+            raise ValueError(msg)
+        self.labelled = numpy.array([bool(label) for label in self.labels])
+
+        # The objects present in the current state, and where they are
+        self.index = numpy.zeros(0, numpy.intp)
+        self.x = self.y = numpy.zeros(0)
+        self.selected = None
+
+    def get_time_interval(self):
+        return float(self.begins.min()), float(self.ends.max())
+
+    def get_bounding_box(self):
+        return (
+            float(self.lats.min()),
+            float(self.lats.max()),
+            float(self.lons.min()),
+            float(self.lons.max()),
+        )
+
+    def get_label(self):
+        """
+        Returns the label of the object found by the last call to
+        mouse_intersect(), or None.
+        """
+        if self.selected is None:
+            return None
+        return self.labels[self.selected]
+
+    def get_lat_lon_at_time(self, sim_time):
+        """
+        Returns (index, lat, lon): arrays of the index of each object
+        existing at sim_time, and its interpolated position.
+        """
+        np = self.numpy
+        index = np.flatnonzero((self.begins <= sim_time) & (sim_time <= self.ends))
+        # The last sample of each track at or before sim_time, and the next
+        keys = self._offsets[index] + (sim_time - self._t0)
+        i = np.searchsorted(self._keys, keys, side="right") - 1
+        # Rounding may have merged the key of sim_time with those of
+        # samples just after it: step back over them
+        while True:
+            after = self.times[i] > sim_time
+            if not after.any():
+                break
+            i -= after
+        j = np.minimum(i + 1, self.lasts[index])
+        t0 = self.times[i]
+        span = self.times[j] - t0
+        fraction = np.divide(
+            sim_time - t0, span, out=np.zeros(len(index)), where=span > 0
+        )
+        lat = self.lats[i] + fraction * (self.lats[j] - self.lats[i])
+        lon = self.lons[i] + fraction * (self.lons[j] - self.lons[i])
+        return index, lat, lon
+
+    def set_state(self, sim_time, get_xy) -> None:
+        """
+        Interpolates and projects the positions of all the objects. get_xy
+        is projected over whole arrays if it has an array attribute, as
+        given by Simulation.make_get_xy(), and point by point otherwise.
+        """
+        np = self.numpy
+        self.index, lat, lon = self.get_lat_lon_at_time(sim_time)
+        get_xy_array = getattr(get_xy, "array", None)
+        if get_xy_array is not None:
+            self.x, self.y = get_xy_array(lat, lon)
+        else:
+            xy = [get_xy(*ll) for ll in zip(lat.tolist(), lon.tolist())]
+            self.x, self.y = np.array(xy, float).reshape(-1, 2).T
+
+    def draw_to_surface(self, surf) -> None:
+        self._draw(surf, self.index, self.x, self.y)
+
+    def draw_parts_to_surface(self, surf, parts) -> None:
+        """
+        Draws the objects at the given positions in the current state
+        (those of get_screen_rects()).
+        """
+        self._draw(surf, self.index[parts], self.x[parts], self.y[parts])
+
+    def _draw(self, surf, index, x, y) -> None:
+        left = (x - self.half_width[index]).tolist()
+        top = (y - self.half_height[index]).tolist()
+        icons: Iterator[pygame.Surface]
+        if len(self.icons) == 1:
+            icons = itertools.repeat(self.icons[0])
+        else:
+            icons = map(self.icons.__getitem__, self.icon_index[index].tolist())
+        surf.blits(zip(icons, zip(left, top)), doreturn=False)
+
+    def mouse_intersect(self, mouse_x, mouse_y):
+        """
+        Returns True if the given mouse location is over a labelled
+        object, and selects the last drawn such object for get_label().
+        """
+        index = self.index
+        over = (
+            self.labelled[index]
+            & (abs(self.x - mouse_x) < self.half_width[index])
+            & (abs(self.y - mouse_y) < self.half_height[index])
+        )
+        found = self.numpy.flatnonzero(over)
+        self.selected = int(index[found[-1]]) if len(found) else None
+        return self.selected is not None
+
+    def get_screen_rects(self):
+        """
+        Returns the rectangle of each object, in the order drawn.
+        """
+        index = self.index
+        return list(
+            zip(
+                (self.x - self.half_width[index]).tolist(),
+                (self.y - self.half_height[index]).tolist(),
+                self.width[index].tolist(),
+                self.height[index].tolist(),
+            )
+        )
+
+
+class PagedTrackingViz(SimViz):
+    """
+    A TrackingVizGroup of all the objects in a readers.FixPages, holding
+    only the page of fixes for the current time in memory. Each page is
+    loaded when the simulation time moves into it, so that a long replay
+    never has to fit in memory. Requires NumPy.
+    """
+
+    def __init__(self, pages, image, labels: bool = True, drawing_order: int = 0):
+        """
+        Constructs a PagedTrackingViz.
+        Arguments:
+            pages - readers.FixPages of the objects' fixes
+            image - filename of the image to display for every object
+            labels - whether to label each object with its id
+            drawing_order - see SimViz.get_drawing_order()
+        """
+        SimViz.__init__(self, drawing_order)
+        self.pages = pages
+        self.image = image
+        self.labels = labels
+        # The current page number, and a group of its objects (or None)
+        self.page = None
+        self.group: TrackingVizGroup | None = None
+
+    def get_time_interval(self):
+        return self.pages.time_window
+
+    def get_bounding_box(self):
+        return self.pages.bounding_box
+
+    def get_label(self):
+        return self.group.get_label() if self.group else None
+
+    def set_state(self, sim_time, get_xy) -> None:
+        page = self.pages.get_page_number(sim_time)
+        if page != self.page:
+            self.page = page
+            self.group = None
+            tracks = self.pages.get_page(page)
+            if tracks:
+                ids, fixes = zip(*tracks)
+                labels = [str(object_id) for object_id in ids] if self.labels else None
+                self.group = TrackingVizGroup(fixes, self.image, labels)
+        if self.group:
+            self.group.set_state(sim_time, get_xy)
+
+    def draw_to_surface(self, surf) -> None:
+        if self.group:
+            self.group.draw_to_surface(surf)
+
+    def mouse_intersect(self, mouse_x, mouse_y):
+        return bool(self.group) and self.group.mouse_intersect(mouse_x, mouse_y)
+
+    def get_screen_rects(self):
+        return self.group.get_screen_rects() if self.group else []
+
+    def draw_parts_to_surface(self, surf, parts) -> None:
+        if self.group:
+            self.group.draw_parts_to_surface(surf, parts)
+
+
+def _tobytes(surface) -> bytes:
+    """Returns the pixels of a surface as RGB bytes"""
+    # pygame.image.tostring() was renamed in Pygame 2.1.3
+    tobytes = getattr(pygame.image, "tobytes", None) or pygame.image.tostring
+    return tobytes(surface, "RGB")
+
+
+class _TimeIndex:
+    """
+    Tracks which of a list of (begin, end) time intervals contain the
+    current time, updating only the intervals beginning or ending
+    between one time and the next.
+    """
+
+    def __init__(self, intervals) -> None:
+        self.intervals = intervals
+        self.by_begin = sorted(range(len(intervals)), key=lambda i: intervals[i][0])
+        self.begins = [intervals[i][0] for i in self.by_begin]
+        self.by_end = sorted(range(len(intervals)), key=lambda i: intervals[i][1])
+        self.ends = [intervals[i][1] for i in self.by_end]
+        self.time = None
+        self.live: set[int] = set()
+        self._sorted: list[int] | None = None
+
+    def get_live(self, time):
+        """
+        Returns the sorted indices of the intervals containing time.
+        """
+        old = self.time
+        if old is None:
+            self.live = {
+                i
+                for i, (begin, end) in enumerate(self.intervals)
+                if begin <= time <= end
+            }
+            self._sorted = None
+        elif time > old:
+            # Leaving: ending in [old, time). Entering: beginning in (old, time]
+            first = bisect_left(self.ends, old)
+            last = bisect_left(self.ends, time)
+            self.live.difference_update(self.by_end[first:last])
+            first = bisect_right(self.begins, old)
+            last = bisect_right(self.begins, time)
+            self.live.update(
+                i for i in self.by_begin[first:last] if self.intervals[i][1] >= time
+            )
+            self._sorted = None
+        elif time < old:
+            # Leaving: beginning in (time, old]. Entering: ending in [time, old)
+            first = bisect_right(self.begins, time)
+            last = bisect_right(self.begins, old)
+            self.live.difference_update(self.by_begin[first:last])
+            first = bisect_left(self.ends, time)
+            last = bisect_left(self.ends, old)
+            self.live.update(
+                i for i in self.by_end[first:last] if self.intervals[i][0] <= time
+            )
+            self._sorted = None
+        self.time = time
+        if self._sorted is None:
+            self._sorted = sorted(self.live)
+        return self._sorted
+
+
+class _HitGrid:
+    """
+    A grid of square cells over a surface, listing the vizs whose
+    screen rectangle starts in each cell, for finding the vizs
+    under the mouse without testing every one.
+    """
+
+    def __init__(self, vizs, cell_size: int = 64) -> None:
+        """
+        vizs is a list of (drawing position, viz), in their current state.
+        """
+        self.cell_size = cell_size
+        self.cells: dict[tuple[int, int], list] = {}
+        # Vizs with no known rectangle, tested everywhere
+        self.everywhere: list = []
+        # Largest rectangle, bounding how far back from the mouse to look
+        self.max_w = self.max_h = 0
+        for order, sviz in vizs:
+            rect = sviz.get_screen_rect()
+            if rect is None:
+                self.everywhere.append((order, sviz))
+                continue
+            x, y, w, h = rect
+            if w <= 0 or h <= 0:
+                continue
+            self.max_w = max(self.max_w, w)
+            self.max_h = max(self.max_h, h)
+            key = (int(x // cell_size), int(y // cell_size))
+            cell = self.cells.get(key)
+            if cell is None:
+                self.cells[key] = [(order, sviz)]
+            else:
+                cell.append((order, sviz))
+
+    def find(self, x, y):
+        """
+        Returns the viz drawn last of those under (x, y), or None.
+        """
+        size = self.cell_size
+        candidates = list(self.everywhere)
+        for cx in range(int((x - self.max_w) // size), int(x // size) + 1):
+            for cy in range(int((y - self.max_h) // size), int(y // size) + 1):
+                candidates += self.cells.get((cx, cy), ())
+        found = None
+        for order, sviz in candidates:
+            if found is not None and order < found[0]:
+                continue
+            if sviz.mouse_intersect(x, y) and sviz.get_label():
+                found = order, sviz
+        return found and found[1]
+
+
+def _percentiles(values) -> dict:
+    """Returns the 50th, 90th and 99th percentiles and maximum of values"""
+    ordered = sorted(values)
+    if not ordered:
+        return {"p50": 0.0, "p90": 0.0, "p99": 0.0, "max": 0.0}
+    last = len(ordered) - 1
+    # Nearest rank
+    return {
+        "p50": ordered[round(last * 0.50)],
+        "p90": ordered[round(last * 0.90)],
+        "p99": ordered[round(last * 0.99)],
+        "max": ordered[last],
+    }
+
+
+class FrameClock:
+    """
+    Paces a loop at a target frame rate, as pygame.time.Clock does, and
+    measures the frames actually achieved.
+
+    Each call to tick() waits until the next frame is due, and returns the
+    wall time elapsed since the last one, by which to advance animations
+    so that they keep pace with wall time whatever the frame rate. When a
+    frame takes longer than a whole period, the frames missed are skipped
+    rather than rushed through to catch up.
+    """
+
+    def __init__(
+        self,
+        fps: float = 10.0,
+        history: int = 1000,
+        clock=time.perf_counter,
+        sleep=time.sleep,
+    ) -> None:
+        """
+        Creates a FrameClock.
+        Arguments:
+            fps - target number of frames per second
+            history - number of recent frames to keep times of, for
+                 get_fps() and get_stats()
+            clock - function returning the current time in seconds
+            sleep - function sleeping for a number of seconds
+        """
+        if fps <= 0:
+            msg = "fps must be positive"
+            raise ValueError(msg)
+        self.period = 1.0 / fps
+        self._clock = clock
+        self._sleep = sleep
+        # Seconds between frames, and of work in each frame (not sleeping)
+        self.frame_times: deque[float] = deque(maxlen=history)
+        self.work_times: deque[float] = deque(maxlen=history)
+        self.frames = 0
+        self.skipped = 0
+        # When the last tick() returned, and when the next frame is due
+        self._last = None
+        self._due = 0.0
+
+    def tick(self) -> float:
+        """
+        Waits until the next frame is due, and returns the seconds since
+        the last call returned (0.0 on the first call).
+        """
+        now = self._clock()
+        if self._last is None:
+            self._last = now
+            self._due = now + self.period
+            return 0.0
+        self.work_times.append(now - self._last)
+        if now < self._due:
+            self._sleep(self._due - now)
+            now = self._clock()
+        elif now - self._due >= self.period:
+            # Too late for whole frames: drop them, keeping to the beat
+            missed = int((now - self._due) // self.period)
+            self.skipped += missed
+            self._due += missed * self.period
+        self._due += self.period
+        elapsed = now - self._last
+        self._last = now
+        self.frame_times.append(elapsed)
+        self.frames += 1
+        return elapsed
+
+    def get_fps(self) -> float:
+        """
+        Returns the frames per second achieved over the recent frames.
+        """
+        total = sum(self.frame_times)
+        return len(self.frame_times) / total if total else 0.0
+
+    def get_stats(self) -> dict:
+        """
+        Returns a dict of the number of frames drawn and skipped, the
+        frames per second achieved, and the percentiles (p50, p90, p99
+        and max) of the recent frame times and work times in seconds.
+        """
+        return {
+            "frames": self.frames,
+            "skipped": self.skipped,
+            "fps": self.get_fps(),
+            "frame_time": _percentiles(self.frame_times),
+            "work_time": _percentiles(self.work_times),
+        }
+
 
 class Simulation:
     """
@@ -219,7 +769,7 @@ class Simulation:
     method is provided which displays the simulation in a pygame window.
     """
 
-    def __init__(self, actor_vizs, scene_vizs, init_time: int = 0) -> None:
+    def __init__(self, actor_vizs, scene_vizs, init_time: float = 0) -> None:
         """
         Given two collections of generic SimViz objects, and optionally an
         initial time, creates a Simulation object.
@@ -227,6 +777,9 @@ class Simulation:
         objects. The difference is that the actor_vizs will determine the
         bounds of the animation in space and time, while the location and
         time windows of the scene_vizs will be largely ignored.
+        Actors are only set, drawn and tested for the mouse during their
+        time interval. Changes to the collections after this point are
+        not seen by the Simulation.
         """
         self.actor_vizs = actor_vizs
         self.scene_vizs = scene_vizs
@@ -234,8 +787,17 @@ class Simulation:
         self.__find_bounding_box()
         self.__find_time_window()
         self.__sort_vizs()
-
-        self.time = 10000
+        self.__index_vizs()
+        # (time, get_xy, live vizs) of the last frame drawn, and its grid
+        self._frame = None
+        self._hit_grid = None
+        self._queries = 0
+        # (surface, background, {drawing position: rects}) of update_frame()
+        self._drawn: (
+            tuple[pygame.Surface, pygame.Surface, dict[int, list[tuple]]] | None
+        ) = None
+
+        self.time: float = 10000
         self.set_time(init_time)
 
     def __find_bounding_box(self) -> None:
@@ -271,6 +833,16 @@ class Simulation:
 
         self.all_vizs.sort(key=key_function)
 
+    def __index_vizs(self) -> None:
+        """Indexes the vizs by time interval, scene vizs being always present"""
+        actors = {id(viz) for viz in self.actor_vizs}
+        self._time_index = _TimeIndex(
+            [
+                viz.get_time_interval() if id(viz) in actors else (-Inf, Inf)
+                for viz in self.all_vizs
+            ]
+        )
+
     def set_time(self, time) -> None:
         """
         Moves all bus tracks to the given time.
@@ -288,10 +860,328 @@ class Simulation:
         Given coordinates in lon, lat, and a screen size,
         returns the corresponding (x, y) pixel coordinates.
         """
-        x_ratio = (lon - bounds[2]) / (bounds[3] - bounds[2])
-        y_ratio = 1.0 - ((lat - bounds[0]) / (bounds[1] - bounds[0]))
-        x, y = int(x_ratio * screen_size[0]), int(y_ratio * screen_size[1])
-        return x, y
+        return projection.get_xy(lat, lon, bounds, screen_size)
+
+    def get_xy_array(self, lat, lon, bounds, screen_size):
+        """
+        Given NumPy arrays of lat and lon, and a screen size, returns
+        arrays of the corresponding x and y pixel coordinates.
+        """
+        return projection.get_xy_array(lat, lon, bounds, screen_size)
+
+    def make_get_xy(self, bounds, screen_size):
+        """
+        Returns a get_xy function of (lat, lon) for draw_frame(), given
+        the bounds and size of the screen. Its array attribute is the same
+        function on NumPy arrays, for vizs which project in bulk.
+        """
+
+        def get_xy(lat, lon):
+            return self.get_xy(lat, lon, bounds, screen_size)
+
+        def get_xy_array(lat, lon):
+            return self.get_xy_array(lat, lon, bounds, screen_size)
+
+        get_xy.array = get_xy_array
+        return get_xy
+
+    def draw_frame(self, surface, background, get_xy, mouse_pos=None):
+        """
+        Draws the simulation at the current time on surface: the
+        background (a surface, or None) and then each viz, in drawing
+        order. get_xy is a function of (lat, lon) returning the pixel
+        coordinates on surface.
+        Returns the last drawn viz with a label under mouse_pos, an
+        (x, y) position on surface, or None.
+        """
+        if background is not None:
+            surface.blit(background, (0, 0))
+        live = self._time_index.get_live(self.time)
+        all_vizs = self.all_vizs
+        for order in live:
+            sviz = all_vizs[order]
+            sviz.set_state(self.time, get_xy)
+            sviz.draw_to_surface(surface)
+        if self._drawn is not None and self._drawn[0] is surface:
+            # update_frame() no longer knows what is on surface
+            self._drawn = None
+        return self.__end_frame(get_xy, live, mouse_pos)
+
+    def update_frame(
+        self,
+        surface,
+        background,
+        get_xy,
+        mouse_pos=None,
+        dirty=(),
+        max_dirty: float = 0.5,
+    ):
+        """
+        Draws the simulation at the current time on surface, as
+        draw_frame() does, but only redraws the regions which changed
+        since the last call: the old and new screen rectangles of each
+        viz which moved, appeared or disappeared, and the rectangles in
+        dirty (such as where a label was drawn on the last frame).
+        A viz is assumed to look the same while its screen rectangles (see
+        SimViz.get_screen_rects()) stay the same, and only its parts over
+        a changed region are redrawn.
+        Everything is redrawn on the first call, after draw_frame(), when
+        surface or background (which must be a surface) is a different
+        one, when a live viz's get_screen_rects() is None, or when the
+        changed regions add up to more than max_dirty of surface.
+        Returns (selected, rects) where selected is as for draw_frame(),
+        and rects is the list of rectangles of surface which changed, for
+        pygame.display.update(), or None if all of surface was redrawn.
+        """
+        live = self._time_index.get_live(self.time)
+        all_vizs = self.all_vizs
+        rects: dict[int, list[tuple]] | None = {}
+        for order in live:
+            sviz = all_vizs[order]
+            sviz.set_state(self.time, get_xy)
+            screen_rects = sviz.get_screen_rects()
+            if screen_rects is None:
+                rects = None
+            elif rects is not None:
+                rects[order] = screen_rects
+
+        changed: list[pygame.Rect] | None = None
+        if (
+            rects is not None
+            and self._drawn is not None
+            and self._drawn[0] is surface
+            and self._drawn[1] is background
+        ):
+            old = self._drawn[2]
+            # The parts which moved, appeared or disappeared
+            moved: set[tuple] = set()
+            for order, new_parts in rects.items():
+                old_parts = old.get(order, [])
+                if new_parts == old_parts:
+                    continue
+                if len(new_parts) + len(old_parts) <= 2:
+                    # One part, as for most vizs
+                    moved.update(new_parts + old_parts)
+                else:
+                    moved |= set(new_parts) ^ set(old_parts)
+            for order in old.keys() - rects.keys():
+                moved.update(old[order])
+            area = surface.get_rect()
+            limit = max_dirty * area.width * area.height
+            # Whole pixels covering each image wherever it is blitted: from
+            # one pixel left of and above its truncated rectangle, to two
+            # right of and below it
+            regions = itertools.chain(
+                (pygame.Rect(rect).inflate(3, 3) for rect in moved), dirty
+            )
+            changed = []
+            total = 0
+            for region in regions:
+                region = area.clip(region)
+                if region.width and region.height:
+                    changed.append(region)
+                    total += region.width * region.height
+                    if total > limit:
+                        # Stop as soon as a full redraw is cheaper
+                        changed = None
+                        break
+
+        # changed is only worked out with rects
+        if changed is None or rects is None:
+            if background is not None:
+                surface.blit(background, (0, 0))
+            for order in live:
+                all_vizs[order].draw_to_surface(surface)
+        else:
+            # Each region is redrawn whole, from the background up, with
+            # the parts of vizs over it (found with the same margin as
+            # above, their rectangles being truncated)
+            live_rects = []
+            parts = []
+            for order in live:
+                live_rects += rects[order]
+                parts += [(order, part) for part in range(len(rects[order]))]
+            for rect in changed:
+                surface.set_clip(rect)
+                surface.blit(background, rect, rect)
+                hits = [parts[i] for i in rect.inflate(4, 4).collidelistall(live_rects)]
+                for order, hit in itertools.groupby(hits, itemgetter(0)):
+                    all_vizs[order].draw_parts_to_surface(
+                        surface, [part for _, part in hit]
+                    )
+            surface.set_clip(None)
+        if rects is None or background is None:
+            self._drawn = None
+        else:
+            self._drawn = surface, background, rects
+        return self.__end_frame(get_xy, live, mouse_pos), changed
+
+    def __end_frame(self, get_xy, live, mouse_pos):
+        """Notes the frame drawn, and returns the viz under mouse_pos"""
+        frame = (self.time, get_xy, live)
+        if frame != self._frame:
+            # The grid is made on the second query of a frame, and kept
+            # while the vizs stay in the same state (as when paused)
+            self._frame = frame
+            self._hit_grid = None
+            self._queries = 0
+        if mouse_pos is None:
+            return None
+        return self.get_viz_at(*mouse_pos)
+
+    def get_viz_at(self, x, y):
+        """
+        Returns the last drawn viz whose mouse_intersect() is True at
+        (x, y) in the last frame drawn by draw_frame(), and which then has
+        a label, or None.
+        """
+        if self._frame is None:
+            return None
+        all_vizs = self.all_vizs
+        live = self._frame[2]
+        if self._hit_grid is None:
+            self._queries += 1
+            if self._queries == 1:
+                # A single query is cheaper as a scan, latest drawn first
+                for order in reversed(live):
+                    sviz = all_vizs[order]
+                    if sviz.mouse_intersect(x, y) and sviz.get_label():
+                        return sviz
+                return None
+            self._hit_grid = _HitGrid([(order, all_vizs[order]) for order in live])
+        return self._hit_grid.find(x, y)
+
+    def get_background(self, window_size, osm_zoom: int = 14, osm_manager=None):
+        """
+        Creates the map of the simulation's bounding box from OSM tiles at
+        zoom level osm_zoom, scaled down to fit within window_size.
+        osm_manager is the OSMManager to use, with a PygameImageManager.
+        Default None: one caching tiles in "maptiles/".
+        Returns (background, bounds, window_size) where background is a
+        surface, bounds is the (min_lat, max_lat, min_lon, max_lon) it
+        covers, and window_size is its size.
+        """
+        osm = osm_manager or OSMManager(
+            cache="maptiles/", image_manager=PygameImageManager()
+        )
+        bg_big, new_bounds = osm.create_osm_image(self.bounding_box, zoom=osm_zoom)
+        osm.manager.destroy_image()
+        w_h_ratio = float(bg_big.get_width()) / bg_big.get_height()
+        # Make the window smaller to keep proportions and stay within
+        # specified window_size
+        new_width = int(window_size[1] * w_h_ratio)
+        new_height = int(window_size[0] / w_h_ratio)
+        if new_width > window_size[0]:
+            window_size = window_size[0], new_height
+        elif new_height > window_size[1]:
+            window_size = new_width, window_size[1]
+
+        bg_small = pygame.transform.smoothscale(bg_big, window_size)
+        del bg_big
+        return bg_small, new_bounds, window_size
+
+    def render(
+        self,
+        output,
+        dt: float = 1.0,
+        start=None,
+        end=None,
+        window_size=(1280, 800),
+        osm_zoom: int = 14,
+        osm_manager=None,
+    ) -> int:
+        """
+        Renders the simulation off-screen, without a window, as fast as it
+        can be drawn: one frame every dt seconds of simulation time, from
+        start to end (default: the simulation's time window).
+        output is one of:
+            - a filename pattern, such as "frames/{:05d}.png", formatted
+              with each frame number to save a numbered image sequence
+            - a writable binary file, such as an encoder's stdin, to which
+              each frame is written as raw RGB (rgb24) bytes
+            - a function, called with (surface, frame number) for each frame
+        window_size, osm_zoom and osm_manager are as for get_background().
+        Labels are not drawn. Returns the number of frames rendered.
+        """
+        start = self.time_window[0] if start is None else start
+        end = self.time_window[1] if end is None else end
+        if dt <= 0 or abs(end - start) == Inf:
+            msg = "render() needs a positive dt and a finite start and end"
+            raise ValueError(msg)
+
+        if isinstance(output, str):
+
+            def write(surface, frame) -> None:
+                pygame.image.save(surface, output.format(frame))
+
+        elif callable(output):
+            write = output
+        else:
+
+            def write(surface, frame) -> None:
+                output.write(_tobytes(surface))
+
+        background, bounds, window_size = self.get_background(
+            window_size, osm_zoom, osm_manager
+        )
+        surface = pygame.Surface(window_size)
+        get_xy = self.make_get_xy(bounds, window_size)
+
+        frame = 0
+        # Computed from start each time, so that no error accumulates
+        while start + frame * dt <= end:
+            self.set_time(start + frame * dt)
+            self.draw_frame(surface, background, get_xy)
+            write(surface, frame)
+            frame += 1
+        return frame
+
+    def render_video(
+        self,
+        filename: str,
+        fps: float = 25,
+        ffmpeg: str = "ffmpeg",
+        ffmpeg_args=("-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-pix_fmt", "yuv420p"),
+        **kwargs,
+    ) -> int:
+        """
+        Renders the simulation off-screen (see render()) into a video file,
+        by piping the frames to ffmpeg, which must be installed.
+        fps is the number of frames per second of video.
+        ffmpeg_args are passed to ffmpeg before the output filename, to
+        choose the codec and its options; the defaults make a video most
+        players accept.
+        Other keyword arguments are as for render().
+        Returns the number of frames rendered.
+        """
+        proc: subprocess.Popen[bytes] | None = None
+
+        def write(surface, frame) -> None:
+            nonlocal proc
+            if proc is None:
+                width, height = surface.get_size()
+                # fmt: off
+                command = [
+                    ffmpeg, "-y", "-loglevel", "error",
+                    "-f", "rawvideo", "-pix_fmt", "rgb24",
+                    "-s", f"{width}x{height}", "-r", str(fps), "-i", "-",
+                    *ffmpeg_args, filename,
+                ]
+                # fmt: on
+                proc = subprocess.Popen(command, stdin=subprocess.PIPE)
+            cast(IO[bytes], proc.stdin).write(_tobytes(surface))
+
+        try:
+            frames = self.render(write, **kwargs)
+        finally:
+            if proc is not None:
+                # Closes ffmpeg's input and waits for it to finish
+                proc.communicate()
+                returncode = proc.returncode
+        if proc is not None and returncode:
+            msg = f"ffmpeg failed with exit code {returncode}"
+            raise RuntimeError(msg)
+        return frames
 
     def run(
         self,
@@ -302,17 +1192,30 @@ class Simulation:
         "lib/python2.5/site-packages/pygame/freesansbold.ttf",
         font_size: int = 10,
         osm_zoom: int = 14,
-    ) -> None:
+        osm_manager=None,
+        incremental: bool = False,
+    ) -> dict:
         """
         Pops up a window and displays the simulation on it.
         speed is advancement of sim in seconds/second.
-        refresh_rate is pause in seconds between frames.
+        refresh_rate is the target time in seconds from one frame to the
+            next. The simulation advances by the wall time which actually
+            elapsed, so it keeps pace with the clock even when frames take
+            longer, and frames are skipped when it falls a whole frame
+            behind.
         window_size is the desired (width, height) of the display window.
         Font is either the full path to a pygame-compatible font file
             (e.g. a .ttf file), or an actual pygame Font object, or None.
             If None, then labels will not be rendered, instead they will be
             printed to stdout.
         font_size is the size of the font, if it exists.
+        osm_zoom and osm_manager are as for get_background().
+        incremental - if True, only the parts of the window which changed
+            are redrawn and updated each frame, as by update_frame(). This
+            costs much less when few vizs move (or none, when paused), as
+            long as every viz gives its screen rectangle or never changes.
+        Returns FrameClock.get_stats() of the frames shown, such as the
+        frames per second achieved; the window title shows it as it runs.
         """
         pygame.init()
         black = pygame.Color(0, 0, 0)
@@ -327,27 +1230,16 @@ class Simulation:
         elif isinstance(font, pygame.font.Font):
             fnt = font
 
-        osm = OSMManager(cache="maptiles/", image_manager=PygameImageManager())
-        bg_big, new_bounds = osm.create_osm_image(self.bounding_box, zoom=osm_zoom)
-        w_h_ratio = float(bg_big.get_width()) / bg_big.get_height()
-        # Make the window smaller to keep proportions and stay within
-        # specified window_size
-        new_width = int(window_size[1] * w_h_ratio)
-        new_height = int(window_size[0] / w_h_ratio)
-        if new_width > window_size[0]:
-            window_size = window_size[0], new_height
-        elif new_height > window_size[1]:
-            window_size = new_width, window_size[1]
-
+        bg_small, new_bounds, window_size = self.get_background(
+            window_size, osm_zoom, osm_manager
+        )
         screen = pygame.display.set_mode(window_size)
 
-        bg_small = pygame.transform.smoothscale(bg_big, window_size)
-        del bg_big
-
         last_time = self.time
-
-        def get_xy(lat, lon):
-            return self.get_xy(lat, lon, new_bounds, window_size)
+        get_xy = self.make_get_xy(new_bounds, window_size)
+        # Where the label was drawn over the last frame
+        label_rects: list = []
+        clock = FrameClock(1.0 / refresh_rate)
 
         # Main simulation loop #
 
@@ -370,38 +1262,41 @@ class Simulation:
 
             # Grab mouse position
             mouse_x, mouse_y = pygame.mouse.get_pos()
-            selected = None
 
             # Print the time if changed
             if self.time != last_time:
                 self.print_time()
             last_time = self.time
 
-            # Draw the background
-            screen.blit(bg_small, (0, 0))
-
-            # Draw the tracked objects
-            for sviz in self.all_vizs:
-                sviz.set_state(self.time, get_xy)
-                sviz.draw_to_surface(screen)
-                label = sviz.get_label()
-                if label and sviz.mouse_intersect(mouse_x, mouse_y):
-                    selected = sviz
+            if incremental:
+                selected, rects = self.update_frame(
+                    screen, bg_small, get_xy, (mouse_x, mouse_y), label_rects
+                )
+            else:
+                selected = self.draw_frame(screen, bg_small, get_xy, (mouse_x, mouse_y))
+                rects = None
 
             # Display selected label
+            label_rects = []
             if selected:
                 if fnt:
                     text = fnt.render(selected.get_label(), True, black, notec)
-                    screen.blit(text, (mouse_x, mouse_y - 10))
+                    label_rects.append(screen.blit(text, (mouse_x, mouse_y - 10)))
                     del text
                 else:
-                    print(selected.getLabel())
+                    print(selected.get_label())
 
-            pygame.display.flip()
+            if rects is None:
+                pygame.display.flip()
+            elif rects or label_rects:
+                pygame.display.update(rects + label_rects)
 
-            time.sleep(refresh_rate)
-            self.set_time(self.time + speed * refresh_rate)
+            elapsed = clock.tick()
+            self.set_time(self.time + speed * elapsed)
+            if clock.frames % max(1, round(1.0 / refresh_rate)) == 0:
+                pygame.display.set_caption(f"osmviz: {clock.get_fps():.1f} fps")
 
         # Clean up and exit
         del bg_small
         pygame.display.quit()
+        return clock.get_stats()
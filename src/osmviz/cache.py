@@ -0,0 +1,646 @@
+"""
+Tile caches:
+  - TileMemoryCache keeps decoded tile images in memory, so tiles shared by
+    several create_osm_image() calls are only read and decoded once
+  - TileStore is the interface through which an OSMManager keeps the
+    tiles it downloads. Implementations:
+     - FlatFileTileStore: one flat directory of PNG files (the default)
+     - DiskTileCache: zoom/x/y directories, bounded in size, expiring tiles
+       as told by the tile server
+     - MBTilesTileStore: a single MBTiles (SQLite) file
+
+Any ImageManager can be given a TileMemoryCache, and one cache can be
+shared by several image managers, of any kind. An OSMManager can be given
+any TileStore as its tile_store.
+"""
+
+# Copyright (c) 2010 Colin Bick, Robert Damphousse
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+from __future__ import annotations
+
+import contextlib
+import io
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from email.utils import parsedate_to_datetime
+from os import path
+from typing import NamedTuple
+
+
+class TileMemoryCache:
+    """
+    A thread-safe least-recently-used cache of decoded tile images, bounded
+    by the total size in bytes of the images it holds.
+    Keys are typically (url template hash, zoom, x, y) tuples.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024) -> None:
+        """
+        Constructs a TileMemoryCache.
+        Arguments:
+            max_bytes - memory budget; the least recently used images are
+                 evicted to keep the total size of the cached images below it
+        """
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the image cached under key, or None if there is none.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, image, nbytes: int) -> None:
+        """
+        Caches image under key, nbytes being its size in memory.
+        Images larger than the whole budget are not cached.
+        """
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            self._entries[key] = (image, nbytes)
+            self.current_bytes += nbytes
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_bytes
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """
+        Removes all images from the cache. Counters are kept.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> dict[str, int]:
+        """
+        Returns a dict of the cache counters and current size.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+class ReadOnlyTileStoreError(OSError):
+    """
+    Raised when storing tiles in a tile store opened read-only.
+    """
+
+
+class CachedTile(NamedTuple):
+    """
+    A tile found in a tile store.
+    source is what an ImageManager can load the tile from (a filename,
+    or a file object for stores which do not keep one file per tile).
+    fresh is False when the tile has expired and should be revalidated
+    with the tile server, using the etag and last_modified validators.
+    """
+
+    source: str | io.BytesIO
+    fresh: bool
+    etag: str | None = None
+    last_modified: str | None = None
+
+
+def get_expiry(headers, now: float, default_max_age: float) -> float:
+    """
+    Given the headers of a tile server response, returns the time
+    (in seconds since the epoch) at which the tile expires, honouring
+    Cache-Control and Expires, or default_max_age if there are neither.
+    """
+    cache_control = headers.get("Cache-Control") or ""
+    for directive in cache_control.lower().split(","):
+        name, _, value = directive.strip().partition("=")
+        if name in ("no-cache", "no-store"):
+            return now
+        if name == "max-age":
+            try:
+                return now + max(0, int(value.strip('"')))
+            except ValueError:
+                return now
+    expires = headers.get("Expires")
+    if expires:
+        try:
+            return parsedate_to_datetime(expires).timestamp()
+        except (TypeError, ValueError):
+            return now
+    return now + default_max_age
+
+
+def write_file(filename: str, data: bytes) -> None:
+    """
+    Writes data to filename atomically: readers see either the old file
+    or the whole new one, never a partly written file.
+    """
+    tmp_filename = f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_filename, "wb") as f:
+            f.write(data)
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_filename)
+        raise
+
+
+class TileStore:
+    """
+    Simple abstract interface for storing downloaded tiles, to be used by
+    an OSMManager object. Tiles are identified by (server, zoom, x, y) keys,
+    server being a short hash of the tile server URL.
+    """
+
+    # TO BE OVERRIDDEN #
+
+    def get_tile(self, key, now: float | None = None):
+        """
+        To be overridden.
+        Returns the CachedTile stored under key, or None if there is none.
+        now is the current time, for expiry.
+        """
+        raise NotImplementedError
+
+    def put_tile(self, key, data: bytes, headers, now: float | None = None):
+        """
+        To be overridden.
+        Stores the tile data downloaded for key, given the headers of the
+        tile server response, and returns its source (see CachedTile).
+        """
+        raise NotImplementedError
+
+    # END OF TO BE OVERRIDDEN #
+
+    def revalidate_tile(self, key, headers, now: float | None = None):
+        """
+        Records that the tile server confirmed (HTTP 304 Not Modified)
+        the stored tile for key, with the given response headers.
+        Returns its source (see CachedTile).
+        The default is for stores which never expire tiles.
+        """
+        return self.get_tile(key, now).source
+
+    def record_hit(self, key, now: float | None = None) -> None:
+        """
+        Records that the stored tile for key was served. Stores which
+        evict tiles by their use override this.
+        """
+
+    def get_location(self) -> str:
+        """
+        Returns the directory or file in which the store keeps its tiles,
+        telling it apart from other stores.
+        """
+        return type(self).__name__
+
+    @contextlib.contextmanager
+    def pin_tiles(self, keys):
+        """
+        Returns a context manager within which the stored tiles for keys
+        are not evicted, however full the store gets, so that tiles just
+        retrieved stay available until they are used.
+        The default is for stores which never evict tiles.
+        """
+        yield
+
+    def put_tiles(self, tiles, now: float | None = None) -> None:
+        """
+        Stores many (key, data, headers) tiles at once. Stores which can
+        do it in one transaction override this.
+        """
+        for key, data, headers in tiles:
+            self.put_tile(key, data, headers, now)
+
+    def close(self) -> None:
+        """
+        Releases any resources held by the store.
+        """
+
+
+class FlatFileTileStore(TileStore):
+    """
+    A TileStore keeping all tiles, which never expire, as files named
+    <server>z_x_y.png in one directory.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+
+    def get_filename(self, key) -> str:
+        """
+        Given a (server, zoom, x, y) tile key, returns the filename
+        under which the tile is (or would be) stored.
+        """
+        server, zoom, x, y = key
+        return path.join(self.directory, f"{server}{zoom}_{x}_{y}.png")
+
+    def get_location(self) -> str:
+        return path.abspath(self.directory)
+
+    def get_tile(self, key, now: float | None = None):
+        filename = self.get_filename(key)
+        if not path.isfile(filename):
+            return None
+        return CachedTile(filename, True)
+
+    def put_tile(self, key, data: bytes, headers, now: float | None = None) -> str:
+        filename = self.get_filename(key)
+        write_file(filename, data)
+        return filename
+
+
+class DiskTileCache(TileStore):
+    """
+    An on-disk tile store, with one directory per tile server under root,
+    sharded by zoom and x (root/server/zoom/x/y.png), so that no directory
+    holds more than a row of tiles.
+
+    The size, last access time, hit count and expiry of every tile are
+    kept in an SQLite index in root, so that the least recently (or least
+    frequently) used tiles can be evicted without scanning the directories.
+    The index can be shared by several processes. Pinned tiles (see
+    pin_tiles()) are only protected from eviction by this process.
+    """
+
+    POLICIES = ("lru", "lfu")
+
+    def __init__(
+        self,
+        root: str,
+        max_bytes: int | None = None,
+        policy: str = "lru",
+        default_max_age: float = 7 * 24 * 3600,
+    ) -> None:
+        """
+        Constructs a DiskTileCache.
+        Arguments:
+            root - directory in which to keep the tiles and the index;
+                 created if needed
+            max_bytes - maximum total size of the cached tiles, or None for
+                 no limit
+            policy - "lru" to evict the least recently used tiles first,
+                 or "lfu" to evict the least frequently used first
+            default_max_age - seconds for which a tile is fresh when the
+                 server does not say (Cache-Control or Expires)
+        """
+        if policy not in self.POLICIES:
+            msg = f"Unknown eviction policy {policy!r}, use one of {self.POLICIES}"
+            raise ValueError(msg)
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.default_max_age = default_max_age
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # Pin counts of the keys of pinned tiles
+        self._pinned: Counter[tuple] = Counter()
+        self._db = sqlite3.connect(
+            path.join(root, "index.sqlite"), check_same_thread=False, timeout=30
+        )
+        with self._db:
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS tiles (
+                    server TEXT, zoom INTEGER, x INTEGER, y INTEGER,
+                    size INTEGER NOT NULL, last_access REAL NOT NULL,
+                    hits INTEGER NOT NULL, expires REAL NOT NULL,
+                    etag TEXT, last_modified TEXT,
+                    PRIMARY KEY (server, zoom, x, y)
+                );
+                CREATE INDEX IF NOT EXISTS tiles_lru ON tiles (last_access);
+                CREATE INDEX IF NOT EXISTS tiles_lfu ON tiles (hits, last_access);
+                CREATE TABLE IF NOT EXISTS totals (bytes INTEGER NOT NULL);
+                INSERT INTO totals SELECT 0 WHERE NOT EXISTS (SELECT * FROM totals);
+                """)
+
+    def get_filename(self, key) -> str:
+        """
+        Given a (server, zoom, x, y) tile key, returns the filename
+        under which the tile is (or would be) cached.
+        """
+        server, zoom, x, y = key
+        return path.join(self.root, server.strip("-"), str(zoom), str(x), f"{y}.png")
+
+    def get_location(self) -> str:
+        return path.abspath(self.root)
+
+    def get_tile(self, key, now: float | None = None):
+        """
+        Returns the CachedTile stored under a (server, zoom, x, y) key,
+        or None if the tile is not cached. Looking a tile up does not count
+        as using it: see record_hit().
+        """
+        now = time.time() if now is None else now
+        filename = self.get_filename(key)
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT size, expires, etag, last_modified FROM tiles "
+                "WHERE server = ? AND zoom = ? AND x = ? AND y = ?",
+                key,
+            ).fetchone()
+            if row is None:
+                return None
+            size, expires, etag, last_modified = row
+            if not path.isfile(filename):
+                # Removed behind our back
+                self._delete(key, size)
+                return None
+        return CachedTile(filename, now < expires, etag, last_modified)
+
+    def record_hit(self, key, now: float | None = None) -> None:
+        """
+        Records that the tile under a (server, zoom, x, y) key was served,
+        for the eviction policy.
+        """
+        now = time.time() if now is None else now
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE tiles SET last_access = ?, hits = hits + 1 "
+                "WHERE server = ? AND zoom = ? AND x = ? AND y = ?",
+                (now, *key),
+            )
+
+    @contextlib.contextmanager
+    def pin_tiles(self, keys):
+        """
+        Returns a context manager within which the tiles under the given
+        (server, zoom, x, y) keys are not evicted. The cache may grow past
+        max_bytes meanwhile, and is brought back within it on exit.
+        """
+        keys = [tuple(key) for key in keys]
+        with self._lock:
+            self._pinned.update(keys)
+        try:
+            yield
+        finally:
+            with self._lock, self._db:
+                self._pinned.subtract(keys)
+                self._pinned = +self._pinned
+                self._evict()
+
+    def put_tile(self, key, data: bytes, headers, now: float | None = None) -> str:
+        """
+        Stores the tile data downloaded for a (server, zoom, x, y) key,
+        given the response headers, evicting other tiles if the cache
+        grows too big. Returns the filename of the tile.
+        """
+        now = time.time() if now is None else now
+        filename = self.get_filename(key)
+        os.makedirs(path.dirname(filename), exist_ok=True)
+        write_file(filename, data)
+
+        expires = get_expiry(headers, now, self.default_max_age)
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT size FROM tiles "
+                "WHERE server = ? AND zoom = ? AND x = ? AND y = ?",
+                key,
+            ).fetchone()
+            old_size = row[0] if row else 0
+            self._db.execute(
+                "INSERT INTO tiles VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?, ?) "
+                "ON CONFLICT (server, zoom, x, y) DO UPDATE SET "
+                "size = excluded.size, last_access = excluded.last_access, "
+                "expires = excluded.expires, etag = excluded.etag, "
+                "last_modified = excluded.last_modified",
+                (
+                    *key,
+                    len(data),
+                    now,
+                    expires,
+                    headers.get("ETag"),
+                    headers.get("Last-Modified"),
+                ),
+            )
+            self._db.execute(
+                "UPDATE totals SET bytes = bytes + ?", (len(data) - old_size,)
+            )
+            self._evict(keep=tuple(key))
+        return filename
+
+    def revalidate_tile(self, key, headers, now: float | None = None) -> str:
+        now = time.time() if now is None else now
+        expires = get_expiry(headers, now, self.default_max_age)
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE tiles SET expires = ?, etag = COALESCE(?, etag), "
+                "last_modified = COALESCE(?, last_modified) "
+                "WHERE server = ? AND zoom = ? AND x = ? AND y = ?",
+                (expires, headers.get("ETag"), headers.get("Last-Modified"), *key),
+            )
+        return self.get_filename(key)
+
+    def get_size(self) -> int:
+        """
+        Returns the total size in bytes of the cached tiles.
+        """
+        with self._lock:
+            return self._db.execute("SELECT bytes FROM totals").fetchone()[0]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM tiles").fetchone()[0]
+
+    def close(self) -> None:
+        """
+        Closes the index.
+        """
+        with self._lock:
+            self._db.close()
+
+    def _delete(self, key, size: int) -> None:
+        """
+        Removes a tile from the index and disk. Call with the lock held,
+        inside a transaction.
+        """
+        self._db.execute(
+            "DELETE FROM tiles WHERE server = ? AND zoom = ? AND x = ? AND y = ?",
+            key,
+        )
+        self._db.execute("UPDATE totals SET bytes = bytes - ?", (size,))
+        try:
+            os.remove(self.get_filename(key))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self, keep=None) -> None:
+        """
+        Evicts tiles, other than keep and pinned ones, until the cache
+        fits in max_bytes. Call with the lock held, inside a transaction.
+        """
+        if self.max_bytes is None:
+            return
+        order = "last_access" if self.policy == "lru" else "hits, last_access"
+        # Number of tiles kept at the start of the eviction order
+        skipped = 0
+        while True:
+            total = self._db.execute("SELECT bytes FROM totals").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            rows = self._db.execute(
+                f"SELECT server, zoom, x, y, size FROM tiles ORDER BY {order} "
+                "LIMIT 64 OFFSET ?",
+                (skipped,),
+            ).fetchall()
+            if not rows:
+                return
+            for *key, size in rows:
+                key = tuple(key)
+                if key == keep or key in self._pinned:
+                    skipped += 1
+                    continue
+                self._delete(key, size)
+                self.evictions += 1
+                total -= size
+                if total <= self.max_bytes:
+                    return
+
+
+class MBTilesTileStore(TileStore):
+    """
+    A TileStore keeping tiles, which never expire, as blobs in a single
+    MBTiles (SQLite) file. One file holds the tiles of one tile server.
+
+    The file can be opened read-only by many processes at once, for
+    example on offline nodes shipped a pre-seeded file, and tiles can be
+    written in bulk with put_tiles(), in a single transaction.
+    """
+
+    def __init__(self, filename: str, read_only: bool = False, name=None) -> None:
+        """
+        Constructs an MBTilesTileStore.
+        Arguments:
+            filename - the MBTiles file; created unless read_only
+            read_only - open an existing file without locking it for writing
+            name - tileset name to record in the metadata of a new file
+        """
+        self.filename = filename
+        self.read_only = read_only
+        self._lock = threading.Lock()
+        if read_only:
+            self._db = sqlite3.connect(
+                f"file:{filename}?mode=ro", uri=True, check_same_thread=False
+            )
+            return
+        self._db = sqlite3.connect(filename, check_same_thread=False, timeout=30)
+        with self._db:
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT);
+                CREATE UNIQUE INDEX IF NOT EXISTS metadata_name ON metadata (name);
+                CREATE TABLE IF NOT EXISTS tiles (
+                    zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER,
+                    tile_data BLOB
+                );
+                CREATE UNIQUE INDEX IF NOT EXISTS tile_index
+                    ON tiles (zoom_level, tile_column, tile_row);
+                """)
+            for meta_name, value in (
+                ("name", name or path.basename(filename)),
+                ("format", "png"),
+                ("type", "baselayer"),
+                ("version", "1.0"),
+            ):
+                self._db.execute(
+                    "INSERT OR IGNORE INTO metadata VALUES (?, ?)", (meta_name, value)
+                )
+
+    def get_location(self) -> str:
+        return path.abspath(self.filename)
+
+    @staticmethod
+    def _row(key):
+        """
+        Returns the (zoom_level, tile_column, tile_row) of a tile key.
+        MBTiles rows count from the south (TMS), unlike OSM tiles.
+        """
+        _, zoom, x, y = key
+        return zoom, x, (1 << zoom) - 1 - y
+
+    def get_tile(self, key, now: float | None = None):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT tile_data FROM tiles "
+                "WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                self._row(key),
+            ).fetchone()
+        if row is None:
+            return None
+        return CachedTile(io.BytesIO(row[0]), True)
+
+    def put_tile(self, key, data: bytes, headers, now: float | None = None):
+        self.put_tiles([(key, data, headers)], now)
+        return io.BytesIO(data)
+
+    def put_tiles(self, tiles, now: float | None = None) -> None:
+        if self.read_only:
+            msg = f"{self.filename} was opened read-only"
+            raise ReadOnlyTileStoreError(msg)
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)",
+                ((*self._row(key), data) for key, data, _ in tiles),
+            )
+
+    def get_metadata(self) -> dict[str, str]:
+        """
+        Returns the metadata of the tileset as a dict.
+        """
+        with self._lock:
+            return dict(self._db.execute("SELECT name, value FROM metadata"))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM tiles").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -1,11 +1,12 @@
 """
 OpenStreetMap Management Tool:
   - Provides simple interface to retrieve and tile OSM images
-  - Can use pygame or PIL (to generate pygame Surfaces or PIL images)
+  - Can use pygame, PIL or NumPy (to generate pygame Surfaces, PIL images
+    or NumPy arrays)
 
 Basic idea:
   1. Choose an ImageManager class and construct an instance.
-     - Pygame and PIL implementations available
+     - Pygame, PIL and NumPy implementations available
      - To make your own custom ImageManager, override the ImageManager
        class.
   2. Construct an OSMManager object.
@@ -36,11 +37,33 @@ Basic idea:
 from __future__ import annotations
 
 import hashlib
+import io
 import math
+import numbers
 import os
-import urllib.request
+import re
+import threading
+import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from contextlib import nullcontext
 from os import path
-from urllib.request import urlretrieve
+from typing import TYPE_CHECKING, cast
+from urllib.parse import urlsplit
+
+from . import projection
+from .cache import FlatFileTileStore
+from .seed import SeedReport, box_intersects_polygon, polygon_bounds
+from .stats import Stats
+from .transport import CircuitOpenError, ConnectionPool, RetryPolicy, TokenBucket
+
+if TYPE_CHECKING:
+    import numpy as np
 
 try:
     from tqdm import tqdm
@@ -48,14 +71,44 @@ except ImportError:
     tqdm = None  # type: ignore[assignment,misc]
 
 
+# Number of channels of the images made by NumpyImageManager, per PIL mode
+CHANNELS = {"L": 1, "RGB": 3, "RGBA": 4}
+
+
+def expand_mirrors(url):
+    """
+    Given a URL template, returns the list of templates of its mirrors,
+    one per alternative in a '{a|b|c}' choice, if it has one.
+    """
+    match = re.search(r"\{([^{}]*\|[^{}]*)\}", url)
+    if not match:
+        return [url]
+    head, tail = url[: match.start()], url[match.end() :]
+    return [head + choice + tail for choice in match.group(1).split("|")]
+
+
 class ImageManager:
     """
     Simple abstract interface for creating and manipulating images, to be used
     by an OSMManager object.
     """
 
-    def __init__(self) -> None:
+    # Whether paste_image_file() may be called from several threads at once
+    # for tiles which do not overlap
+    parallel_paste = False
+
+    def __init__(self, tile_cache=None) -> None:
+        """
+        Arguments:
+            tile_cache - optional TileMemoryCache in which decoded tiles
+                 are kept, so that pasting the same tile again does not
+                 read and decode its file again.
+        """
         self.image = None
+        self.tile_cache = tile_cache
+        # Stats recording decode and paste times, if any: set by the
+        # OSMManager using this manager
+        self.stats = None
 
     # TO BE OVERRIDDEN #
 
@@ -81,6 +134,24 @@ class ImageManager:
         """
         raise NotImplementedError
 
+    def get_image_nbytes(self, img):
+        """
+        To be overridden (optionally).
+        Returns the size in memory of an image loaded by load_image_file.
+        Only needed when a tile_cache is used.
+        """
+        raise NotImplementedError
+
+    def resize_image(self, img, box, size):
+        """
+        To be overridden (optionally).
+        Given an image loaded by load_image_file, returns the region of it
+        within box, a (left, upper, right, lower) tuple of pixel
+        coordinates which may be fractional, resampled to size (width,
+        height). Only needed by OSMManager.render_osm_image().
+        """
+        raise NotImplementedError
+
     # END OF TO BE OVERRIDDEN #
 
     def prepare_image(self, width, height):
@@ -88,7 +159,7 @@ class ImageManager:
         Create and internally store an image whose dimensions
         are those specified by width and height.
         """
-        if self.image:
+        if self.image is not None:
             msg = "Image already prepared."
             raise RuntimeError(msg)
         self.image = self.create_image(width, height)
@@ -98,28 +169,55 @@ class ImageManager:
         Destroys internal representation of the image, if it was
         ever created.
         """
-        if self.image:
+        if self.image is not None:
             del self.image
         self.image = None
 
-    def paste_image_file(self, image_file, xy):
+    def paste_image_file(self, image_file, xy, cache_key=None, box=None, size=None):
         """
         Given the filename of an image, and the x, y coordinates of the
         location at which to place the top left corner of the contents
         of that image, pastes the image into this object's internal image.
+        If cache_key is given and this manager has a tile_cache, the
+        decoded image is looked up in and stored to the cache under
+        that key.
+        If box and size are given, only the box region of the image is
+        pasted, resampled to size (see resize_image).
         """
-        if not self.image:
+        if self.image is None:
             msg = "Image not prepared"
             raise RuntimeError(msg)
 
+        if self.tile_cache is not None and cache_key is not None:
+            # Several kinds of manager, in different modes, may share one
+            # cache
+            mode = getattr(self, "mode", None)
+            cache_key = (self.__class__.__name__, mode, *cache_key)
+            img = self.tile_cache.get(cache_key)
+            if img is None:
+                img = self._load_image_file(image_file)
+                self.tile_cache.put(cache_key, img, self.get_image_nbytes(img))
+        else:
+            img = self._load_image_file(image_file)
+
+        with self._timer("paste"):
+            if box is not None:
+                img = self.resize_image(img, box, size)
+            self.paste_image(img, xy)
+        del img
+
+    def _load_image_file(self, image_file):
         try:
-            img = self.load_image_file(image_file)
+            with self._timer("decode"):
+                return self.load_image_file(image_file)
         except (OSError, ValueError, RuntimeError) as e:
             msg = f"Could not load image {image_file}\n{e}"
             raise ValueError(msg)
 
-        self.paste_image(img, xy)
-        del img
+    def _timer(self, name):
+        if self.stats is None:
+            return nullcontext()
+        return self.stats.timer(name)
 
     def get_image(self):
         """
@@ -134,8 +232,13 @@ class PygameImageManager(ImageManager):
     An ImageManager which works with Pygame images.
     """
 
-    def __init__(self) -> None:
-        ImageManager.__init__(self)
+    def __init__(self, tile_cache=None) -> None:
+        """
+        Constructs a Pygame Image Manager.
+        Arguments:
+            tile_cache - see ImageManager.
+        """
+        ImageManager.__init__(self, tile_cache)
         try:
             import pygame
         except ImportError:
@@ -152,19 +255,32 @@ class PygameImageManager(ImageManager):
     def paste_image(self, img, xy) -> None:
         self.get_image().blit(img, xy)
 
+    def resize_image(self, img, box, size):
+        # Pygame crops to whole pixels: round the box outwards
+        left, upper = int(box[0]), int(box[1])
+        right, lower = math.ceil(box[2]), math.ceil(box[3])
+        img = img.subsurface((left, upper, right - left, lower - upper))
+        if img.get_bitsize() in (24, 32):
+            return self.pygame.transform.smoothscale(img, size)
+        return self.pygame.transform.scale(img, size)
+
+    def get_image_nbytes(self, img):
+        return img.get_pitch() * img.get_height()
+
 
 class PILImageManager(ImageManager):
     """
     An ImageManager which works with PIL images.
     """
 
-    def __init__(self, mode) -> None:
+    def __init__(self, mode, tile_cache=None) -> None:
         """
         Constructs a PIL Image Manager.
         Arguments:
             mode - the PIL mode in which to create the image.
+            tile_cache - see ImageManager.
         """
-        ImageManager.__init__(self)
+        ImageManager.__init__(self, tile_cache)
         self.mode = mode
         try:
             import PIL.Image
@@ -177,11 +293,194 @@ class PILImageManager(ImageManager):
         return self.PILImage.new(self.mode, (width, height))
 
     def load_image_file(self, image_file):
-        return self.PILImage.open(image_file)
+        img = self.PILImage.open(image_file)
+        # Decode now, rather than when pasting: a cached image must not
+        # depend on the open file, and decoding is timed apart
+        img.load()
+        return img
 
     def paste_image(self, img, xy) -> None:
         self.get_image().paste(img, xy)
 
+    def resize_image(self, img, box, size):
+        # Convert first: palette images would only be resampled by nearest
+        return img.convert(self.mode).resize(
+            size, self.PILImage.Resampling.BICUBIC, box
+        )
+
+    def get_image_nbytes(self, img):
+        return len(img.getbands()) * img.width * img.height
+
+
+class NumpyImageManager(ImageManager):
+    """
+    An ImageManager which builds the image as a NumPy uint8 array of shape
+    (height, width, channels), decoding tiles with PIL.
+
+    For "L" and "RGBA" images, each PNG or JPEG tile is decoded straight
+    into its place in the array when the tile file has the same mode, and
+    other tiles are copied there once after decoding and converting them.
+    "RGB" images take an extra copy, as PIL keeps RGB pixels in 4 bytes.
+
+    Tiles can be decoded and pasted by several threads at once (see the
+    decoders argument of OSMManager), as PIL releases the GIL while
+    decoding and each tile has its own region of the array.
+    """
+
+    parallel_paste = True
+    # PIL decoders which write into the image they are given. Others, like
+    # the "raw" one of uncompressed formats, may map the file instead.
+    in_place_decoders = frozenset({"jpeg", "zip"})
+
+    def __init__(self, mode="RGBA", tile_cache=None) -> None:
+        """
+        Constructs a NumPy Image Manager.
+        Arguments:
+            mode - "L", "RGB" or "RGBA", the PIL mode to which tiles are
+                 converted, which sets the number of channels of the image.
+            tile_cache - see ImageManager.
+        """
+        ImageManager.__init__(self, tile_cache)
+        if mode not in CHANNELS:
+            msg = f"Unsupported mode {mode!r}, use one of {list(CHANNELS)}"
+            raise ValueError(msg)
+        self.mode = mode
+        try:
+            import numpy
+        except ImportError:
+            msg = "NumPy could not be imported!"
+            raise ImportError(msg)
+        try:
+            import PIL.Image
+        except ImportError:
+            msg = "PIL could not be imported!"
+            raise ImportError(msg)
+        self.numpy = numpy
+        self.PILImage = PIL.Image
+        # Flat array holding the image, plus one spare row at the end:
+        # PIL maps a region of it only if whole strides are available,
+        # even for the last row
+        self.buffer = None
+
+    def create_image(self, width, height):
+        channels = CHANNELS[self.mode]
+        size = width * height * channels
+        self.buffer = self.numpy.zeros(size + width * channels, self.numpy.uint8)
+        return self.buffer[:size].reshape(height, width, channels)
+
+    def destroy_image(self) -> None:
+        ImageManager.destroy_image(self)
+        self.buffer = None
+
+    def load_image_file(self, image_file):
+        # Not decoded yet: paste_image() may decode it in place
+        img = self.PILImage.open(image_file)
+        if self.tile_cache is not None:
+            img = img.convert(self.mode)
+        return img
+
+    def paste_image(self, img, xy) -> None:
+        image = cast("np.ndarray", self.image)
+        x, y = xy
+        w, h = img.size
+        height, width = image.shape[:2]
+        if self.mode == "RGB" or x < 0 or y < 0 or x + w > width or y + h > height:
+            x0, y0 = max(x, 0), max(y, 0)
+            x1, y1 = min(x + w, width), min(y + h, height)
+            if x0 < x1 and y0 < y1:
+                pixels = self.numpy.asarray(img.convert(self.mode))
+                if pixels.ndim == 2:
+                    pixels = pixels[:, :, None]
+                image[y0:y1, x0:x1] = pixels[y0 - y : y1 - y, x0 - x : x1 - x]
+            return
+
+        # A PIL image sharing the memory of the target region of the array
+        channels = CHANNELS[self.mode]
+        offset = (y * width + x) * channels
+        buffer = cast("np.ndarray", self.buffer)[offset:]
+        view = self.PILImage.frombuffer(
+            self.mode, (w, h), buffer, "raw", self.mode, width * channels, 1
+        )
+        # ImageFile.tile lists what remains to decode
+        tiles = getattr(img, "tile", None)
+        if (
+            tiles
+            and img.mode == self.mode
+            and all(tile[0] in self.in_place_decoders for tile in tiles)
+        ):
+            # Not decoded yet: have the decoder write into the array
+            img.im = view.im
+            img.load()
+        else:
+            if img.mode != self.mode:
+                img = img.convert(self.mode)
+            img.load()
+            view.im.paste(img.im, (0, 0, w, h))
+
+    def resize_image(self, img, box, size):
+        return img.convert(self.mode).resize(
+            size, self.PILImage.Resampling.BICUBIC, box
+        )
+
+    def get_image_nbytes(self, img):
+        return len(img.getbands()) * img.width * img.height
+
+
+class MemmapImageManager(NumpyImageManager):
+    """
+    A NumpyImageManager whose image is a memory-mapped .npy file, so that
+    images larger than memory can be built: tiles are written straight
+    into the file's pages, which the OS writes out as needed.
+    The file can be opened again later with open_image(), or with
+    numpy.load(filename, mmap_mode="r").
+    """
+
+    def __init__(self, filename, mode="RGBA", tile_cache=None) -> None:
+        """
+        Constructs a Memmap Image Manager.
+        Arguments:
+            filename - the .npy file to create (or overwrite) for each image.
+            mode, tile_cache - see NumpyImageManager.
+        """
+        NumpyImageManager.__init__(self, mode, tile_cache)
+        self.filename = filename
+
+    def create_image(self, width, height):
+        channels = CHANNELS[self.mode]
+        size = width * height * channels
+        # Write the .npy header, then add the spare row after the data,
+        # where numpy.load() ignores it
+        header = self.numpy.lib.format.open_memmap(
+            self.filename,
+            mode="w+",
+            dtype=self.numpy.uint8,
+            shape=(height, width, channels),
+        )
+        offset = header.offset
+        del header
+        with open(self.filename, "r+b") as f:
+            f.truncate(offset + size + width * channels)
+        self.buffer = self.numpy.memmap(
+            self.filename, self.numpy.uint8, mode="r+", offset=offset
+        )
+        return self.buffer[:size].reshape(height, width, channels)
+
+    def destroy_image(self) -> None:
+        """
+        Writes the image to its file and unmaps it. The file is kept.
+        """
+        if self.buffer is not None:
+            self.buffer.flush()
+        NumpyImageManager.destroy_image(self)
+
+    def open_image(self, mmap_mode="r"):
+        """
+        Returns the image last built, memory-mapped from its file.
+        mmap_mode is as for numpy.load(): "r" for read-only, "r+" to
+        modify the file, "c" for copy-on-write.
+        """
+        return self.numpy.load(self.filename, mmap_mode=mmap_mode)
+
 
 class OSMManager:
     """
@@ -208,6 +507,11 @@ class OSMManager:
                     contain placeholders for zoom ('{z}'), coordinate x and y
                     ('{x}' and '{y}'), and optionally scale ('{s}') for high-
                     resolution tile retrieval.
+                    For servers with mirrors, the template may contain one
+                    choice of alternatives, such as '{a|b|c}' for
+                    subdomains, or url may be a list of templates, one per
+                    mirror. Each tile is always fetched from the same mirror
+                    first, and from the others if that one fails.
                     Note: when specified, the server parameter is ignored.
                     Default: server with "/{z}/{x}/{y}.png" appended
 
@@ -220,12 +524,64 @@ class OSMManager:
 
         image_manager - ImageManager instance which will be used to do all
                             image manipulation. You must provide this.
+
+        workers - Number of threads used by create_osm_image() to download
+                    missing tiles concurrently. The tiles are still pasted
+                    in the same order, so the result is identical to the
+                    serial one.
+                    Default 1 (download one tile at a time)
+
+        max_per_host - Maximum number of downloads in flight to any one
+                    tile server host, whatever the number of workers.
+                    Ignored when pool is given.
+                    Default 2
+
+        decoders - Number of threads used by create_osm_image() to decode
+                    and paste tiles at once, when the image manager allows
+                    it (see ImageManager.parallel_paste), such as a
+                    NumpyImageManager.
+                    Default 1
+
+        pool - ConnectionPool used to download tiles over persistent
+                    connections. Give the same pool to several managers to
+                    share connections between them.
+                    Default: a new pool owned by this manager
+
+        tile_store - TileStore in which to keep downloaded tiles, such as
+                    a DiskTileCache or an MBTilesTileStore. Expired tiles
+                    are revalidated with the tile server.
+                    Default: a FlatFileTileStore in the cache directory
+
+        policy - RetryPolicy setting the rate limit for each tile server
+                    host, how failed downloads are retried, and when to
+                    stop trying a failing server. Give the same policy to
+                    several managers to share its limits between them.
+                    Default: RetryPolicy(), retrying 3 times, with no
+                    rate limit
+
+        stats - Stats in which to record tile store hits and misses,
+                    download sizes and times, decode and paste times and
+                    render times, also given to the image manager unless
+                    it has its own. See osmviz.stats.
+                    Default: a new Stats
+
+        verbose - False to print nothing and show no progress bars, as
+                    for use in servers.
+                    Default True
         """
         cache = kwargs.get("cache")
         server = kwargs.get("server")
         url = kwargs.get("url")
         scale = kwargs.get("scale")
         mgr = kwargs.get("image_manager")
+        workers = kwargs.get("workers")
+        decoders = kwargs.get("decoders")
+        max_per_host = kwargs.get("max_per_host")
+        pool = kwargs.get("pool")
+        tile_store = kwargs.get("tile_store")
+        policy = kwargs.get("policy")
+        stats = kwargs.get("stats")
+        self.verbose = kwargs.get("verbose", True)
 
         self.cache = None
 
@@ -234,11 +590,11 @@ class OSMManager:
                 try:
                     os.makedirs(cache, 0o766)
                     self.cache = cache
-                    print("WARNING: Created cache dir", cache)
+                    self._log("WARNING: Created cache dir", cache)
                 except OSError:
-                    print("Could not make cache dir", cache)
+                    self._log("Could not make cache dir", cache)
             elif not os.access(cache, os.R_OK | os.W_OK):
-                print("Insufficient privileges on cache dir", cache)
+                self._log("Insufficient privileges on cache dir", cache)
             else:
                 self.cache = cache
 
@@ -246,9 +602,9 @@ class OSMManager:
             self.cache = (
                 os.getenv("TMPDIR") or os.getenv("TMP") or os.getenv("TEMP") or "/tmp"
             )
-            print(f"WARNING: Using {self.cache} to cache map tiles.")
+            self._log(f"WARNING: Using {self.cache} to cache map tiles.")
             if not os.access(self.cache, os.R_OK | os.W_OK):
-                print(f" ERROR: Insufficient access to {self.cache}.")
+                self._log(f" ERROR: Insufficient access to {self.cache}.")
                 msg = "Unable to find/create/use map tile cache directory."
                 raise RuntimeError(msg)
 
@@ -261,12 +617,20 @@ class OSMManager:
         #  * https://server/layer@{s}x/{z}/{x}/{y}.png
         #  * https://server/layer/{z}/{x}/{y}@{s}x.png (e.g. Mapbox)
         #  * https://server/layer/{z}/{x}/{y}.png?scale={s} (e.g. Google Maps)
-        if url:
+        # and one choice of alternatives, for servers with several mirrors:
+        #  * https://{a|b|c}.server/{z}/{x}/{y}.png
+        # A list of templates can also be given, one per mirror.
+        if url and not isinstance(url, str):
+            self.url = url[0]
+            self.urls = [u for template in url for u in expand_mirrors(template)]
+        elif url:
             self.url = url
         elif server:
             self.url = f"{server}/{{z}}/{{x}}/{{y}}.png"
         else:
             self.url = "https://tile.openstreetmap.org/{z}/{x}/{y}.png"
+        if not url or isinstance(url, str):
+            self.urls = expand_mirrors(self.url)
 
         # Default scale is 1. High-resolution tiles use 1.5, 2 (most common),
         # 3, 4 or even more.
@@ -289,28 +653,82 @@ class OSMManager:
             msg = "OSMManager.__init__ requires argument image_manager"
             raise TypeError(msg)
 
+        if tile_store is not None:
+            self.tile_store = tile_store
+        else:
+            self.tile_store = FlatFileTileStore(self.cache)
+
+        self.workers = workers or 1
+        self.decoders = decoders or 1
+        if pool:
+            self.pool = pool
+            self._owns_pool = False
+        else:
+            self.pool = ConnectionPool(max_per_host=max_per_host or 2)
+            self._owns_pool = True
+        self.policy = policy or RetryPolicy()
+        self.stats = stats or Stats()
+        if getattr(self.manager, "stats", None) is None:
+            self.manager.stats = self.stats
+        # Downloads in progress, by tile key, so that threads wanting the
+        # same tile wait for one download instead of starting their own
+        self._in_flight: dict[tuple, Future] = {}
+        self._in_flight_lock = threading.Lock()
+
+    def _log(self, *args) -> None:
+        if self.verbose:
+            print(*args)
+
+    def _progress_bar(self, desc, total=None):
+        """
+        Returns a tqdm progress bar, or None if tqdm is not installed or
+        this manager is not verbose.
+        """
+        if self.verbose and tqdm:  # type: ignore[truthy-function]
+            return tqdm(desc=desc, total=total, unit="tile")
+        return None
+
     def get_tile_coord(self, lon_deg, lat_deg, zoom):
         """
         Given lon, lat coords in DEGREES, and a zoom level,
         returns the (x, y) coordinate of the corresponding tile #.
         (https://wiki.openstreetmap.org/wiki/Slippy_map_tilenames#Python)
         """
-        lat_rad = lat_deg * math.pi / 180.0
-        n = 2.0**zoom
-        xtile = int((lon_deg + 180.0) / 360.0 * n)
-        ytile = int(
-            (1.0 - math.log(math.tan(lat_rad) + (1 / math.cos(lat_rad))) / math.pi)
-            / 2.0
-            * n
-        )
-        return xtile, ytile
+        return projection.get_tile_coord(lon_deg, lat_deg, zoom)
+
+    def get_tile_coord_array(self, lon_deg, lat_deg, zoom):
+        """
+        Given NumPy arrays of lon, lat coords in DEGREES, and a zoom level
+        (or an array of them), returns arrays of the x and y tile numbers.
+        """
+        return projection.get_tile_coord_array(lon_deg, lat_deg, zoom)
 
     def get_tile_url(self, tile_coord, zoom):
         """
         Given x, y coord of the tile to download, and the zoom level,
         returns the URL from which to download the image.
         """
-        return self.url.format(x=tile_coord[0], y=tile_coord[1], z=zoom, s=self.scale)
+        return self.get_tile_urls(tile_coord, zoom)[0]
+
+    def get_tile_urls(self, tile_coord, zoom):
+        """
+        Given x, y coord of the tile to download, and the zoom level,
+        returns the URLs of each mirror from which to download the image,
+        in the order to try them. The first one depends only on the tile,
+        so the same tile always comes from the same mirror when it is up.
+        """
+        x, y = tile_coord
+        first = (x + y) % len(self.urls)
+        order = self.urls[first:] + self.urls[:first]
+        return [url.format(x=x, y=y, z=zoom, s=self.scale) for url in order]
+
+    def get_tile_key(self, tile_coord, zoom):
+        """
+        Given x, y coord of the tile, and the zoom level, returns a key
+        identifying the tile among those of all tile servers, for use
+        with a TileMemoryCache.
+        """
+        return (self.cache_prefix, zoom, tile_coord[0], tile_coord[1])
 
     def get_local_tile_filename(self, tile_coord, zoom):
         """
@@ -326,18 +744,369 @@ class OSMManager:
     def retrieve_tile_image(self, tile_coord, zoom):
         """
         Given x, y coord of the tile, and the zoom level,
-        retrieves the file to disk if necessary and
-        returns the local filename.
+        retrieves the tile into the tile store if necessary
+        (revalidating it if it has expired) and returns the local
+        filename, or a file object for stores not keeping files.
         """
-        filename = self.get_local_tile_filename(tile_coord, zoom)
-        if not path.isfile(filename):
-            url = self.get_tile_url(tile_coord, zoom)
+        key = self.get_tile_key(tile_coord, zoom)
+        cached = self.tile_store.get_tile(key)
+        if cached and cached.fresh:
+            self.stats.count("tile_hits")
+            self.tile_store.record_hit(key)
+            return cached.source
+
+        self.stats.count("tile_misses")
+        with self._in_flight_lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._in_flight[key] = future
+        if not leader:
+            source = future.result()
+            if isinstance(source, io.BytesIO):
+                # Each caller reads its own copy
+                source = io.BytesIO(source.getvalue())
+            return source
+
+        try:
+            # Another thread may have finished the download just before
+            cached = self.tile_store.get_tile(key)
+            if cached and cached.fresh:
+                self.tile_store.record_hit(key)
+                source = cached.source
+            else:
+                source = self._update_tile(key, tile_coord, zoom, cached)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(source)
+        finally:
+            with self._in_flight_lock:
+                del self._in_flight[key]
+        return source
+
+    def _update_tile(self, key, tile_coord, zoom, cached):
+        """
+        Downloads (or revalidates, if cached is an expired CachedTile) the
+        tile into the tile store, and returns its source.
+        """
+        urls = self.get_tile_urls(tile_coord, zoom)
+        headers = {}
+        if cached and cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached and cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+        try:
+            with self.stats.timer("download"):
+                resp = self._download(urls, headers)
+        except OSError:
+            if cached:
+                # Better an old tile than none at all
+                self.stats.count("tile_stale")
+                self.tile_store.record_hit(key)
+                return cached.source
+            raise
+        if resp.status == 304:
+            self.stats.count("tile_revalidations")
+            source = self.tile_store.revalidate_tile(key, resp.headers)
+            self.tile_store.record_hit(key)
+            return source
+        self.stats.count("download_bytes", len(resp.body))
+        return self.tile_store.put_tile(key, resp.body, resp.headers)
+
+    def _download(self, urls, headers=None):
+        """
+        Downloads the given URL, or the first of the given mirror URLs
+        which works, and returns the Response, which is either 200 OK, or
+        304 Not Modified when conditional headers were given.
+        Failed requests go on to the next mirror, as do requests to a
+        mirror slow to answer (see RetryPolicy's failover_timeout), and
+        are retried as self.policy allows once every mirror has failed.
+        Raises OSError otherwise.
+        """
+        if isinstance(urls, str):
+            urls = [urls]
+        # Hosts which failed to answer, and count against their breakers
+        failed = set()
+        failover_timeout = self.policy.failover_timeout
+        try:
+            for attempt in range(self.policy.retries + 1):
+                retry_headers = None
+                for i, url in enumerate(urls):
+                    host = urlsplit(url).netloc
+                    # Do not wait long for a slow mirror when others remain
+                    timeout = None if i == len(urls) - 1 else failover_timeout
+                    resp = None
+                    try:
+                        self.policy.before_request(host)
+                        resp = self.pool.get(url, headers, timeout=timeout)
+                        if resp.status != 200 and not (headers and resp.status == 304):
+                            msg = f"HTTP Error {resp.status}: {resp.reason}"
+                            raise OSError(msg)
+                    except CircuitOpenError as e:
+                        msg = f"Unable to retrieve URL: {url}\n{e}"
+                        error = CircuitOpenError(msg)
+                    except OSError as e:
+                        msg = f"Unable to retrieve URL: {url}\n{e}"
+                        error = OSError(msg)
+                        if (
+                            resp is not None
+                            and resp.status not in self.policy.retry_statuses
+                        ):
+                            # The server is up, the tile is just not there
+                            self.policy.record_success(host)
+                            raise error
+                        failed.add(host)
+                        if resp is not None:
+                            retry_headers = resp.headers
+                    else:
+                        self.policy.record_success(host)
+                        failed.discard(host)
+                        return resp
+                if not failed or attempt == self.policy.retries:
+                    # Every breaker is open, or out of retries
+                    raise error
+                self.policy.wait_to_retry(attempt, retry_headers)
+        finally:
+            for host in failed:
+                self.policy.record_failure(host)
+
+    def fetch_tiles(self, tile_coords, zoom, callback=None):
+        """
+        Given a collection of x, y tile coords and the zoom level,
+        retrieves all the tiles which are not yet cached, using up to
+        self.workers threads.
+        callback, if given, is called with each tile coord once that
+        tile is available.
+        Returns a dict mapping each tile coord to its local filename (or
+        file object, see retrieve_tile_image).
+        """
+        tile_coords = list(tile_coords)
+        filenames = {}
+        if self.workers <= 1:
+            for tile_coord in tile_coords:
+                filenames[tile_coord] = self.retrieve_tile_image(tile_coord, zoom)
+                if callback:
+                    callback(tile_coord)
+            return filenames
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {
+                executor.submit(self.retrieve_tile_image, tile_coord, zoom): tile_coord
+                for tile_coord in tile_coords
+            }
+            try:
+                for future in as_completed(futures):
+                    tile_coord = futures[future]
+                    filenames[tile_coord] = future.result()
+                    if callback:
+                        callback(tile_coord)
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+        return filenames
+
+    def get_tile_coords(self, bounds, zoom):
+        """
+        Given bounding lat_lons (in degrees) and a zoom level, returns
+        the list of (x, y) coords of the tiles covering them.
+        """
+        min_lat, max_lat, min_lon, max_lon = bounds
+        last = 2**zoom - 1
+        min_x, min_y = self.get_tile_coord(min_lon, max_lat, zoom)
+        max_x, max_y = self.get_tile_coord(max_lon, min_lat, zoom)
+        min_x, min_y = max(min_x, 0), max(min_y, 0)
+        max_x, max_y = min(max_x, last), min(max_y, last)
+        return [
+            (x, y) for x in range(min_x, max_x + 1) for y in range(min_y, max_y + 1)
+        ]
+
+    def get_area_tile_coords(self, zoom, boxes=(), polygons=()):
+        """
+        Given a zoom level, a list of (min_lat, max_lat, min_lon, max_lon)
+        bounding boxes and a list of polygons, each a list of (lat, lon)
+        points, returns the sorted list of (x, y) coords of the tiles
+        covering any of them.
+        """
+        tile_coords = set()
+        for box in boxes:
+            tile_coords.update(self.get_tile_coords(box, zoom))
+        for polygon in polygons:
+            for tile_coord in self.get_tile_coords(polygon_bounds(polygon), zoom):
+                max_lat, min_lon = self.tile_nw_lat_lon(tile_coord, zoom)
+                x, y = tile_coord
+                min_lat, max_lon = self.tile_nw_lat_lon((x + 1, y + 1), zoom)
+                tile_box = (min_lat, max_lat, min_lon, max_lon)
+                if box_intersects_polygon(tile_box, polygon):
+                    tile_coords.add(tile_coord)
+        return sorted(tile_coords)
+
+    def seed_tiles(self, zooms, boxes=(), polygons=(), rate=None, progress_file=None):
+        """
+        Downloads ahead of time the tiles covering the given areas at the
+        given zoom levels, skipping those already in the tile store, using
+        up to self.workers threads.
+        Arguments:
+            zooms - a zoom level or an iterable of zoom levels
+            boxes - a list of (min_lat, max_lat, min_lon, max_lon) bounding
+                 boxes
+            polygons - a list of polygons, each a list of (lat, lon) points
+            rate - maximum number of tiles to download per second,
+                 or None for no limit
+            progress_file - file in which seeded tiles are recorded, so that
+                 an interrupted seed resumes where it stopped. Tiles are
+                 recorded for this tile server and tile store only, so
+                 one file can be shared by seeds of several.
+        Failed tiles are counted and skipped.
+        Returns a SeedReport.
+        """
+        if isinstance(zooms, numbers.Integral):
+            zooms = [zooms]
+        limiter = TokenBucket(rate) if rate else None
+        # Progress is recorded as "<seed> <zoom>/<x>/<y>" lines, seed being
+        # a hash of the tile URL templates and of the tile store
+        md5 = hashlib.md5()
+        md5.update("\n".join([*self.urls, self.tile_store.get_location()]).encode())
+        seed_id = md5.hexdigest()[:10]
+        done = set()
+        if progress_file and path.isfile(progress_file):
+            with open(progress_file) as f:
+                done = {line.strip() for line in f}
+        counts = {"total": 0, "skipped": 0, "downloaded": 0, "failed": 0}
+        start = time.perf_counter()
+
+        def seed_one(tile_coord, zoom):
+            cached = self.tile_store.get_tile(self.get_tile_key(tile_coord, zoom))
+            if cached and cached.fresh:
+                return "skipped"
+            if limiter:
+                limiter.acquire()
             try:
-                urlretrieve(url, filename=filename)
-            except OSError as e:
-                msg = f"Unable to retrieve URL: {url}\n{e}"
-                raise OSError(msg)
-        return filename
+                self.retrieve_tile_image(tile_coord, zoom)
+            except OSError:
+                return "failed"
+            return "downloaded"
+
+        def record(future, name, journal) -> None:
+            outcome = future.result()
+            counts[outcome] += 1
+            if journal and outcome != "failed":
+                journal.write(name + "\n")
+                journal.flush()
+            if pbar is not None:
+                pbar.update()
+
+        pbar = self._progress_bar("Seeding tiles")
+        with (
+            open(progress_file, "a") if progress_file else nullcontext() as journal,
+            ThreadPoolExecutor(max_workers=self.workers) as executor,
+        ):
+            for zoom in zooms:
+                tile_coords = self.get_area_tile_coords(zoom, boxes, polygons)
+                counts["total"] += len(tile_coords)
+                if pbar is None:
+                    self._log(f"Seeding {len(tile_coords)} tiles at zoom {zoom}...")
+                pending = {}
+                for x, y in tile_coords:
+                    name = f"{seed_id} {zoom}/{x}/{y}"
+                    if name in done:
+                        counts["skipped"] += 1
+                        continue
+                    pending[executor.submit(seed_one, (x, y), zoom)] = name
+                    if len(pending) >= 4 * self.workers:
+                        finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            record(future, pending.pop(future), journal)
+                for future in as_completed(pending):
+                    record(future, pending[future], journal)
+        if pbar is not None:
+            pbar.close()
+
+        report = SeedReport(seconds=time.perf_counter() - start, **counts)
+        self._log(report)
+        return report
+
+    def build_pyramid(self, bounds, min_zoom, max_zoom):
+        """
+        Given bounding lat_lons (in degrees) and a range of zoom levels,
+        fills the tile store with the tiles covering them at every level,
+        downloading only the finest level (max_zoom): each coarser tile
+        whose four children are stored is made by downsampling them 2x2.
+        Coarser tiles with missing children (at the edges of the bounds)
+        are downloaded. Tiles already fresh in the store are kept.
+        Requires PIL.
+        Returns a dict with the number of tiles "downloaded", "derived"
+        and "skipped".
+        """
+        try:
+            import PIL.Image
+        except ImportError:
+            msg = "PIL could not be imported!"
+            raise ImportError(msg)
+
+        counts = {"downloaded": 0, "derived": 0, "skipped": 0}
+
+        def is_stored(tile_coord, zoom):
+            cached = self.tile_store.get_tile(self.get_tile_key(tile_coord, zoom))
+            return bool(cached and cached.fresh)
+
+        finest = [
+            tile_coord
+            for tile_coord in self.get_tile_coords(bounds, max_zoom)
+            if not is_stored(tile_coord, max_zoom)
+        ]
+        counts["skipped"] += len(self.get_tile_coords(bounds, max_zoom)) - len(finest)
+        self.fetch_tiles(finest, max_zoom)
+        counts["downloaded"] += len(finest)
+
+        for zoom in range(max_zoom - 1, min_zoom - 1, -1):
+            to_download = []
+            for x, y in self.get_tile_coords(bounds, zoom):
+                if is_stored((x, y), zoom):
+                    counts["skipped"] += 1
+                    continue
+                children = [
+                    self.tile_store.get_tile(self.get_tile_key((x2, y2), zoom + 1))
+                    for y2 in (2 * y, 2 * y + 1)
+                    for x2 in (2 * x, 2 * x + 1)
+                ]
+                if not all(children):
+                    to_download.append((x, y))
+                    continue
+                data = self._downsample([c.source for c in children], PIL.Image)
+                self.tile_store.put_tile(self.get_tile_key((x, y), zoom), data, {})
+                counts["derived"] += 1
+            self.fetch_tiles(to_download, zoom)
+            counts["downloaded"] += len(to_download)
+
+        self._log(
+            f"Pyramid: {counts['downloaded']} tiles downloaded, "
+            f"{counts['derived']} derived, {counts['skipped']} already cached"
+        )
+        return counts
+
+    def _downsample(self, sources, PILImage):
+        """
+        Given the sources of four tiles, in the order top left, top right,
+        bottom left, bottom right, returns the PNG data of their parent
+        tile, averaging each 2x2 block of pixels.
+        """
+        children = [PILImage.open(source) for source in sources]
+        has_alpha = any(
+            "A" in child.getbands() or "transparency" in child.info
+            for child in children
+        )
+        mode = "RGBA" if has_alpha else "RGB"
+        size = self.tile_size
+        whole = PILImage.new(mode, (2 * size, 2 * size))
+        for i, child in enumerate(children):
+            whole.paste(child.convert(mode), ((i % 2) * size, (i // 2) * size))
+        buf = io.BytesIO()
+        whole.reduce(2).save(buf, "PNG")
+        return buf.getvalue()
 
     def tile_nw_lat_lon(self, tile_coord, zoom):
         """
@@ -345,12 +1114,43 @@ class OSMManager:
         returns the (lat, lon) coordinates of the upper
         left corner of the tile.
         """
-        x_tile, y_tile = tile_coord
-        n = 2.0**zoom
-        lon_deg = x_tile / n * 360.0 - 180.0
-        lat_rad = math.atan(math.sinh(math.pi * (1 - 2 * y_tile / n)))
-        lat_deg = lat_rad * 180.0 / math.pi
-        return lat_deg, lon_deg
+        return projection.tile_nw_lat_lon(tile_coord, zoom)
+
+    def tile_nw_lat_lon_array(self, x_tile, y_tile, zoom):
+        """
+        Given NumPy arrays of x and y tile coords, and a zoom level (or an
+        array of them), returns arrays of the lat and lon of the upper
+        left corners of the tiles.
+        """
+        return projection.tile_nw_lat_lon_array(x_tile, y_tile, zoom)
+
+    def get_tile_range(self, bounds, zoom):
+        """
+        Given bounding lat_lons (in degrees), and an OSM zoom level,
+        returns (min_x, min_y, max_x, max_y), the tile coords of the top
+        left and bottom right tiles covering them.
+        """
+        min_lat, max_lat, min_lon, max_lon = bounds
+        min_x, min_y = self.get_tile_coord(min_lon, max_lat, zoom)
+        max_x, max_y = self.get_tile_coord(max_lon, min_lat, zoom)
+        return min_x, min_y, max_x, max_y
+
+    def get_osm_image_bounds(self, bounds, zoom):
+        """
+        Given bounding lat_lons (in degrees), and an OSM zoom level,
+        returns ((width, height), bounds) where (width, height) is the size
+        of the image create_osm_image() would construct, and bounds is the
+        (min_lat, max_lat, min_lon, max_lon) bounding box its tiles cover.
+        """
+        min_x, min_y, max_x, max_y = self.get_tile_range(bounds, zoom)
+        new_max_lat, new_min_lon = self.tile_nw_lat_lon((min_x, min_y), zoom)
+        new_min_lat, new_max_lon = self.tile_nw_lat_lon((max_x + 1, max_y + 1), zoom)
+        pix_width = (max_x - min_x + 1) * self.tile_size
+        pix_height = (max_y - min_y + 1) * self.tile_size
+        return (
+            (pix_width, pix_height),
+            (new_min_lat, new_max_lat, new_min_lon, new_max_lon),
+        )
 
     def create_osm_image(self, bounds, zoom):
         """
@@ -361,45 +1161,225 @@ class OSMManager:
         and bounds is the (min_lat, max_lat, min_lon, max_lon) bounding box
         which the tiles cover.
         """
-        min_lat, max_lat, min_lon, max_lon = bounds
         if not self.manager:
             msg = "No ImageManager was specified, cannot create image."
             raise ValueError(msg)
 
-        topleft = min_x, min_y = self.get_tile_coord(min_lon, max_lat, zoom)
-        max_x, max_y = self.get_tile_coord(max_lon, min_lat, zoom)
-        new_max_lat, new_min_lon = self.tile_nw_lat_lon(topleft, zoom)
-        new_min_lat, new_max_lon = self.tile_nw_lat_lon((max_x + 1, max_y + 1), zoom)
-        pix_width = (max_x - min_x + 1) * self.tile_size
-        pix_height = (max_y - min_y + 1) * self.tile_size
+        min_x, min_y, max_x, max_y = self.get_tile_range(bounds, zoom)
+        (pix_width, pix_height), new_bounds = self.get_osm_image_bounds(bounds, zoom)
+        start = time.perf_counter()
         self.manager.prepare_image(pix_width, pix_height)
         total = (1 + max_x - min_x) * (1 + max_y - min_y)
 
-        if tqdm:  # type: ignore[truthy-function]
-            pbar = tqdm(desc="Fetching tiles", total=total, unit="tile")
-        else:
-            print(f"Fetching {total} tiles...")
-
-        for x in range(min_x, max_x + 1):
-            for y in range(min_y, max_y + 1):
-                f_name = self.retrieve_tile_image((x, y), zoom)
-                x_off = self.tile_size * (x - min_x)
-                y_off = self.tile_size * (y - min_y)
-                self.manager.paste_image_file(f_name, (x_off, y_off))
-                if tqdm:  # type: ignore[truthy-function]
-                    pbar.update()
-        if tqdm:  # type: ignore[truthy-function]
+        pbar = self._progress_bar("Fetching tiles", total)
+        if pbar is None:
+            self._log(f"Fetching {total} tiles...")
+
+        def progress(tile_coord) -> None:
+            if pbar is not None:
+                pbar.update()
+
+        tile_coords = [
+            (x, y) for x in range(min_x, max_x + 1) for y in range(min_y, max_y + 1)
+        ]
+        self._paste_tiles(tile_coords, zoom, (min_x, min_y), progress)
+        if pbar is not None:
             pbar.close()
         else:
-            print("... done.")
-        return (
-            self.manager.get_image(),
-            (new_min_lat, new_max_lat, new_min_lon, new_max_lon),
+            self._log("... done.")
+        self.stats.add_time("render", time.perf_counter() - start)
+        return self.manager.get_image(), new_bounds
+
+    def iter_osm_image(self, bounds, zoom, window=None):
+        """
+        Given bounding lat_lons (in degrees), and an OSM zoom level,
+        constructs the image create_osm_image() would, one piece at a
+        time, so that the whole image is never held in memory.
+        window is the (columns, rows) size of each piece, in tiles.
+        Default None: strips the width of the image and one tile high.
+        Yields (img, (x, y)) for each piece, left to right then top to
+        bottom, where img is as returned by the image manager's
+        "get_image()" method and (x, y) is the position of its top left
+        corner in the whole image. img is destroyed when the next piece
+        is requested, so copy it if you need to keep it.
+        Use get_osm_image_bounds() for the size and bounds of the whole.
+        """
+        if not self.manager:
+            msg = "No ImageManager was specified, cannot create image."
+            raise ValueError(msg)
+
+        min_x, min_y, max_x, max_y = self.get_tile_range(bounds, zoom)
+        columns, rows = window or (max_x - min_x + 1, 1)
+        for top in range(min_y, max_y + 1, rows):
+            bottom = min(top + rows - 1, max_y)
+            for left in range(min_x, max_x + 1, columns):
+                right = min(left + columns - 1, max_x)
+                self.manager.prepare_image(
+                    (right - left + 1) * self.tile_size,
+                    (bottom - top + 1) * self.tile_size,
+                )
+                try:
+                    tile_coords = [
+                        (x, y)
+                        for x in range(left, right + 1)
+                        for y in range(top, bottom + 1)
+                    ]
+                    self._paste_tiles(tile_coords, zoom, (left, top))
+                    xy = (
+                        (left - min_x) * self.tile_size,
+                        (top - min_y) * self.tile_size,
+                    )
+                    yield self.manager.get_image(), xy
+                finally:
+                    self.manager.destroy_image()
+
+    def get_render_zoom(self, bounds, size, max_zoom=19):
+        """
+        Given bounding lat_lons (in degrees) and an image (width, height)
+        in pixels, returns the lowest zoom level, up to max_zoom, whose
+        tiles have at least as many pixels across the bounds as the image.
+        """
+        min_lat, max_lat, min_lon, max_lon = bounds
+        x0, y0 = projection.get_fractional_tile_coord(min_lon, max_lat, 0)
+        x1, y1 = projection.get_fractional_tile_coord(max_lon, min_lat, 0)
+        ratio = max(
+            size[0] / ((x1 - x0) * self.tile_size),
+            size[1] / ((y1 - y0) * self.tile_size),
         )
+        if ratio <= 1:
+            return 0
+        # Allow for rounding, so that an exact power of two is not exceeded
+        return min(math.ceil(math.log2(ratio) - 1e-9), max_zoom)
+
+    def get_render_crops(self, bounds, size, zoom):
+        """
+        Given bounding lat_lons (in degrees), an image (width, height) in
+        pixels and a zoom level, returns a dict mapping the coord of each
+        tile overlapping the bounds to the (xy, box, size) with which
+        render_osm_image() pastes it (see ImageManager.paste_image_file).
+        """
+        width, height = size
+        min_lat, max_lat, min_lon, max_lon = bounds
+        x0, y0 = projection.get_fractional_tile_coord(min_lon, max_lat, zoom)
+        x1, y1 = projection.get_fractional_tile_coord(max_lon, min_lat, zoom)
+
+        def spans(start, end, pixels):
+            """
+            Yields (tile, first, last, crop_start, crop_end) for the tiles
+            from start to end along one axis: the image pixels first to
+            last (exclusive) show the crop_start to crop_end tile pixels.
+            """
+            scale = pixels / (end - start)
+            for tile in range(int(start), math.ceil(end)):
+                # Shared edges are rounded alike, leaving neither gaps
+                # nor overlaps between neighbouring tiles
+                first = min(max(round((tile - start) * scale), 0), pixels)
+                last = min(max(round((tile + 1 - start) * scale), 0), pixels)
+                if first < last:
+                    crop_start = max(start + first / scale - tile, 0.0)
+                    crop_end = min(start + last / scale - tile, 1.0)
+                    yield (
+                        tile,
+                        first,
+                        last,
+                        crop_start * self.tile_size,
+                        crop_end * self.tile_size,
+                    )
+
+        crops = {}
+        for x, left, right, crop_left, crop_right in spans(x0, x1, width):
+            for y, top, bottom, crop_top, crop_bottom in spans(y0, y1, height):
+                crops[(x, y)] = (
+                    (left, top),
+                    (crop_left, crop_top, crop_right, crop_bottom),
+                    (right - left, bottom - top),
+                )
+        return crops
 
+    def render_osm_image(self, bounds, size, zoom=None, max_zoom=19):
+        """
+        Given bounding lat_lons (in degrees) and an image (width, height)
+        in pixels, creates an image of exactly that size covering exactly
+        those bounds, unlike create_osm_image() which returns whole tiles.
+        Only the tiles overlapping the bounds are retrieved, and each is
+        cropped and resampled into its place in the image, so the whole
+        tiled image is never made.
+        zoom is the level of the tiles to use. Default None: chosen by
+        get_render_zoom(bounds, size, max_zoom).
+        Returns the image, as returned by the image manager's
+        "get_image()" method. The image manager must implement
+        resize_image().
+        """
+        if not self.manager:
+            msg = "No ImageManager was specified, cannot create image."
+            raise ValueError(msg)
+
+        if zoom is None:
+            zoom = self.get_render_zoom(bounds, size, max_zoom)
+        crops = self.get_render_crops(bounds, size, zoom)
+        with self.stats.timer("render"):
+            self.manager.prepare_image(*size)
+            self._paste_tiles(list(crops), zoom, None, crops=crops)
+        return self.manager.get_image()
+
+    def _paste_tiles(
+        self, tile_coords, zoom, origin, progress=None, crops=None, filenames=None
+    ) -> None:
+        """
+        Retrieves the given tiles and pastes them into the image manager's
+        image, origin being the coord of the tile at its top left corner.
+        progress, if given, is called with each tile coord once done.
+        crops, if given, maps each tile coord to the (xy, box, size) with
+        which to paste a region of it instead (see paste_image_file).
+        filenames, if given, maps each tile coord to its already retrieved
+        local filename (or file object).
+        """
+        # Tiles retrieved first must stay in the store until pasted
+        keys = [self.get_tile_key(tile_coord, zoom) for tile_coord in tile_coords]
+        with self.tile_store.pin_tiles(keys):
+            parallel = self.decoders > 1 and self.manager.parallel_paste
+            if filenames is None and (self.workers > 1 or parallel):
+                # Download everything first, then paste
+                filenames = self.fetch_tiles(tile_coords, zoom, callback=progress)
+
+            def paste(tile_coord, f_name) -> None:
+                cache_key = self.get_tile_key(tile_coord, zoom)
+                if crops:
+                    xy, box, size = crops[tile_coord]
+                    self.manager.paste_image_file(
+                        f_name, xy, cache_key=cache_key, box=box, size=size
+                    )
+                    return
+                x, y = tile_coord
+                x_off = self.tile_size * (x - origin[0])
+                y_off = self.tile_size * (y - origin[1])
+                self.manager.paste_image_file(
+                    f_name, (x_off, y_off), cache_key=cache_key
+                )
+
+            if parallel:
+                with ThreadPoolExecutor(max_workers=self.decoders) as executor:
+                    # Tiles do not overlap, so the order does not matter
+                    futures = [
+                        executor.submit(paste, tile_coord, filenames[tile_coord])
+                        for tile_coord in tile_coords
+                    ]
+                    for future in as_completed(futures):
+                        future.result()
+                return
 
-# import httplib
-# httplib.HTTPConnection.debuglevel = 1
-opener = urllib.request.build_opener()
-opener.addheaders = [("User-agent", "OSMViz/1.1.0 +https://hugovk.dev/osmviz")]
-urllib.request.install_opener(opener)
+            for tile_coord in tile_coords:
+                if filenames is not None:
+                    paste(tile_coord, filenames[tile_coord])
+                else:
+                    paste(tile_coord, self.retrieve_tile_image(tile_coord, zoom))
+                    if progress:
+                        progress(tile_coord)
+
+    def close(self) -> None:
+        """
+        Closes the connections held open to the tile server, unless the
+        connection pool was given by the caller (who then closes it).
+        """
+        if self._owns_pool:
+            self.pool.close()
@@ -0,0 +1,179 @@
+"""
+Web Mercator projection, as used by OSM tiles:
+  - Scalar functions, working on one lat/lon with the math module
+  - Array functions (suffixed _array), working on NumPy arrays of lat/lon
+    (and zoom) in one vectorized call. These require NumPy.
+
+Both kinds share the same formulas, written once. Tile indices and pixel
+coordinates match exactly; other float results may differ in the last bits
+where NumPy's log, tan or sinh round differently from the C library's.
+"""
+
+# Copyright (c) 2010 Colin Bick, Robert Damphousse
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+from __future__ import annotations
+
+import math
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        msg = "NumPy could not be imported!"
+        raise ImportError(msg)
+    return numpy
+
+
+# Formulas, given a math-like module xp (math or numpy) #
+# (https://wiki.openstreetmap.org/wiki/Slippy_map_tilenames#Python)
+
+
+def _tile_xy(lon_deg, lat_deg, zoom, xp):
+    lat_rad = lat_deg * xp.pi / 180.0
+    n = 2.0**zoom
+    xtile = (lon_deg + 180.0) / 360.0 * n
+    ytile = (1.0 - xp.log(xp.tan(lat_rad) + (1 / xp.cos(lat_rad))) / xp.pi) / 2.0 * n
+    return xtile, ytile
+
+
+def _tile_lat_lon(x_tile, y_tile, zoom, xp):
+    n = 2.0**zoom
+    lon_deg = x_tile / n * 360.0 - 180.0
+    lat_rad = xp.arctan(xp.sinh(xp.pi * (1 - 2 * y_tile / n)))
+    lat_deg = lat_rad * 180.0 / xp.pi
+    return lat_deg, lon_deg
+
+
+def _screen_ratios(lat, lon, bounds):
+    x_ratio = (lon - bounds[2]) / (bounds[3] - bounds[2])
+    y_ratio = 1.0 - ((lat - bounds[0]) / (bounds[1] - bounds[0]))
+    return x_ratio, y_ratio
+
+
+class _Math:
+    """The math module, with NumPy's name for atan"""
+
+    pi = math.pi
+    log = staticmethod(math.log)
+    tan = staticmethod(math.tan)
+    cos = staticmethod(math.cos)
+    sinh = staticmethod(math.sinh)
+    arctan = staticmethod(math.atan)
+
+
+# Scalar functions #
+
+
+def get_fractional_tile_coord(lon_deg, lat_deg, zoom):
+    """
+    Given lon, lat coords in DEGREES, and a zoom level, returns the
+    fractional (x, y) tile coordinate of that point.
+    """
+    return _tile_xy(lon_deg, lat_deg, zoom, _Math)
+
+
+def get_tile_coord(lon_deg, lat_deg, zoom):
+    """
+    Given lon, lat coords in DEGREES, and a zoom level,
+    returns the (x, y) coordinate of the corresponding tile #.
+    """
+    xtile, ytile = _tile_xy(lon_deg, lat_deg, zoom, _Math)
+    return int(xtile), int(ytile)
+
+
+def tile_nw_lat_lon(tile_coord, zoom):
+    """
+    Given x, y coord of the tile (which may be fractional), and the zoom
+    level, returns the (lat, lon) coordinates of its upper left corner.
+    """
+    return _tile_lat_lon(tile_coord[0], tile_coord[1], zoom, _Math)
+
+
+def get_xy(lat, lon, bounds, screen_size):
+    """
+    Given coordinates in lat, lon, the (min_lat, max_lat, min_lon, max_lon)
+    bounds of the screen, and a screen size, returns the corresponding
+    (x, y) pixel coordinates.
+    """
+    x_ratio, y_ratio = _screen_ratios(lat, lon, bounds)
+    return int(x_ratio * screen_size[0]), int(y_ratio * screen_size[1])
+
+
+# Array functions #
+
+
+def get_fractional_tile_coord_array(lon_deg, lat_deg, zoom):
+    """
+    Given arrays of lon, lat coords in DEGREES, and a zoom level (or an
+    array of them), returns arrays of the fractional x and y tile
+    coordinates of those points.
+    """
+    np = _numpy()
+    return _tile_xy(
+        np.asarray(lon_deg, float), np.asarray(lat_deg, float), np.asarray(zoom), np
+    )
+
+
+def get_tile_coord_array(lon_deg, lat_deg, zoom):
+    """
+    Given arrays of lon, lat coords in DEGREES, and a zoom level (or an
+    array of them), returns int64 arrays of the x and y tile numbers.
+    """
+    xtile, ytile = get_fractional_tile_coord_array(lon_deg, lat_deg, zoom)
+    return xtile.astype("int64"), ytile.astype("int64")
+
+
+def get_pixel_coord_array(lon_deg, lat_deg, zoom, tile_size: int = 256):
+    """
+    Given arrays of lon, lat coords in DEGREES, and a zoom level (or an
+    array of them), returns float arrays of the x and y coordinates of
+    those points in pixels from the top left corner of tile (0, 0).
+    """
+    xtile, ytile = get_fractional_tile_coord_array(lon_deg, lat_deg, zoom)
+    return xtile * tile_size, ytile * tile_size
+
+
+def tile_nw_lat_lon_array(x_tile, y_tile, zoom):
+    """
+    Given arrays of x and y tile coords (which may be fractional), and a
+    zoom level (or an array of them), returns arrays of the lat and lon
+    of the upper left corners of those tiles.
+    """
+    np = _numpy()
+    return _tile_lat_lon(
+        np.asarray(x_tile, float), np.asarray(y_tile, float), np.asarray(zoom), np
+    )
+
+
+def get_xy_array(lat, lon, bounds, screen_size):
+    """
+    Given arrays of lat, lon coords, the (min_lat, max_lat, min_lon,
+    max_lon) bounds of the screen, and a screen size, returns int64
+    arrays of the corresponding x and y pixel coordinates.
+    """
+    np = _numpy()
+    x_ratio, y_ratio = _screen_ratios(
+        np.asarray(lat, float), np.asarray(lon, float), bounds
+    )
+    return (
+        (x_ratio * screen_size[0]).astype("int64"),
+        (y_ratio * screen_size[1]).astype("int64"),
+    )
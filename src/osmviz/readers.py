@@ -0,0 +1,408 @@
+"""
+Streaming readers of position logs, for building trajectories:
+  - read_csv(), read_gpx() and read_parquet() (which requires pyarrow)
+    yield chunks of (object id, time, lat, lon) fixes, so that files of
+    any size are read in constant memory
+  - TrajectoryBuilder gathers chunks into one Trajectory per object,
+    keeping the bounding box and time window as it goes
+  - FixPages sorts fixes into pages of a fixed duration, spilled to
+    temporary files, so that a long replay only needs one page of
+    fixes in memory at a time (see animation.PagedTrackingViz)
+
+Times may be numbers of seconds, or ISO 8601 date-times, which are
+converted to seconds since the epoch (UTC unless they give a time zone).
+
+    builder = TrajectoryBuilder()
+    for chunk in read_csv("avl.csv", columns=("vehicle", "ts", "lat", "lon")):
+        builder.add(chunk)
+    trajectories = builder.get_trajectories()
+"""
+
+# Copyright (c) 2010 Colin Bick, Robert Damphousse
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+from __future__ import annotations
+
+import csv
+import datetime as dt
+import math
+import os
+import shutil
+import tempfile
+import xml.etree.ElementTree as ET
+from array import array
+from operator import itemgetter
+
+from .trajectory import Trajectory
+
+Inf = float("inf")
+
+
+def parse_time(value) -> float:
+    """
+    Returns a time as seconds: numbers (or strings of them) as they are,
+    and date-times (datetime objects or ISO 8601 strings) as seconds
+    since the epoch, taken as UTC if they have no time zone.
+    """
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            # Python 3.10 does not accept a "Z" suffix
+            value = dt.datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    if isinstance(value, dt.datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=dt.timezone.utc)
+        return value.timestamp()
+    return float(value)
+
+
+def read_csv(
+    file,
+    columns=("id", "time", "lat", "lon"),
+    chunk_size: int = 10_000,
+    **kwargs,
+):
+    """
+    Reads a CSV file with a header row, yielding lists of up to
+    chunk_size (object id, time, lat, lon) fixes.
+    Arguments:
+        file - filename, or text file object
+        columns - names of the (object id, time, lat, lon) columns
+        chunk_size - number of fixes in each chunk
+        Other keyword arguments are passed to csv.reader(), such as
+        delimiter.
+    """
+    if isinstance(file, str):
+        with open(file, newline="") as f:
+            yield from read_csv(f, columns, chunk_size, **kwargs)
+        return
+    reader = csv.reader(file, **kwargs)
+    header = next(reader, None)
+    if header is None:
+        msg = f"CSV file needs a header row with columns {list(columns)}"
+        raise ValueError(msg)
+    try:
+        i_id, i_time, i_lat, i_lon = (header.index(column) for column in columns)
+    except ValueError:
+        msg = f"CSV file needs columns {list(columns)}, found {header}"
+        raise ValueError(msg) from None
+    chunk = []
+    for row in reader:
+        if not row:
+            continue
+        chunk.append(
+            (row[i_id], parse_time(row[i_time]), float(row[i_lat]), float(row[i_lon]))
+        )
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def read_gpx(file, chunk_size: int = 10_000):
+    """
+    Reads the track points of a GPX file, yielding lists of up to
+    chunk_size (object id, time, lat, lon) fixes. The object id of each
+    track is its name, or "track <n>" (counting from 1) without one.
+    Points without a time are skipped.
+    Arguments:
+        file - filename, or binary file object
+        chunk_size - number of fixes in each chunk
+    """
+    chunk = []
+    tracks = 0
+    name = None
+    in_segment = False
+    # The elements being read, from the root down
+    parents = []
+    for event, elem in ET.iterparse(file, events=("start", "end")):
+        tag = elem.tag.rsplit("}", 1)[-1]
+        if event == "start":
+            parents.append(elem)
+            if tag == "trk":
+                tracks += 1
+                name = None
+            elif tag == "trkseg":
+                in_segment = True
+            continue
+        if tag == "name" and tracks and not in_segment and name is None:
+            # The track's own name, not that of the file or of a point
+            name = (elem.text or "").strip() or None
+        elif tag == "trkpt":
+            when = next(
+                (
+                    child.text
+                    for child in elem
+                    if child.tag.rsplit("}", 1)[-1] == "time"
+                ),
+                None,
+            )
+            if when:
+                chunk.append(
+                    (
+                        name or f"track {tracks}",
+                        parse_time(when),
+                        float(elem.get("lat")),
+                        float(elem.get("lon")),
+                    )
+                )
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+        elif tag == "trkseg":
+            in_segment = False
+        parents.pop()
+        if parents and tag in ("trk", "trkseg", "trkpt", "rte", "rtept", "wpt"):
+            # Free the points (and everything else in the tree but the
+            # element being read) as we go
+            elem.clear()
+            parents[-1].remove(elem)
+    if chunk:
+        yield chunk
+
+
+def read_parquet(
+    filename: str,
+    columns=("id", "time", "lat", "lon"),
+    chunk_size: int = 65_536,
+):
+    """
+    Reads a Parquet file one batch of rows at a time, yielding lists of up
+    to chunk_size (object id, time, lat, lon) fixes. Only the four columns
+    are read. Requires pyarrow.
+    Arguments:
+        filename - path of the Parquet file
+        columns - names of the (object id, time, lat, lon) columns
+        chunk_size - number of fixes in each chunk
+    """
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        msg = "pyarrow could not be imported!"
+        raise ImportError(msg)
+    parquet_file = pyarrow.parquet.ParquetFile(filename)
+    for batch in parquet_file.iter_batches(
+        batch_size=chunk_size, columns=list(columns)
+    ):
+        ids, times, lats, lons = (
+            batch.column(column).to_pylist() for column in columns
+        )
+        yield [
+            (object_id, parse_time(time), float(lat), float(lon))
+            for object_id, time, lat, lon in zip(ids, times, lats, lons)
+        ]
+
+
+class _Extent:
+    """
+    The bounding box and time window of fixes, updated chunk by chunk.
+    """
+
+    def __init__(self) -> None:
+        self.bounding_box = (Inf, -Inf, Inf, -Inf)
+        self.time_window = (Inf, -Inf)
+        self.count = 0
+
+    def update(self, chunk) -> None:
+        if not chunk:
+            return
+        _, times, lats, lons = zip(*chunk)
+        min_lat, max_lat, min_lon, max_lon = self.bounding_box
+        self.bounding_box = (
+            min(min_lat, *lats),
+            max(max_lat, *lats),
+            min(min_lon, *lons),
+            max(max_lon, *lons),
+        )
+        begin, end = self.time_window
+        self.time_window = min(begin, *times), max(end, *times)
+        self.count += len(chunk)
+
+
+class TrajectoryBuilder:
+    """
+    Gathers chunks of (object id, time, lat, lon) fixes, as yielded by the
+    readers, into one Trajectory per object. The bounding box and time
+    window of all the fixes so far are kept as attributes.
+    """
+
+    def __init__(self) -> None:
+        self._fixes: dict = {}
+        self._extent = _Extent()
+
+    @property
+    def bounding_box(self):
+        """(min_lat, max_lat, min_lon, max_lon) of the fixes so far"""
+        return self._extent.bounding_box
+
+    @property
+    def time_window(self):
+        """(begin, end) times of the fixes so far"""
+        return self._extent.time_window
+
+    def add(self, chunk) -> None:
+        """
+        Adds a chunk (any iterable) of (object id, time, lat, lon) fixes.
+        The fixes of an object may come in any order, and in any chunks.
+        """
+        chunk = list(chunk)
+        self._extent.update(chunk)
+        fixes = self._fixes
+        for object_id, time, lat, lon in chunk:
+            track = fixes.get(object_id)
+            if track is None:
+                fixes[object_id] = [(time, lat, lon)]
+            else:
+                track.append((time, lat, lon))
+
+    def get_trajectories(self) -> dict:
+        """
+        Returns a dict mapping each object id to its Trajectory.
+        """
+        # Fixes at the same time stay in the order they were added
+        return {
+            object_id: Trajectory(sorted(track, key=itemgetter(0)))
+            for object_id, track in self._fixes.items()
+        }
+
+
+class FixPages:
+    """
+    Fixes sorted into pages of page_duration seconds each, spilled to
+    temporary files, for replaying logs too large to fit in memory.
+
+    The chunks are read once, as they are added. Each page holds, for
+    every object moving during it, its fixes within the page plus the
+    fix on either side, so that positions can be interpolated anywhere
+    in the page from that page alone. The fixes of each object must
+    come in time order, though fixes of different objects may be
+    interleaved, as in most logs.
+    """
+
+    def __init__(self, chunks=(), page_duration: float = 600.0, directory=None):
+        """
+        Creates FixPages.
+        Arguments:
+            chunks - iterable of chunks of (object id, time, lat, lon)
+                 fixes, as yielded by the readers, to add now
+            page_duration - seconds of time covered by each page
+            directory - where to make the temporary directory of pages.
+                 Default None: the system's temporary directory.
+        """
+        if page_duration <= 0:
+            msg = "page_duration must be positive"
+            raise ValueError(msg)
+        self.page_duration = page_duration
+        self.directory = tempfile.mkdtemp(prefix="osmviz-pages-", dir=directory)
+        self.ids: list = []
+        self._numbers: dict = {}
+        # Number of each object's page, and its last fix, so far
+        self._last: dict = {}
+        self._extent = _Extent()
+        for chunk in chunks:
+            self.add(chunk)
+
+    @property
+    def bounding_box(self):
+        """(min_lat, max_lat, min_lon, max_lon) of the fixes so far"""
+        return self._extent.bounding_box
+
+    @property
+    def time_window(self):
+        """(begin, end) times of the fixes so far"""
+        return self._extent.time_window
+
+    def get_page_number(self, sim_time) -> int:
+        """
+        Returns the number of the page covering sim_time.
+        """
+        return math.floor(sim_time / self.page_duration)
+
+    def _get_filename(self, page: int) -> str:
+        return os.path.join(self.directory, f"{page}.bin")
+
+    def add(self, chunk) -> None:
+        """
+        Adds a chunk (any iterable) of (object id, time, lat, lon) fixes
+        to the pages.
+        """
+        chunk = list(chunk)
+        self._extent.update(chunk)
+        pages: dict[int, array] = {}
+        numbers, last = self._numbers, self._last
+        for object_id, time, lat, lon in chunk:
+            number = numbers.get(object_id)
+            if number is None:
+                number = numbers[object_id] = len(self.ids)
+                self.ids.append(object_id)
+            page = self.get_page_number(time)
+            record = (number, time, lat, lon)
+            previous = last.get(number)
+            if previous is not None:
+                previous_page, previous_record = previous
+                if time < previous_record[1]:
+                    msg = f"Fixes of {object_id!r} are not in time order"
+                    raise ValueError(msg)
+                # Both ends of the segment go in every page it crosses
+                for crossed in range(previous_page + 1, page + 1):
+                    pages.setdefault(crossed, array("d")).extend(previous_record)
+                for crossed in range(previous_page, page):
+                    pages.setdefault(crossed, array("d")).extend(record)
+            pages.setdefault(page, array("d")).extend(record)
+            last[number] = page, record
+        for page, records in pages.items():
+            with open(self._get_filename(page), "ab") as f:
+                records.tofile(f)
+
+    def get_page(self, page: int):
+        """
+        Returns the fixes of a page, as a list of (object id, fixes) for
+        each object in it, where fixes is a list of (time, lat, lon) in
+        time order. Objects are in the order they first appeared in.
+        """
+        records = array("d")
+        try:
+            with open(self._get_filename(page), "rb") as f:
+                records.frombytes(f.read())
+        except FileNotFoundError:
+            return []
+        tracks: dict[int, list] = {}
+        for i in range(0, len(records), 4):
+            number = int(records[i])
+            fix = (records[i + 1], records[i + 2], records[i + 3])
+            track = tracks.get(number)
+            if track is None:
+                tracks[number] = [fix]
+            else:
+                track.append(fix)
+        return [(self.ids[number], track) for number, track in sorted(tracks.items())]
+
+    def close(self) -> None:
+        """
+        Deletes the temporary files of the pages.
+        """
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -0,0 +1,110 @@
+"""
+Tile seeding helpers:
+  - Enumerate the tiles covering bounding boxes or polygons
+  - Report on a seeding run
+
+Seeding itself is done by OSMManager.seed_tiles(), or from the command line:
+
+    python -m osmviz seed --bbox 59.9 60.3 24.7 25.3 --zoom 10-14 --cache tiles/
+"""
+
+# Copyright (c) 2010 Colin Bick, Robert Damphousse
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+from __future__ import annotations
+
+from typing import NamedTuple
+
+
+class SeedReport(NamedTuple):
+    """
+    The outcome of OSMManager.seed_tiles().
+    """
+
+    total: int
+    skipped: int
+    downloaded: int
+    failed: int
+    seconds: float
+
+    @property
+    def tiles_per_second(self) -> float:
+        """Download throughput"""
+        return self.downloaded / self.seconds if self.seconds else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.total} tiles: {self.downloaded} downloaded, "
+            f"{self.skipped} already cached, {self.failed} failed "
+            f"in {self.seconds:.1f}s ({self.tiles_per_second:.1f} tiles/s)"
+        )
+
+
+def polygon_bounds(polygon):
+    """
+    Returns the (min_lat, max_lat, min_lon, max_lon) box bounding a polygon.
+    """
+    lats = [lat for lat, lon in polygon]
+    lons = [lon for lat, lon in polygon]
+    return min(lats), max(lats), min(lons), max(lons)
+
+
+def point_in_polygon(lat, lon, polygon) -> bool:
+    """
+    Returns True if (lat, lon) is inside the polygon (even-odd rule).
+    """
+    inside = False
+    for (lat1, lon1), (lat2, lon2) in zip(polygon, polygon[1:] + polygon[:1]):
+        if (lat1 > lat) != (lat2 > lat):
+            cross_lon = lon1 + (lat - lat1) * (lon2 - lon1) / (lat2 - lat1)
+            if lon < cross_lon:
+                inside = not inside
+    return inside
+
+
+def _segments_cross(p1, p2, q1, q2) -> bool:
+    def orient(a, b, c):
+        return (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+
+    d1, d2 = orient(q1, q2, p1), orient(q1, q2, p2)
+    d3, d4 = orient(p1, p2, q1), orient(p1, p2, q2)
+    return d1 * d2 < 0 and d3 * d4 < 0
+
+
+def box_intersects_polygon(box, polygon) -> bool:
+    """
+    Returns True if the (min_lat, max_lat, min_lon, max_lon) box and the
+    polygon overlap, treating edges as straight lines in lat/lon.
+    """
+    min_lat, max_lat, min_lon, max_lon = box
+    corners = [
+        (min_lat, min_lon),
+        (min_lat, max_lon),
+        (max_lat, max_lon),
+        (max_lat, min_lon),
+    ]
+    if any(
+        min_lat <= lat <= max_lat and min_lon <= lon <= max_lon for lat, lon in polygon
+    ):
+        return True
+    if any(point_in_polygon(lat, lon, polygon) for lat, lon in corners):
+        return True
+    edges = list(zip(polygon, polygon[1:] + polygon[:1]))
+    sides = list(zip(corners, corners[1:] + corners[:1]))
+    return any(_segments_cross(a, b, c, d) for a, b in edges for c, d in sides)
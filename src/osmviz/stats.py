@@ -0,0 +1,153 @@
+"""
+Instrumentation for tile fetching and rendering:
+  - Counts events, such as tile store hits and misses, and bytes downloaded
+  - Times steps, such as downloads, decoding, pasting and whole renders
+  - Passes each event to listeners, for tracing
+  - Exports the totals as JSON or in the Prometheus text format
+
+A Stats object is kept by each OSMManager (as its stats attribute) and
+shared with its ImageManager. The names recorded are:
+
+  tile_hits, tile_misses - tiles found fresh in the tile store, or not
+  tile_revalidations - expired tiles the server said were unchanged
+  tile_stale - tiles used from the store after a failed download
+  download_bytes - bytes of tiles downloaded
+  download - time downloading each tile
+  decode - time loading each tile file (PIL and Pygame decode it here;
+           the NumPy managers decode while pasting)
+  paste - time pasting each tile into the image
+  render - wall time of each create_osm_image() or render_osm_image()
+"""
+
+# Copyright (c) 2010 Colin Bick, Robert Damphousse
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+from __future__ import annotations
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Stats:
+    """
+    Thread-safe counters and timers, by name.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._listeners: list = []
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Sets all counters and timers back to zero.
+        """
+        with self._lock:
+            self.counters: dict[str, float] = {}
+            # name -> [count, total seconds, max seconds]
+            self.timers: dict[str, list] = {}
+
+    def add_listener(self, listener) -> None:
+        """
+        Adds a function to be called with (kind, name, value) for each
+        event recorded, where kind is "count" or "time", and value is the
+        amount counted or the seconds taken. It is called in the thread
+        which recorded the event.
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener) -> None:
+        self._listeners.remove(listener)
+
+    def count(self, name: str, amount: float = 1) -> None:
+        """
+        Adds amount to the counter name.
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+        for listener in self._listeners:
+            listener("count", name, amount)
+
+    def add_time(self, name: str, seconds: float) -> None:
+        """
+        Records one occurrence of the step name, which took seconds.
+        """
+        with self._lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                self.timers[name] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                timer[2] = max(timer[2], seconds)
+        for listener in self._listeners:
+            listener("time", name, seconds)
+
+    @contextmanager
+    def timer(self, name: str):
+        """
+        Context manager recording the time taken by its block as the step
+        name, unless the block raises an exception.
+        """
+        start = time.perf_counter()
+        yield
+        self.add_time(name, time.perf_counter() - start)
+
+    def get_snapshot(self) -> dict:
+        """
+        Returns a dict of the counters, and of the count, total and
+        maximum seconds of each timer.
+        """
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "timers": {
+                    name: {"count": count, "total": total, "max": max_seconds}
+                    for name, (count, total, max_seconds) in self.timers.items()
+                },
+            }
+
+    def to_json(self, **kwargs) -> str:
+        """
+        Returns get_snapshot() as JSON. Keyword arguments are passed to
+        json.dumps().
+        """
+        return json.dumps(self.get_snapshot(), **kwargs)
+
+    def to_prometheus(self, prefix: str = "osmviz") -> str:
+        """
+        Returns the counters and timers in the Prometheus text exposition
+        format: counters as <prefix>_<name>_total, timers as summaries
+        <prefix>_<name>_seconds (with _count and _sum).
+        """
+        snapshot = self.get_snapshot()
+        lines = []
+        for name, value in sorted(snapshot["counters"].items()):
+            metric = f"{prefix}_{name}_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+        for name, timer in sorted(snapshot["timers"].items()):
+            metric = f"{prefix}_{name}_seconds"
+            lines += [
+                f"# TYPE {metric} summary",
+                f"{metric}_count {timer['count']}",
+                f"{metric}_sum {timer['total']}",
+            ]
+        return "\n".join(lines) + "\n"
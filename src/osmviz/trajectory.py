@@ -0,0 +1,156 @@
+"""
+Trajectories of moving objects, from timestamped position fixes:
+  - Positions between fixes are interpolated linearly, from slopes
+    computed once
+  - Lookups remember the last segment used, so that a steadily advancing
+    time costs O(1), and any other time a binary search, O(log n)
+  - Fixes are projected to pixels once per get_xy function (once per
+    window), and pixel positions interpolated from those
+
+A Trajectory can be given to TrackingViz in place of a function of time:
+
+    track = Trajectory([(0, 60.16, 24.93), (60, 60.17, 24.95), ...])
+    viz = TrackingViz("Bus 1", "bus.png", track)
+"""
+
+# Copyright (c) 2010 Colin Bick, Robert Damphousse
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+from __future__ import annotations
+
+from bisect import bisect_right
+from collections.abc import Callable
+
+
+def _slopes(times, values):
+    """
+    Returns the rate of change of values over each segment between
+    successive times, 0 for empty segments and after the last fix.
+    """
+    slopes = []
+    for i in range(len(times) - 1):
+        span = times[i + 1] - times[i]
+        slopes.append((values[i + 1] - values[i]) / span if span else 0.0)
+    slopes.append(0.0)
+    return slopes
+
+
+class Trajectory:
+    """
+    The path of an object through time, from a sorted sequence of
+    (time, lat, lon) fixes. The object exists from the time of the first
+    fix to that of the last, and moves in a straight line between fixes.
+    """
+
+    def __init__(self, fixes) -> None:
+        """
+        Given a sequence of (time, lat, lon) fixes (such as a list of
+        tuples, or an N x 3 NumPy array) in increasing time order,
+        creates a Trajectory.
+        Raises ValueError if there are no fixes, or they are out of order.
+        """
+        rows = [tuple(map(float, fix)) for fix in fixes]
+        if not rows:
+            msg = "A trajectory needs at least one (time, lat, lon) fix"
+            raise ValueError(msg)
+        self.times, self.lats, self.lons = (list(column) for column in zip(*rows))
+        if any(t1 < t0 for t0, t1 in zip(self.times, self.times[1:])):
+            msg = "Trajectory fixes must be in increasing time order"
+            raise ValueError(msg)
+        self.lat_slopes = _slopes(self.times, self.lats)
+        self.lon_slopes = _slopes(self.times, self.lons)
+        # The end of the segment from each fix, empty after the last fix
+        self._next_times = self.times[1:] + self.times[-1:]
+        # Index of the fix starting the segment used last
+        self._cursor = 0
+        # Pixel positions of the fixes, and slopes, for the last get_xy
+        self._get_xy: Callable | None = None
+        self._pixels: tuple[tuple, tuple, list[float], list[float]] | None = None
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def get_time_interval(self):
+        """
+        Returns the (begin, end) times of the first and last fixes.
+        """
+        return self.times[0], self.times[-1]
+
+    def get_bounding_box(self):
+        """
+        Returns the (min_lat, max_lat, min_lon, max_lon) bounds of the
+        fixes, which the object never leaves.
+        """
+        return min(self.lats), max(self.lats), min(self.lons), max(self.lons)
+
+    def find_fix(self, sim_time):
+        """
+        Returns the index of the last fix at or before sim_time, or None
+        if sim_time is outside the trajectory's time interval.
+        """
+        i = self._cursor
+        if self.times[i] <= sim_time < self._next_times[i]:
+            return i
+        times = self.times
+        if not times[0] <= sim_time <= times[-1]:
+            return None
+        # The next segment, or a search
+        i += 1
+        if not (i < len(times) and times[i] <= sim_time < self._next_times[i]):
+            i = bisect_right(times, sim_time) - 1
+        self._cursor = i
+        return i
+
+    def get_lat_lon_at_time(self, sim_time):
+        """
+        Returns the interpolated (lat, lon) at sim_time, or None if the
+        object does not exist then.
+        """
+        i = self.find_fix(sim_time)
+        if i is None:
+            return None
+        dt = sim_time - self.times[i]
+        return (
+            self.lats[i] + dt * self.lat_slopes[i],
+            self.lons[i] + dt * self.lon_slopes[i],
+        )
+
+    # A Trajectory can be used as a TrackingViz's get_lat_lon_at_time_func
+    __call__ = get_lat_lon_at_time
+
+    def get_xy_at_time(self, sim_time, get_xy):
+        """
+        Returns the (x, y) pixel position at sim_time, or None if the
+        object does not exist then. get_xy is a function of (lat, lon)
+        returning pixel coordinates; the fixes are projected with it when
+        it first differs from the last one given, and the position is
+        interpolated between the projected fixes. This agrees with
+        projecting get_lat_lon_at_time() to within a pixel for the
+        Simulation's projection, which is linear in lat and lon.
+        """
+        i = self.find_fix(sim_time)
+        if i is None:
+            return None
+        if get_xy is not self._get_xy:
+            xs, ys = zip(*(get_xy(*ll) for ll in zip(self.lats, self.lons)))
+            self._pixels = xs, ys, _slopes(self.times, xs), _slopes(self.times, ys)
+            self._get_xy = get_xy
+        xs, ys, x_slopes, y_slopes = self._pixels
+        dt = sim_time - self.times[i]
+        return int(xs[i] + dt * x_slopes[i]), int(ys[i] + dt * y_slopes[i])
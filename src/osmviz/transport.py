@@ -0,0 +1,497 @@
+"""
+HTTP transport for tile downloads:
+  - Keeps persistent (keep-alive) connections to each tile server, so
+    consecutive tiles do not each pay for a new TCP/TLS handshake
+  - Limits the number of connections open to any one host
+  - Connects through the proxies set in the environment (HTTP_PROXY,
+    HTTPS_PROXY and NO_PROXY), as urllib does
+  - Provides a TokenBucket to limit the rate of requests
+  - Provides a RetryPolicy to pace, retry and stop requests to failing
+    servers
+
+A ConnectionPool is owned by each OSMManager by default, but one pool can
+be shared by several managers. Unlike urllib.request.install_opener(), it
+does not change the behaviour of any other code in the process.
+"""
+
+# Copyright (c) 2010 Colin Bick, Robert Damphousse
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+from __future__ import annotations
+
+import base64
+import http.client
+import random
+import threading
+import time
+import urllib.request
+from email.utils import parsedate_to_datetime
+from typing import NamedTuple
+from urllib.parse import unquote, urljoin, urlsplit
+
+USER_AGENT = "OSMViz/1.1.0 +https://hugovk.dev/osmviz"
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+
+class Response(NamedTuple):
+    """
+    A fully read HTTP response.
+    """
+
+    status: int
+    reason: str
+    headers: http.client.HTTPMessage
+    body: bytes
+
+
+class ConnectionPool:
+    """
+    A thread-safe pool of persistent HTTP(S) connections, kept per host.
+    At most max_per_host requests to the same host are in flight at
+    once; other callers wait for a connection to be released.
+    """
+
+    def __init__(
+        self,
+        max_per_host: int = 2,
+        timeout: float = 30.0,
+        headers=None,
+        proxies=None,
+    ):
+        """
+        Constructs a ConnectionPool.
+        Arguments:
+            max_per_host - maximum number of connections open to one host
+            timeout - socket timeout in seconds for each connection
+            headers - dict of extra headers to send with every request.
+                 A User-Agent identifying OSMViz is sent unless overridden.
+            proxies - dict mapping URL schemes to the URLs of the proxies
+                 to use for them. Default None: those of the environment,
+                 from urllib.request.getproxies(). Hosts for which
+                 urllib.request.proxy_bypass() is true (such as those in
+                 NO_PROXY) are connected to directly.
+        """
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.headers = {"User-Agent": USER_AGENT}
+        if headers:
+            self.headers.update(headers)
+        if proxies is None:
+            proxies = urllib.request.getproxies()
+        self.proxies = proxies
+        self._idle: dict[tuple[str, str], list[http.client.HTTPConnection]] = {}
+        self._slots: dict[tuple[str, str], threading.BoundedSemaphore] = {}
+        self._proxy_urls: dict[tuple[str, str], str | None] = {}
+        self._lock = threading.Lock()
+
+    def _slot(self, key):
+        """
+        Returns the semaphore limiting connections to the given host.
+        """
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = threading.BoundedSemaphore(self.max_per_host)
+                self._slots[key] = slot
+        return slot
+
+    def _connect(self, key):
+        """
+        Returns (connection, reused) for the given host, taking an idle
+        connection from the pool if there is one.
+        """
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        return self._new_connection(key), False
+
+    def _get_proxy(self, key):
+        """
+        Returns the URL of the proxy through which to reach the given
+        host, or None to connect to it directly.
+        """
+        with self._lock:
+            if key in self._proxy_urls:
+                return self._proxy_urls[key]
+        scheme, netloc = key
+        proxy = self.proxies.get(scheme)
+        if proxy and urllib.request.proxy_bypass(netloc):
+            proxy = None
+        if proxy and "://" not in proxy:
+            proxy = "http://" + proxy
+        with self._lock:
+            self._proxy_urls[key] = proxy
+        return proxy
+
+    @staticmethod
+    def _get_proxy_headers(proxy):
+        """
+        Returns the headers with which to authenticate to a proxy, from
+        the user name and password in its URL, if any.
+        """
+        parts = urlsplit(proxy)
+        if parts.username is None:
+            return {}
+        credentials = f"{unquote(parts.username)}:{unquote(parts.password or '')}"
+        token = base64.b64encode(credentials.encode()).decode("ascii")
+        return {"Proxy-Authorization": f"Basic {token}"}
+
+    def _new_connection(self, key):
+        scheme, netloc = key
+        if scheme not in ("http", "https"):
+            msg = f"Unsupported URL scheme: {scheme}"
+            raise ValueError(msg)
+        proxy = self._get_proxy(key)
+        if proxy is None:
+            host = netloc
+        else:
+            parts = urlsplit(proxy)
+            host = parts.netloc.rpartition("@")[2]
+        if scheme == "http":
+            if proxy is not None and parts.scheme == "https":
+                return http.client.HTTPSConnection(host, timeout=self.timeout)
+            return http.client.HTTPConnection(host, timeout=self.timeout)
+        conn = http.client.HTTPSConnection(host, timeout=self.timeout)
+        if proxy is not None:
+            # Through a CONNECT tunnel, TLS being with the tile server
+            conn.set_tunnel(netloc, headers=self._get_proxy_headers(proxy))
+        return conn
+
+    def _release(self, key, conn) -> None:
+        with self._lock:
+            self._idle.setdefault(key, []).append(conn)
+
+    @staticmethod
+    def _set_timeout(conn, timeout: float) -> None:
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+
+    def request(
+        self, method: str, url: str, headers=None, timeout: float | None = None
+    ) -> Response:
+        """
+        Sends a single request and returns the Response, whatever its
+        status. Redirects are not followed.
+        timeout, if given, replaces the pool's for this request: it bounds
+        the wait to connect and for each read, so that a server slow to
+        answer can be given up early.
+        Raises OSError if the server cannot be reached.
+        """
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+        all_headers = dict(self.headers)
+        if headers:
+            all_headers.update(headers)
+        proxy = self._get_proxy(key) if parts.scheme == "http" else None
+        if proxy is not None:
+            # A proxy is sent the whole URL, and any credentials for it
+            target = f"http://{parts.netloc}{target}"
+            all_headers.update(self._get_proxy_headers(proxy))
+        if timeout is None:
+            timeout = self.timeout
+
+        with self._slot(key):
+            conn, reused = self._connect(key)
+            while True:
+                self._set_timeout(conn, timeout)
+                try:
+                    conn.request(method, target, headers=all_headers)
+                    resp = conn.getresponse()
+                    body = resp.read()
+                except (OSError, http.client.HTTPException) as e:
+                    conn.close()
+                    if reused:
+                        # The server may have closed an idle keep-alive
+                        # connection: try once more on a fresh one
+                        conn, reused = self._new_connection(key), False
+                        continue
+                    if isinstance(e, OSError):
+                        raise
+                    msg = f"Bad response from {parts.netloc}: {e!r}"
+                    raise OSError(msg) from e
+                break
+
+            if resp.will_close:
+                conn.close()
+            else:
+                self._release(key, conn)
+
+        return Response(resp.status, resp.reason, resp.headers, body)
+
+    def get(
+        self,
+        url: str,
+        headers=None,
+        max_redirects: int = 5,
+        timeout: float | None = None,
+    ) -> Response:
+        """
+        Sends a GET request, following up to max_redirects redirects,
+        and returns the final Response. timeout is as for request().
+        """
+        for _ in range(max_redirects + 1):
+            resp = self.request("GET", url, headers, timeout)
+            location = resp.headers.get("Location")
+            if resp.status not in REDIRECT_CODES or not location:
+                return resp
+            url = urljoin(url, location)
+        msg = f"Too many redirects for {url}"
+        raise OSError(msg)
+
+    def close(self) -> None:
+        """
+        Closes all idle connections. The pool can still be used afterwards.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket rate limiter, allowing rate events per
+    second on average, in bursts of up to burst events.
+    """
+
+    def __init__(self, rate: float, burst: float = 1) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Takes one token, first sleeping until there is one.
+        Returns the number of seconds slept.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._last) * self.rate
+            )
+            self._last = now
+            self._tokens -= 1
+            # A negative balance is a debt the caller waits out
+            delay = max(0.0, -self._tokens / self.rate)
+        if delay:
+            time.sleep(delay)
+        return delay
+
+
+class CircuitOpenError(OSError):
+    """
+    Raised instead of sending a request to a host which has failed too
+    often recently (see RetryPolicy).
+    """
+
+
+class RetryPolicy:
+    """
+    A thread-safe policy for requests to tile servers, kept per host:
+      - Rate limits requests with a TokenBucket
+      - Retries failed requests (network errors and the statuses in
+        retry_statuses) after an exponential backoff with full jitter,
+        or after the delay asked for by a Retry-After header
+      - Opens a circuit breaker after failure_threshold consecutive
+        failures: requests then fail at once with CircuitOpenError for
+        reset_after seconds, after which one trial request is let through.
+        Its success closes the breaker again.
+      - Gives up on a mirror which is slow to answer after
+        failover_timeout seconds when another mirror remains to be
+        tried. This counts as a failure, so a mirror which is up but
+        slow ends up skipped by its breaker too.
+
+    The counts and delays so far are returned by get_metrics().
+    """
+
+    retry_statuses = frozenset((429, 500, 502, 503, 504))
+
+    def __init__(
+        self,
+        rate: float | None = None,
+        burst: float = 1,
+        retries: int = 3,
+        backoff: float = 0.5,
+        max_backoff: float = 30.0,
+        failure_threshold: int = 5,
+        reset_after: float = 30.0,
+        failover_timeout: float = 5.0,
+    ) -> None:
+        """
+        Constructs a RetryPolicy.
+        Arguments:
+            rate - maximum requests per second to each host, on average,
+                 or None for no limit
+            burst - number of requests to a host which may be sent at
+                 once, over the average rate
+            retries - number of times a failed request is retried
+            backoff - maximum delay in seconds before the first retry,
+                 doubling for each retry after it
+            max_backoff - maximum delay before any retry, including
+                 delays asked for with Retry-After
+            failure_threshold - consecutive failures (after retries) to a
+                 host which open its circuit breaker, or None for no breaker
+            reset_after - seconds for which an open breaker stays open
+            failover_timeout - seconds to wait for a mirror to connect,
+                 and for each read, before trying the next mirror, or
+                 None to wait for the connection pool's timeout
+        """
+        self.rate = rate
+        self.burst = burst
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.failover_timeout = failover_timeout
+        self._buckets: dict[str, TokenBucket] = {}
+        self._failures: dict[str, int] = {}
+        self._open_until: dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retried = 0
+        self.failures = 0
+        self.rejected = 0
+        self.circuit_opens = 0
+        self.throttle_seconds = 0.0
+        self.backoff_seconds = 0.0
+
+    def before_request(self, host: str) -> None:
+        """
+        To be called before each request to host: raises
+        CircuitOpenError if its breaker is open, otherwise waits for
+        the rate limit.
+        """
+        with self._lock:
+            open_until = self._open_until.get(host)
+            if open_until:
+                now = time.monotonic()
+                if now < open_until:
+                    self.rejected += 1
+                    msg = f"Too many failures from {host}, not retrying yet"
+                    raise CircuitOpenError(msg)
+                # Half open: this request is the trial, the others wait
+                # for its outcome
+                self._open_until[host] = now + self.reset_after
+            self.requests += 1
+            bucket = None
+            if self.rate:
+                bucket = self._buckets.get(host)
+                if bucket is None:
+                    bucket = TokenBucket(self.rate, self.burst)
+                    self._buckets[host] = bucket
+        if bucket:
+            delay = bucket.acquire()
+            with self._lock:
+                self.throttle_seconds += delay
+
+    def record_success(self, host: str) -> None:
+        """
+        To be called when host answers a request, closing its breaker.
+        """
+        with self._lock:
+            self._failures.pop(host, None)
+            self._open_until.pop(host, None)
+
+    def record_failure(self, host: str) -> None:
+        """
+        To be called when a request to host fails for good, which may
+        open its breaker.
+        """
+        with self._lock:
+            self.failures += 1
+            failures = self._failures.get(host, 0) + 1
+            self._failures[host] = failures
+            if self.failure_threshold and failures >= self.failure_threshold:
+                if failures == self.failure_threshold:
+                    self.circuit_opens += 1
+                self._open_until[host] = time.monotonic() + self.reset_after
+
+    def get_retry_delay(self, attempt: int, headers=None) -> float:
+        """
+        Returns the seconds to wait before retrying a request for the
+        attempt-th time (from 0), given the headers of the failed
+        response, if any.
+        """
+        retry_after = get_retry_after(headers) if headers else None
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        return random.uniform(0, min(self.backoff * 2**attempt, self.max_backoff))
+
+    def wait_to_retry(self, attempt: int, headers=None) -> None:
+        """
+        Sleeps before retrying a request (see get_retry_delay).
+        """
+        delay = self.get_retry_delay(attempt, headers)
+        with self._lock:
+            self.retried += 1
+            self.backoff_seconds += delay
+        time.sleep(delay)
+
+    def get_metrics(self) -> dict:
+        """
+        Returns a dict of the numbers of requests sent, retried, failed
+        for good and rejected by an open breaker, of breakers opened, and
+        of the seconds spent waiting for the rate limit and for retries.
+        """
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "retried": self.retried,
+                "failures": self.failures,
+                "rejected": self.rejected,
+                "circuit_opens": self.circuit_opens,
+                "throttle_seconds": self.throttle_seconds,
+                "backoff_seconds": self.backoff_seconds,
+            }
+
+
+def get_retry_after(headers, now: float | None = None) -> float | None:
+    """
+    Returns the seconds to wait given by a Retry-After header, which is
+    either a number of seconds or an HTTP date, or None if there is none.
+    """
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+    now = time.time() if now is None else now
+    return max(0.0, when - now)
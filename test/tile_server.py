@@ -0,0 +1,176 @@
+"""
+A local stand-in for a slippy map tile server, shared by the unit tests
+and the benchmarks through their tile_server fixtures:
+  - Serves synthetic PNGs at /{z}/{x}/{y}.png, encoding each tile once
+  - Counts requests per path and accepted connections
+  - Can stand in for an HTTP proxy, answering requests for any host
+  - Can be made slow, or to fail
+"""
+
+from __future__ import annotations
+
+import io
+import socket
+import threading
+import time
+from collections import Counter
+from collections.abc import Iterator
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+
+def synthetic_tile(
+    zoom: int, x: int, y: int, size: int = 256, textured: bool = False
+) -> bytes:
+    """
+    Returns the PNG bytes of a tile depending on zoom, x and y, so that
+    misplaced tiles show up in comparisons. A plain tile is one colour;
+    a textured one has 16 x 16 pixel blocks of random colours, so that
+    it takes a realistic time to decode.
+    """
+    import numpy as np
+    from PIL import Image
+
+    if textured:
+        rng = np.random.default_rng((zoom, x, y))
+        base = rng.integers(0, 256, (16, 16, 3), dtype=np.uint8)
+        pixels = np.kron(base, np.ones((size // 16, size // 16, 1), dtype=np.uint8))
+        img = Image.fromarray(pixels)
+    else:
+        colour = ((x * 37) % 256, (y * 59) % 256, (zoom * 83) % 256)
+        img = Image.new("RGB", (size, size), colour)
+    buf = io.BytesIO()
+    img.save(buf, "PNG")
+    return buf.getvalue()
+
+
+class TileServer(ThreadingHTTPServer):
+    """
+    Serves synthetic_tile() PNGs at /{z}/{x}/{y}.png.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, textured: bool = False) -> None:
+        super().__init__(("127.0.0.1", 0), TileHandler)
+        self.textured = textured
+        self.tiles: dict[tuple[int, int, int], bytes] = {}
+        self.requests: Counter[str] = Counter()
+        self.connections = 0
+        self.not_modified = 0
+        self.user_agents: set[str] = set()
+        self.proxy_authorizations: set[str] = set()
+        # Sent as Cache-Control: max-age, if not None
+        self.max_age: int | None = None
+        # Seconds to wait before answering each request
+        self.delay = 0.0
+        # Error statuses to answer the next requests with, in order, and
+        # the Retry-After header to send with them, if not None
+        self.errors: list[int] = []
+        self.retry_after: str | None = None
+        self.lock = threading.Lock()
+
+    def get_request(self):
+        request = super().get_request()
+        with self.lock:
+            self.connections += 1
+        return request
+
+    def get_tile(self, zoom: int, x: int, y: int) -> bytes:
+        """
+        Returns the PNG bytes of a tile, encoding it on first use.
+        """
+        with self.lock:
+            tile = self.tiles.get((zoom, x, y))
+        if tile is None:
+            tile = synthetic_tile(zoom, x, y, textured=self.textured)
+            with self.lock:
+                self.tiles[zoom, x, y] = tile
+        return tile
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}/{{z}}/{{x}}/{{y}}.png"
+
+
+class TileHandler(BaseHTTPRequestHandler):
+    server: TileServer
+    protocol_version = "HTTP/1.1"
+
+    def setup(self) -> None:
+        super().setup()
+        # Headers and body are sent apart: do not let Nagle's algorithm
+        # hold the body back waiting for a delayed ACK
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_GET(self) -> None:
+        with self.server.lock:
+            self.server.requests[self.path] += 1
+            self.server.user_agents.add(self.headers.get("User-Agent", ""))
+            self.server.proxy_authorizations.add(
+                self.headers.get("Proxy-Authorization", "")
+            )
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        with self.server.lock:
+            error = self.server.errors.pop(0) if self.server.errors else None
+        if error:
+            self.send_response(error)
+            if self.server.retry_after is not None:
+                self.send_header("Retry-After", self.server.retry_after)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        # The whole URL if sent to a proxy
+        path = urlsplit(self.path).path
+        try:
+            z, x, y = (int(v) for v in path.removesuffix(".png").split("/")[1:])
+        except ValueError:
+            self.send_error(404)
+            return
+        etag = f'"{z}-{x}-{y}"'
+        if self.headers.get("If-None-Match") == etag:
+            with self.server.lock:
+                self.server.not_modified += 1
+            self.send_response(304)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = self.server.get_tile(z, x, y)
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("ETag", etag)
+        if self.server.max_age is not None:
+            self.send_header("Cache-Control", f"max-age={self.server.max_age}")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_CONNECT(self) -> None:
+        # Counted, but tunnels are not supported
+        with self.server.lock:
+            self.server.requests["CONNECT " + self.path] += 1
+            self.server.proxy_authorizations.add(
+                self.headers.get("Proxy-Authorization", "")
+            )
+        self.send_error(501)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+@contextmanager
+def serve_tiles(textured: bool = False) -> Iterator[TileServer]:
+    """
+    Runs a TileServer in a background thread for the duration of the
+    with block.
+    """
+    server = TileServer(textured)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
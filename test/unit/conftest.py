@@ -0,0 +1,23 @@
+"""
+Shared fixtures for unit tests
+"""
+
+from __future__ import annotations
+
+import pytest
+from tile_server import serve_tiles
+from tile_server import synthetic_tile as _synthetic_tile
+
+
+@pytest.fixture()
+def tile_server():
+    with serve_tiles() as server:
+        yield server
+
+
+@pytest.fixture()
+def synthetic_tile():
+    """
+    The function making the tiles that tile_server serves.
+    """
+    return _synthetic_tile
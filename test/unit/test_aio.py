@@ -0,0 +1,173 @@
+"""
+Unit tests AsyncOSMManager
+"""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from osmviz.aio import AsyncOSMManager
+from osmviz.cache import DiskTileCache
+from osmviz.manager import OSMManager, PILImageManager
+
+BOUNDS = (59.9225115912, 60.297839409, 24.7828044415, 25.2544966708)
+
+
+def test_create_osm_image(tile_server, tmp_path) -> None:
+    # Arrange
+    async def render():
+        async with AsyncOSMManager(
+            image_manager=PILImageManager("RGB"),
+            url=tile_server.url,
+            cache=str(tmp_path / "async"),
+        ) as osm:
+            return await asyncio.gather(
+                osm.create_osm_image(BOUNDS, 11), osm.create_osm_image(BOUNDS, 10)
+            )
+
+    sync = OSMManager(
+        image_manager=PILImageManager("RGB"),
+        url=tile_server.url,
+        cache=str(tmp_path / "sync"),
+    )
+
+    # Act
+    (img11, bounds11), (img10, _) = asyncio.run(render())
+
+    # Assert
+    expected, expected_bounds = sync.create_osm_image(BOUNDS, 11)
+    assert bounds11 == expected_bounds
+    assert img11.tobytes() == expected.tobytes()
+    assert img10.size == sync.get_osm_image_bounds(BOUNDS, 10)[0]
+
+
+def test_render_osm_image(tile_server, tmp_path) -> None:
+    # Arrange
+    async def render():
+        async with AsyncOSMManager(
+            image_manager=PILImageManager("RGB"),
+            url=tile_server.url,
+            cache=str(tmp_path),
+        ) as osm:
+            return await osm.render_osm_image(BOUNDS, (300, 200))
+
+    sync = OSMManager(
+        image_manager=PILImageManager("RGB"), url=tile_server.url, cache=str(tmp_path)
+    )
+
+    # Act
+    img = asyncio.run(render())
+
+    # Assert
+    assert img.tobytes() == sync.render_osm_image(BOUNDS, (300, 200)).tobytes()
+
+
+@pytest.mark.parametrize("render", [True, False])
+def test_create_osm_image__keeps_tiles_until_pasted(
+    tile_server, tmp_path, render
+) -> None:
+    # Arrange
+    # Room for a few tiles only, while 20 are fetched before pasting
+    disk_cache = DiskTileCache(str(tmp_path), max_bytes=3000)
+
+    async def create():
+        async with AsyncOSMManager(
+            image_manager=PILImageManager("RGB"),
+            url=tile_server.url,
+            cache=str(tmp_path),
+            tile_store=disk_cache,
+        ) as osm:
+            if render:
+                return await osm.render_osm_image(BOUNDS, (300, 200), zoom=11)
+            img, _ = await osm.create_osm_image(BOUNDS, 11)
+            return img
+
+    # Act
+    img = asyncio.run(create())
+
+    # Assert
+    assert img.size == ((300, 200) if render else (1024, 1280))
+    assert disk_cache.get_size() <= 3000
+    assert disk_cache.evictions > 0
+
+
+def test_fetch_tiles__concurrency(tile_server, tmp_path, monkeypatch) -> None:
+    # Arrange
+    osm = AsyncOSMManager(
+        concurrency=3,
+        image_manager=PILImageManager("RGB"),
+        url=tile_server.url,
+        cache=str(tmp_path),
+    )
+    retrieve = osm.osm_manager.retrieve_tile_image
+    lock = threading.Lock()
+    in_flight = []
+    peak = []
+
+    def counting_retrieve(tile_coord, zoom):
+        with lock:
+            in_flight.append(tile_coord)
+            peak.append(len(in_flight))
+        try:
+            time.sleep(0.02)
+            return retrieve(tile_coord, zoom)
+        finally:
+            with lock:
+                in_flight.remove(tile_coord)
+
+    monkeypatch.setattr(osm.osm_manager, "retrieve_tile_image", counting_retrieve)
+    tile_coords = [(x, y) for x in range(4) for y in range(4)]
+
+    # Act
+    sources = asyncio.run(osm.fetch_tiles(tile_coords, 4))
+    osm.close()
+
+    # Assert
+    assert set(sources) == set(tile_coords)
+    assert max(peak) == 3
+
+
+def test_fetch_tile__timeout(tile_server, tmp_path) -> None:
+    # Arrange
+    tile_server.delay = 0.5
+    osm = AsyncOSMManager(
+        timeout=0.05,
+        image_manager=PILImageManager("RGB"),
+        url=tile_server.url,
+        cache=str(tmp_path),
+    )
+
+    # Act / Assert
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(osm.fetch_tile((0, 0), 1))
+    osm.close()
+
+
+def test_create_osm_image__cancel(tile_server, tmp_path) -> None:
+    # Arrange
+    tile_server.delay = 0.2
+    osm = AsyncOSMManager(
+        image_manager=PILImageManager("RGB"),
+        url=tile_server.url,
+        cache=str(tmp_path),
+    )
+
+    async def cancel_then_render():
+        task = asyncio.ensure_future(osm.create_osm_image(BOUNDS, 11))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        tile_server.delay = 0
+        return await osm.create_osm_image(BOUNDS, 8)
+
+    # Act
+    img, _ = asyncio.run(cancel_then_render())
+    osm.close()
+
+    # Assert
+    assert img.size == osm.osm_manager.get_osm_image_bounds(BOUNDS, 8)[0]
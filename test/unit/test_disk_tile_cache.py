@@ -0,0 +1,207 @@
+"""
+Unit tests for DiskTileCache
+"""
+
+from __future__ import annotations
+
+import os
+
+import pytest
+
+from osmviz.cache import DiskTileCache, get_expiry
+from osmviz.manager import OSMManager, PILImageManager
+
+KEY = ("osmviz-abcde-", 15, 18654, 9480)
+
+
+@pytest.fixture()
+def disk_cache(tmp_path):
+    disk_cache = DiskTileCache(str(tmp_path), max_bytes=300)
+    yield disk_cache
+    disk_cache.close()
+
+
+def test_get_filename(disk_cache, tmp_path) -> None:
+    # Act
+    filename = disk_cache.get_filename(KEY)
+
+    # Assert
+    assert filename == str(tmp_path / "osmviz-abcde" / "15" / "18654" / "9480.png")
+
+
+def test_get_tile__missing(disk_cache) -> None:
+    # Act / Assert
+    assert disk_cache.get_tile(KEY) is None
+
+
+def test_put_tile(disk_cache) -> None:
+    # Arrange
+    headers = {"Cache-Control": "max-age=60", "ETag": '"v1"'}
+
+    # Act
+    filename = disk_cache.put_tile(KEY, b"x" * 100, headers, now=1000)
+
+    # Assert
+    with open(filename, "rb") as f:
+        assert f.read() == b"x" * 100
+    assert disk_cache.get_tile(KEY, now=1059) == (filename, True, '"v1"', None)
+    assert disk_cache.get_tile(KEY, now=1061).fresh is False
+    assert disk_cache.get_size() == 100
+
+
+def test_revalidate_tile(disk_cache) -> None:
+    # Arrange
+    headers = {"Cache-Control": "max-age=0", "Last-Modified": "Mon, 1 Jan 2001"}
+    disk_cache.put_tile(KEY, b"x" * 100, headers, now=1000)
+
+    # Act
+    disk_cache.revalidate_tile(
+        KEY,
+        {"Cache-Control": "max-age=60", "Last-Modified": "Tue, 2 Jan 2001"},
+        now=2000,
+    )
+
+    # Assert
+    cached = disk_cache.get_tile(KEY, now=2030)
+    assert cached.fresh is True
+    assert cached.last_modified == "Tue, 2 Jan 2001"
+
+
+def test_pin_tiles(disk_cache) -> None:
+    # Arrange
+    keys = [("osmviz-abcde-", 1, x, 0) for x in range(5)]
+
+    # Act
+    with disk_cache.pin_tiles(keys[1:]):
+        for t, key in enumerate(keys):
+            disk_cache.put_tile(key, b"x" * 100, {}, now=t)
+        pinned = [disk_cache.get_tile(key) is not None for key in keys]
+
+    # Assert
+    # Only the unpinned tile could be evicted, then the oldest one
+    assert pinned == [False] + [True] * 4
+    assert disk_cache.evictions == 2
+    assert disk_cache.get_size() == 300
+    assert [disk_cache.get_tile(key) is not None for key in keys] == [
+        False,
+        False,
+        True,
+        True,
+        True,
+    ]
+
+
+def test_put_tile__evicts_lru(disk_cache) -> None:
+    # Arrange
+    keys = [("osmviz-abcde-", 1, x, 0) for x in range(4)]
+    for t, key in enumerate(keys[:3]):
+        disk_cache.put_tile(key, b"x" * 100, {}, now=t)
+    disk_cache.record_hit(keys[0], now=10)
+    # Looking a tile up is not using it
+    disk_cache.get_tile(keys[1], now=10)
+
+    # Act
+    disk_cache.put_tile(keys[3], b"x" * 100, {}, now=11)
+
+    # Assert
+    assert disk_cache.get_tile(keys[1]) is None
+    assert not os.path.exists(disk_cache.get_filename(keys[1]))
+    assert len(disk_cache) == 3
+    assert disk_cache.get_size() == 300
+    assert disk_cache.evictions == 1
+
+
+def test_put_tile__evicts_lfu(tmp_path) -> None:
+    # Arrange
+    disk_cache = DiskTileCache(str(tmp_path), max_bytes=300, policy="lfu")
+    keys = [("osmviz-abcde-", 1, x, 0) for x in range(4)]
+    for t, key in enumerate(keys[:3]):
+        disk_cache.put_tile(key, b"x" * 100, {}, now=t)
+    disk_cache.record_hit(keys[0], now=10)
+    disk_cache.record_hit(keys[1], now=11)
+    disk_cache.get_tile(keys[2], now=12)
+
+    # Act
+    disk_cache.put_tile(keys[3], b"x" * 100, {}, now=12)
+
+    # Assert
+    assert disk_cache.get_tile(keys[2]) is None
+    assert len(disk_cache) == 3
+
+
+def test_index_persists(tmp_path) -> None:
+    # Arrange
+    disk_cache = DiskTileCache(str(tmp_path))
+    disk_cache.put_tile(KEY, b"x" * 100, {})
+    disk_cache.close()
+
+    # Act
+    disk_cache = DiskTileCache(str(tmp_path))
+
+    # Assert
+    assert disk_cache.get_tile(KEY).fresh is True
+    assert disk_cache.get_size() == 100
+
+
+def test_unknown_policy(tmp_path) -> None:
+    # Act / Assert
+    with pytest.raises(ValueError):
+        DiskTileCache(str(tmp_path), policy="fifo")
+
+
+@pytest.mark.parametrize(
+    "headers, expected",
+    [
+        ({}, 1000 + 3600),
+        ({"Cache-Control": "public, max-age=60"}, 1060),
+        ({"Cache-Control": "no-cache"}, 1000),
+        ({"Expires": "Thu, 01 Jan 1970 00:20:00 GMT"}, 1200),
+        ({"Expires": "garbage"}, 1000),
+    ],
+)
+def test_get_expiry(headers, expected) -> None:
+    # Act / Assert
+    assert get_expiry(headers, 1000, 3600) == expected
+
+
+def test_osm_manager__revalidates(tile_server, tmp_path) -> None:
+    # Arrange
+    tile_server.max_age = 0
+    disk_cache = DiskTileCache(str(tmp_path))
+    osm_manager = OSMManager(
+        image_manager=PILImageManager("RGB"),
+        url=tile_server.url,
+        cache=str(tmp_path),
+        tile_store=disk_cache,
+    )
+
+    # Act
+    filename1 = osm_manager.retrieve_tile_image((1, 2), 3)
+    filename2 = osm_manager.retrieve_tile_image((1, 2), 3)
+
+    # Assert
+    assert filename1 == filename2
+    assert tile_server.requests["/3/1/2.png"] == 2
+    assert tile_server.not_modified == 1
+
+
+def test_osm_manager__keeps_tiles_until_pasted(tile_server, tmp_path) -> None:
+    # Arrange
+    # Room for a few tiles only, while 20 are fetched before pasting
+    disk_cache = DiskTileCache(str(tmp_path), max_bytes=3000)
+    osm_manager = OSMManager(
+        image_manager=PILImageManager("RGB"),
+        url=tile_server.url,
+        cache=str(tmp_path),
+        tile_store=disk_cache,
+        workers=4,
+    )
+    bounds = (59.9225115912, 60.297839409, 24.7828044415, 25.2544966708)
+
+    # Act
+    img, _ = osm_manager.create_osm_image(bounds, 11)
+
+    # Assert
+    assert img.size == (1024, 1280)
+    assert disk_cache.get_size() <= 3000
+    assert disk_cache.evictions > 0
@@ -0,0 +1,126 @@
+"""
+Unit tests for MBTilesTileStore
+"""
+
+from __future__ import annotations
+
+import pytest
+
+from osmviz.cache import MBTilesTileStore, ReadOnlyTileStoreError
+from osmviz.manager import OSMManager, PILImageManager
+
+KEY = ("osmviz-abcde-", 2, 1, 0)
+
+
+@pytest.fixture()
+def filename(tmp_path):
+    yield str(tmp_path / "tiles.mbtiles")
+
+
+def test_put_get(filename) -> None:
+    # Arrange
+    store = MBTilesTileStore(filename)
+
+    # Act
+    store.put_tile(KEY, b"png data", {})
+    tile = store.get_tile(KEY)
+
+    # Assert
+    assert tile.fresh is True
+    assert tile.source.read() == b"png data"
+    assert store.get_tile(("osmviz-abcde-", 2, 1, 1)) is None
+
+
+def test_tms_rows(filename) -> None:
+    # Arrange
+    store = MBTilesTileStore(filename)
+
+    # Act
+    store.put_tile(KEY, b"png data", {})
+
+    # Assert
+    row = store._db.execute("SELECT zoom_level, tile_column, tile_row FROM tiles")
+    assert row.fetchall() == [(2, 1, 3)]
+
+
+def test_put_tiles(filename) -> None:
+    # Arrange
+    store = MBTilesTileStore(filename, name="Test")
+    tiles: list[tuple[tuple, bytes, dict[str, str]]] = [
+        (("osmviz-abcde-", 3, x, 1), b"png", {}) for x in range(8)
+    ]
+
+    # Act
+    store.put_tiles(tiles)
+
+    # Assert
+    assert len(store) == 8
+    assert store.get_metadata()["name"] == "Test"
+
+
+def test_read_only(filename) -> None:
+    # Arrange
+    MBTilesTileStore(filename).put_tile(KEY, b"png data", {})
+
+    # Act
+    store = MBTilesTileStore(filename, read_only=True)
+
+    # Assert
+    assert store.get_tile(KEY).source.read() == b"png data"
+    with pytest.raises(ReadOnlyTileStoreError):
+        store.put_tile(KEY, b"other data", {})
+
+
+def test_osm_manager(tile_server, filename, tmp_path) -> None:
+    # Arrange
+    bounds = (59.9225115912, 60.297839409, 24.7828044415, 25.2544966708)
+    osm_manager = OSMManager(
+        image_manager=PILImageManager("RGB"),
+        url=tile_server.url,
+        cache=str(tmp_path),
+        tile_store=MBTilesTileStore(filename),
+    )
+    image1, _ = osm_manager.create_osm_image(bounds, 10)
+    tile_server.shutdown()
+
+    # Act
+    offline = OSMManager(
+        image_manager=PILImageManager("RGB"),
+        url=tile_server.url,
+        cache=str(tmp_path),
+        tile_store=MBTilesTileStore(filename, read_only=True),
+    )
+    image2, _ = offline.create_osm_image(bounds, 10)
+
+    # Assert
+    assert image1.tobytes() == image2.tobytes()
+
+
+def test_put_tiles__read_only(filename) -> None:
+    # Arrange
+    MBTilesTileStore(filename).close()
+    store = MBTilesTileStore(filename, read_only=True)
+
+    # Act / Assert
+    # An OSError, as callers expect from failing to store a tile
+    with pytest.raises(OSError):
+        store.put_tiles([(KEY, b"png data", {})])
+    assert store.get_tile(KEY) is None
+
+
+def test_seed_tiles__read_only(tile_server, filename, tmp_path) -> None:
+    # Arrange
+    MBTilesTileStore(filename).close()
+    osm_manager = OSMManager(
+        image_manager=PILImageManager("RGB"),
+        url=tile_server.url,
+        cache=str(tmp_path),
+        tile_store=MBTilesTileStore(filename, read_only=True),
+    )
+    bounds = (59.9225115912, 60.297839409, 24.7828044415, 25.2544966708)
+
+    # Act
+    report = osm_manager.seed_tiles(8, [bounds])
+
+    # Assert
+    assert report.failed == report.total == 2
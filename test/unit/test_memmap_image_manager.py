@@ -0,0 +1,60 @@
+"""
+Unit tests for MemmapImageManager
+"""
+
+from __future__ import annotations
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from osmviz.manager import MemmapImageManager, OSMManager
+
+BUS = "test/images/bus.png"
+
+
+@pytest.fixture()
+def image_manager(tmp_path):
+    yield MemmapImageManager(str(tmp_path / "image.npy"))
+
+
+def test_prepare_image(image_manager) -> None:
+    # Act
+    image_manager.prepare_image(200, 100)
+
+    # Assert
+    image = image_manager.get_image()
+    assert image.shape == (100, 200, 4)
+    assert isinstance(image, np.memmap)
+
+
+def test_paste_image_file__reopen(image_manager) -> None:
+    # Arrange
+    image_manager.prepare_image(200, 100)
+
+    # Act
+    image_manager.paste_image_file(BUS, (150, 50))
+    image_manager.destroy_image()
+
+    # Assert
+    image = image_manager.open_image()
+    pixels = np.asarray(Image.open(BUS).convert("RGBA"))
+    assert image.shape == (100, 200, 4)
+    assert np.array_equal(image[50:100, 150:200], pixels)
+    assert np.array_equal(np.load(image_manager.filename), image)
+
+
+def test_create_osm_image(tile_server, image_manager, tmp_path) -> None:
+    # Arrange
+    bounds = (59.9225115912, 60.297839409, 24.7828044415, 25.2544966708)
+    osm_manager = OSMManager(
+        image_manager=image_manager, url=tile_server.url, cache=str(tmp_path)
+    )
+
+    # Act
+    image, _ = osm_manager.create_osm_image(bounds, 10)
+    expected = np.array(image)
+    image_manager.destroy_image()
+
+    # Assert
+    assert np.array_equal(image_manager.open_image(), expected)
@@ -0,0 +1,173 @@
+"""
+Unit tests for NumpyImageManager
+"""
+
+from __future__ import annotations
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from osmviz.cache import TileMemoryCache
+from osmviz.manager import NumpyImageManager, OSMManager, PILImageManager
+
+BUS = "test/images/bus.png"
+
+
+@pytest.fixture()
+def image_manager():
+    yield NumpyImageManager("RGBA")
+
+
+def expected_pixels(filename, mode):
+    return np.asarray(Image.open(filename).convert(mode))
+
+
+def test_prepare_image(image_manager) -> None:
+    # Act
+    image_manager.prepare_image(200, 100)
+
+    # Assert
+    assert image_manager.image.shape == (100, 200, 4)
+    assert image_manager.image.dtype == np.uint8
+
+
+def test_unsupported_mode() -> None:
+    # Act / Assert
+    with pytest.raises(ValueError):
+        NumpyImageManager("CMYK")
+
+
+@pytest.mark.parametrize("mode", ["L", "RGB", "RGBA"])
+def test_paste_image_file(mode) -> None:
+    # Arrange
+    image_manager = NumpyImageManager(mode)
+    image_manager.prepare_image(200, 100)
+
+    # Act
+    image_manager.paste_image_file(BUS, (70, 30))
+
+    # Assert
+    image = image_manager.get_image()
+    pixels = expected_pixels(BUS, mode).reshape(50, 50, -1)
+    assert np.array_equal(image[30:80, 70:120], pixels)
+    assert not image[:30].any()
+    assert not image[:, :70].any()
+
+
+def test_paste_image_file__decodes_in_place(image_manager, tmp_path) -> None:
+    # Arrange
+    filename = str(tmp_path / "rgba.png")
+    Image.open(BUS).convert("RGBA").save(filename)
+    image_manager.prepare_image(200, 100)
+
+    # Act
+    image_manager.paste_image_file(filename, (10, 20))
+
+    # Assert
+    pixels = expected_pixels(BUS, "RGBA")
+    assert np.array_equal(image_manager.image[20:70, 10:60], pixels)
+
+
+@pytest.mark.parametrize("mode, ext", [("L", "pgm"), ("L", "bmp"), ("RGBA", "tif")])
+def test_paste_image_file__raw_format(tmp_path, mode, ext) -> None:
+    # Arrange
+    # Uncompressed files, which PIL maps into memory rather than decoding
+    filename = str(tmp_path / f"bus.{ext}")
+    Image.open(BUS).convert(mode).save(filename)
+    image_manager = NumpyImageManager(mode)
+    image_manager.prepare_image(200, 100)
+
+    # Act
+    image_manager.paste_image_file(filename, (10, 20))
+
+    # Assert
+    pixels = expected_pixels(BUS, mode).reshape(50, 50, -1)
+    assert pixels.any()
+    assert np.array_equal(image_manager.get_image()[20:70, 10:60], pixels)
+
+
+def test_paste_image_file__clipped(image_manager) -> None:
+    # Arrange
+    image_manager.prepare_image(60, 40)
+
+    # Act
+    image_manager.paste_image_file(BUS, (30, -20))
+
+    # Assert
+    pixels = expected_pixels(BUS, "RGBA")
+    assert np.array_equal(image_manager.image[0:30, 30:60], pixels[20:50, 0:30])
+
+
+def test_paste_image_file__tile_cache() -> None:
+    # Arrange
+    tile_cache = TileMemoryCache()
+    image_manager = NumpyImageManager(tile_cache=tile_cache)
+    image_manager.prepare_image(100, 100)
+
+    # Act
+    image_manager.paste_image_file(BUS, (0, 0), cache_key=("abc", 1, 0, 0))
+    image_manager.paste_image_file(BUS, (50, 50), cache_key=("abc", 1, 0, 0))
+
+    # Assert
+    assert tile_cache.hits == 1
+    image = image_manager.get_image()
+    assert np.array_equal(image[0:50, 0:50], image[50:100, 50:100])
+
+
+def test_paste_image_file__tile_cache_modes() -> None:
+    # Arrange
+    tile_cache = TileMemoryCache()
+    grey = NumpyImageManager("L", tile_cache=tile_cache)
+    image_manager = NumpyImageManager("RGBA", tile_cache=tile_cache)
+    grey.prepare_image(100, 100)
+    image_manager.prepare_image(100, 100)
+
+    # Act
+    grey.paste_image_file(BUS, (0, 0), cache_key=("abc", 1, 0, 0))
+    image_manager.paste_image_file(BUS, (0, 0), cache_key=("abc", 1, 0, 0))
+
+    # Assert
+    assert tile_cache.hits == 0
+    assert len(tile_cache) == 2
+    pixels = expected_pixels(BUS, "RGBA")
+    image = image_manager.get_image()
+    assert np.array_equal(image[0:50, 0:50], pixels[0:50, 0:50])
+
+
+def test_create_osm_image(tile_server, tmp_path) -> None:
+    # Arrange
+    bounds = (59.9225115912, 60.297839409, 24.7828044415, 25.2544966708)
+    managers = [NumpyImageManager("RGBA"), PILImageManager("RGBA")]
+
+    # Act
+    images = [
+        OSMManager(
+            image_manager=manager, url=tile_server.url, cache=str(tmp_path)
+        ).create_osm_image(bounds, 10)[0]
+        for manager in managers
+    ]
+
+    # Assert
+    assert images[0].shape == (768, 512, 4)
+    assert np.array_equal(images[0], np.asarray(images[1]))
+
+
+def test_create_osm_image__parallel_decoders(tile_server, tmp_path) -> None:
+    # Arrange
+    bounds = (59.9225115912, 60.297839409, 24.7828044415, 25.2544966708)
+    osm_managers = [
+        OSMManager(
+            image_manager=NumpyImageManager("RGBA"),
+            url=tile_server.url,
+            cache=str(tmp_path),
+            decoders=decoders,
+        )
+        for decoders in (1, 4)
+    ]
+
+    # Act
+    images = [osm.create_osm_image(bounds, 11)[0] for osm in osm_managers]
+
+    # Assert
+    assert np.array_equal(images[0], images[1])
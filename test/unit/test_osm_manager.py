@@ -4,9 +4,20 @@ Unit tests PILImageManager
 
 from __future__ import annotations
 
+import io
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
+from PIL import Image
+from tile_server import serve_tiles
 
+from osmviz import projection
+from osmviz.cache import FlatFileTileStore, MBTilesTileStore, TileMemoryCache
 from osmviz.manager import OSMManager, PILImageManager
+from osmviz.transport import RetryPolicy
 
 
 @pytest.fixture()
@@ -92,3 +103,367 @@ def test_create_osm_image(osm_manager) -> None:
     # Assert
     assert new_bounds == (59.5343180010956, 60.930432202923335, 23.90625, 25.3125)
     assert im.size == (256, 512)
+
+
+def test_create_osm_image__concurrent_matches_serial(tile_server, tmp_path) -> None:
+    # Arrange
+    bounds = (59.9225115912, 60.297839409, 24.7828044415, 25.2544966708)
+    zoom = 11
+    serial = OSMManager(
+        image_manager=PILImageManager("RGB"),
+        url=tile_server.url,
+        cache=str(tmp_path / "serial"),
+    )
+    concurrent = OSMManager(
+        image_manager=PILImageManager("RGB"),
+        url=tile_server.url,
+        cache=str(tmp_path / "concurrent"),
+        workers=8,
+        max_per_host=4,
+    )
+
+    # Act
+    im1, bounds1 = serial.create_osm_image(bounds, zoom)
+    im2, bounds2 = concurrent.create_osm_image(bounds, zoom)
+
+    # Assert
+    assert bounds1 == bounds2
+    assert im1.size == im2.size == (4 * 256, 5 * 256)
+    assert im1.tobytes() == im2.tobytes()
+    assert all(count == 2 for count in tile_server.requests.values())
+
+
+def test_fetch_tiles(tile_server, tmp_path) -> None:
+    # Arrange
+    osm_manager = OSMManager(
+        image_manager=PILImageManager("RGB"),
+        url=tile_server.url,
+        cache=str(tmp_path),
+        workers=4,
+    )
+    tile_coords = [(x, y) for x in range(3) for y in range(3)]
+    done: list[tuple[int, int]] = []
+
+    # Act
+    filenames = osm_manager.fetch_tiles(tile_coords, 4, callback=done.append)
+    osm_manager.fetch_tiles(tile_coords, 4)
+
+    # Assert
+    assert sorted(filenames) == sorted(done) == tile_coords
+    assert len(tile_server.requests) == 9
+    assert all(count == 1 for count in tile_server.requests.values())
+
+
+def test_create_osm_image__tile_cache(tile_server, tmp_path) -> None:
+    # Arrange
+    tile_cache = TileMemoryCache()
+    bounds = (59.9225115912, 60.297839409, 24.7828044415, 25.2544966708)
+    images = []
+
+    # Act
+    for _ in range(2):
+        osm_manager = OSMManager(
+            image_manager=PILImageManager("RGB", tile_cache=tile_cache),
+            url=tile_server.url,
+            cache=str(tmp_path),
+        )
+        images.append(osm_manager.create_osm_image(bounds, 10)[0])
+
+    # Assert
+    assert tile_cache.misses == tile_cache.hits == 6
+    assert images[0].tobytes() == images[1].tobytes()
+
+
+def test_retrieve_tile_image__flat_file_store(tile_server, tmp_path) -> None:
+    # Arrange
+    osm_manager = OSMManager(
+        image_manager=PILImageManager("RGB"), url=tile_server.url, cache=str(tmp_path)
+    )
+
+    # Act
+    filename = osm_manager.retrieve_tile_image((1, 2), 3)
+
+    # Assert
+    assert isinstance(osm_manager.tile_store, FlatFileTileStore)
+    assert filename == osm_manager.get_local_tile_filename((1, 2), 3)
+
+
+@pytest.mark.parametrize(
+    "url, expected",
+    [
+        (
+            "https://tile.osm.org/{z}/{x}/{y}.png",
+            ["https://tile.osm.org/{z}/{x}/{y}.png"],
+        ),
+        (
+            "https://{a|b|c}.tile.osm.org/{z}/{x}/{y}.png",
+            [
+                "https://a.tile.osm.org/{z}/{x}/{y}.png",
+                "https://b.tile.osm.org/{z}/{x}/{y}.png",
+                "https://c.tile.osm.org/{z}/{x}/{y}.png",
+            ],
+        ),
+        (
+            [
+                "https://one.org/{z}/{x}/{y}.png",
+                "https://{a|b}.two.org/{z}/{x}/{y}.png",
+            ],
+            [
+                "https://one.org/{z}/{x}/{y}.png",
+                "https://a.two.org/{z}/{x}/{y}.png",
+                "https://b.two.org/{z}/{x}/{y}.png",
+            ],
+        ),
+    ],
+)
+def test_mirrors(url, expected) -> None:
+    # Arrange
+    osm_manager = OSMManager(image_manager=PILImageManager("RGB"), url=url)
+    tile_coords = [(x, y) for x in range(10) for y in range(10)]
+
+    # Act
+    firsts = [osm_manager.get_tile_url(tile_coord, 5) for tile_coord in tile_coords]
+    urls = osm_manager.get_tile_urls((3, 4), 5)
+
+    # Assert
+    assert osm_manager.urls == expected
+    assert sorted(urls) == sorted(u.format(x=3, y=4, z=5) for u in expected)
+    assert urls == osm_manager.get_tile_urls((3, 4), 5)
+    assert urls[0] == osm_manager.get_tile_url((3, 4), 5)
+    # Spread evenly over the mirrors
+    for mirror in expected:
+        host = mirror.split("/")[2]
+        assert sum(host in first for first in firsts) >= 100 // len(expected) - 1
+
+
+def test_mirrors__cache_prefix() -> None:
+    # Arrange
+    url = "https://{a|b|c}.tile.osm.org/{z}/{x}/{y}.png"
+
+    # Act
+    osm_manager1 = OSMManager(image_manager=PILImageManager("RGB"), url=url)
+    osm_manager2 = OSMManager(image_manager=PILImageManager("RGB"), url=[url])
+
+    # Assert
+    assert osm_manager1.cache_prefix == osm_manager2.cache_prefix
+
+
+def test_retrieve_tile_image__failover(tile_server, tmp_path) -> None:
+    # Arrange
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        dead_port = sock.getsockname()[1]
+    dead_url = f"http://127.0.0.1:{dead_port}/{{z}}/{{x}}/{{y}}.png"
+    policy = RetryPolicy(backoff=0.01, failure_threshold=2)
+    osm_manager = OSMManager(
+        image_manager=PILImageManager("RGB"),
+        url=[dead_url, tile_server.url],
+        cache=str(tmp_path),
+        policy=policy,
+    )
+    # Tiles whose first mirror is the dead one
+    tile_coords = [(0, 0), (1, 1), (2, 2), (3, 3)]
+
+    # Act
+    for tile_coord in tile_coords:
+        osm_manager.retrieve_tile_image(tile_coord, 5)
+
+    # Assert
+    assert sum(tile_server.requests.values()) == 4
+    metrics = policy.get_metrics()
+    assert metrics["retried"] == 0
+    # Once its breaker is open, the dead mirror is skipped
+    assert metrics["rejected"] == 2
+    assert metrics["requests"] == 2 + 4
+
+
+def test_retrieve_tile_image__failover_slow(tile_server, tmp_path) -> None:
+    # Arrange
+    policy = RetryPolicy(failure_threshold=2, failover_timeout=0.1)
+    # Tiles whose first mirror is the slow one
+    tile_coords = [(0, 0), (1, 1), (2, 2), (3, 3)]
+
+    with serve_tiles() as slow_server:
+        slow_server.delay = 2.0
+        osm_manager = OSMManager(
+            image_manager=PILImageManager("RGB"),
+            url=[slow_server.url, tile_server.url],
+            cache=str(tmp_path),
+            policy=policy,
+        )
+
+        # Act
+        start = time.perf_counter()
+        for tile_coord in tile_coords:
+            osm_manager.retrieve_tile_image(tile_coord, 5)
+        elapsed = time.perf_counter() - start
+        osm_manager.close()
+
+    # Assert
+    # Neither waiting for the slow mirror, nor for the pool's timeout
+    assert elapsed < 1.0
+    assert sum(tile_server.requests.values()) == 4
+    # Once its breaker is open, the slow mirror is skipped
+    assert sum(slow_server.requests.values()) == 2
+    assert policy.get_metrics()["rejected"] == 2
+
+
+@pytest.mark.parametrize("store", ["flat", "mbtiles"])
+def test_retrieve_tile_image__single_flight(tile_server, tmp_path, store) -> None:
+    # Arrange
+    tile_server.delay = 0.2
+    tile_store = None
+    if store == "mbtiles":
+        tile_store = MBTilesTileStore(str(tmp_path / "tiles.mbtiles"))
+    osm_manager = OSMManager(
+        image_manager=PILImageManager("RGB"),
+        url=tile_server.url,
+        cache=str(tmp_path),
+        tile_store=tile_store,
+        max_per_host=8,
+    )
+
+    # Act
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        sources = list(
+            executor.map(lambda _: osm_manager.retrieve_tile_image((1, 2), 3), range(8))
+        )
+
+    # Assert
+    assert tile_server.requests == {"/3/1/2.png": 1}
+    if store == "flat":
+        assert set(sources) == {osm_manager.get_local_tile_filename((1, 2), 3)}
+        assert os.listdir(tmp_path) == [os.path.basename(sources[0])]
+    else:
+        assert len({source.read() for source in sources}) == 1
+
+
+def test_retrieve_tile_image__single_flight_error(tile_server, tmp_path) -> None:
+    # Arrange
+    tile_server.delay = 0.2
+    osm_manager = OSMManager(
+        image_manager=PILImageManager("RGB"),
+        url=tile_server.url.replace(".png", ".jpg"),
+        cache=str(tmp_path),
+        max_per_host=8,
+    )
+
+    def retrieve(_):
+        with pytest.raises(OSError, match="404"):
+            osm_manager.retrieve_tile_image((1, 2), 3)
+
+    # Act
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(retrieve, range(4)))
+
+    # Assert
+    assert sum(tile_server.requests.values()) == 1
+    assert not osm_manager._in_flight
+
+
+@pytest.mark.parametrize("window", [None, (2, 2), (3, 1)])
+def test_iter_osm_image(tile_server, tmp_path, window) -> None:
+    # Arrange
+    bounds = (59.9225115912, 60.297839409, 24.7828044415, 25.2544966708)
+    osm_manager = OSMManager(
+        image_manager=PILImageManager("RGB"), url=tile_server.url, cache=str(tmp_path)
+    )
+    size, new_bounds = osm_manager.get_osm_image_bounds(bounds, 11)
+    whole = Image.new("RGB", size)
+
+    # Act
+    pieces = 0
+    for piece, xy in osm_manager.iter_osm_image(bounds, 11, window=window):
+        whole.paste(piece, xy)
+        pieces += 1
+
+    # Assert
+    expected, expected_bounds = osm_manager.create_osm_image(bounds, 11)
+    assert new_bounds == expected_bounds
+    assert whole.tobytes() == expected.tobytes()
+    assert pieces == {None: 5, (2, 2): 6, (3, 1): 10}[window]
+
+
+def test_build_pyramid(tile_server, synthetic_tile, tmp_path) -> None:
+    # Arrange
+    bounds = (59.9225115912, 60.297839409, 24.7828044415, 25.2544966708)
+    osm_manager = OSMManager(
+        image_manager=PILImageManager("RGB"), url=tile_server.url, cache=str(tmp_path)
+    )
+
+    # Act
+    counts = osm_manager.build_pyramid(bounds, 8, 11)
+    requested = len(tile_server.requests)
+    osm_manager.create_osm_image(bounds, 9)
+
+    # Assert
+    assert counts["downloaded"] + counts["derived"] == 20 + 6 + 2 + 2
+    assert counts["derived"] > 0
+    assert requested == counts["downloaded"]
+    assert len(tile_server.requests) == requested
+    # A derived tile is its four children, halved
+    for x, y in osm_manager.get_tile_coords(bounds, 10):
+        if f"/10/{x}/{y}.png" in tile_server.requests:
+            continue
+        parent = Image.open(osm_manager.retrieve_tile_image((x, y), 10))
+        for dx, dy in ((0, 0), (1, 0), (0, 1), (1, 1)):
+            child = Image.open(io.BytesIO(synthetic_tile(11, 2 * x + dx, 2 * y + dy)))
+            xy = (128 * dx + 64, 128 * dy + 64)
+            assert parent.getpixel(xy) == child.getpixel(xy)
+
+
+def test_get_render_zoom(osm_manager) -> None:
+    # Arrange
+    # Tile (0, 0) at zoom 1, so 256 pixels wide at zoom 1
+    bounds = (0.0, 85.0511287798066, -180.0, 0.0)
+
+    # Act / Assert
+    assert osm_manager.get_render_zoom(bounds, (256, 256)) == 1
+    assert osm_manager.get_render_zoom(bounds, (257, 100)) == 2
+    assert osm_manager.get_render_zoom(bounds, (100, 100)) == 0
+    assert osm_manager.get_render_zoom(bounds, (10**9, 1), max_zoom=12) == 12
+
+
+def test_render_osm_image(tile_server, synthetic_tile, tmp_path) -> None:
+    # Arrange
+    bounds = (59.9225115912, 60.297839409, 24.7828044415, 25.2544966708)
+    osm_manager = OSMManager(
+        image_manager=PILImageManager("RGB"), url=tile_server.url, cache=str(tmp_path)
+    )
+    zoom = osm_manager.get_render_zoom(bounds, (300, 200))
+
+    # Act
+    img = osm_manager.render_osm_image(bounds, (300, 200))
+
+    # Assert
+    assert zoom == 10
+    assert img.size == (300, 200)
+    min_x, min_y, max_x, max_y = osm_manager.get_tile_range(bounds, zoom)
+    assert len(tile_server.requests) <= (max_x - min_x + 1) * (max_y - min_y + 1)
+    # Away from tile edges, each pixel is the colour of its tile
+    x0, y0 = projection.get_fractional_tile_coord(bounds[2], bounds[1], zoom)
+    x1, y1 = projection.get_fractional_tile_coord(bounds[3], bounds[0], zoom)
+    for px in range(5, 300, 10):
+        for py in range(5, 200, 10):
+            tx = x0 + (px + 0.5) / 300 * (x1 - x0)
+            ty = y0 + (py + 0.5) / 200 * (y1 - y0)
+            if min(tx % 1, ty % 1) < 0.02 or max(tx % 1, ty % 1) > 0.98:
+                continue
+            tile = Image.open(io.BytesIO(synthetic_tile(zoom, int(tx), int(ty))))
+            assert img.getpixel((px, py)) == tile.convert("RGB").getpixel((0, 0))
+
+
+def test_render_osm_image__only_overlapping_tiles(tile_server, tmp_path) -> None:
+    # Arrange
+    osm_manager = OSMManager(
+        image_manager=PILImageManager("RGB"), url=tile_server.url, cache=str(tmp_path)
+    )
+    # The box lies within tile (1, 1) at zoom 2, touching its edges
+    _, tile_bounds = osm_manager.get_osm_image_bounds((10, 20, -80, -70), 2)
+
+    # Act
+    img = osm_manager.render_osm_image(tile_bounds, (256, 256))
+
+    # Assert
+    assert img.size == (256, 256)
+    assert set(tile_server.requests) == {"/2/1/1.png"}
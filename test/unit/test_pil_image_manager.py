@@ -6,6 +6,7 @@ from __future__ import annotations
 
 import pytest
 
+from osmviz.cache import TileMemoryCache
 from osmviz.manager import PILImageManager
 
 
@@ -110,3 +111,21 @@ def test_get_image(image_manager) -> None:
 
     # Assert
     assert im.size == (200, 100)
+
+
+def test_paste_image_file__tile_cache() -> None:
+    # Arrange
+    tile_cache = TileMemoryCache()
+    image_manager = PILImageManager("RGB", tile_cache=tile_cache)
+    image_manager.prepare_image(200, 100)
+    filename = "test/images/bus.png"
+
+    # Act
+    image_manager.paste_image_file(filename, (0, 0), cache_key=("abc", 1, 0, 0))
+    image_manager.paste_image_file(filename, (50, 0), cache_key=("abc", 1, 0, 0))
+
+    # Assert
+    assert tile_cache.hits == 1
+    assert tile_cache.misses == 1
+    assert len(tile_cache) == 1
+    assert tile_cache.current_bytes > 0
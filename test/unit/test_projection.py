@@ -0,0 +1,106 @@
+"""
+Unit tests for projection, checking the array functions against the
+scalar ones
+"""
+
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from osmviz import projection
+
+rng = np.random.default_rng(1234)
+LATS = rng.uniform(-85, 85, 10_000)
+LONS = rng.uniform(-180, 180, 10_000)
+ZOOMS = rng.integers(0, 19, 10_000)
+
+
+@pytest.mark.parametrize("zoom", [0, 8, 15, 18, ZOOMS])
+def test_get_tile_coord_array(zoom) -> None:
+    # Arrange
+    zooms = np.broadcast_to(zoom, LATS.shape)
+
+    # Act
+    xs, ys = projection.get_tile_coord_array(LONS, LATS, zoom)
+
+    # Assert
+    expected = [
+        projection.get_tile_coord(lon, lat, int(z))
+        for lon, lat, z in zip(LONS.tolist(), LATS.tolist(), zooms.tolist())
+    ]
+    assert xs.dtype == ys.dtype == np.int64
+    assert list(zip(xs.tolist(), ys.tolist())) == expected
+
+
+def test_get_fractional_tile_coord_array() -> None:
+    # Act
+    xs, ys = projection.get_fractional_tile_coord_array(LONS, LATS, ZOOMS)
+
+    # Assert
+    expected = np.array(
+        [
+            projection.get_fractional_tile_coord(lon, lat, z)
+            for lon, lat, z in zip(LONS.tolist(), LATS.tolist(), ZOOMS.tolist())
+        ]
+    )
+    # x is plain arithmetic, y goes through log and tan: a few ulp of
+    # those, scaled by the number of tiles
+    assert np.array_equal(xs, expected[:, 0])
+    assert np.all(np.abs(ys - expected[:, 1]) <= 16 * 2.0**-52 * 2.0**ZOOMS)
+
+
+def test_get_pixel_coord_array() -> None:
+    # Act
+    px, py = projection.get_pixel_coord_array(LONS, LATS, 10, tile_size=512)
+
+    # Assert
+    xs, ys = projection.get_fractional_tile_coord_array(LONS, LATS, 10)
+    assert np.array_equal(px, xs * 512)
+    assert np.array_equal(py, ys * 512)
+
+
+def test_tile_nw_lat_lon_array() -> None:
+    # Arrange
+    xs, ys = projection.get_tile_coord_array(LONS, LATS, ZOOMS)
+
+    # Act
+    lats, lons = projection.tile_nw_lat_lon_array(xs, ys, ZOOMS)
+
+    # Assert
+    expected = np.array(
+        [
+            projection.tile_nw_lat_lon((x, y), z)
+            for x, y, z in zip(xs.tolist(), ys.tolist(), ZOOMS.tolist())
+        ]
+    )
+    assert np.array_equal(lons, expected[:, 1])
+    np.testing.assert_array_max_ulp(lats, expected[:, 0], maxulp=4)
+
+
+def test_get_xy_array() -> None:
+    # Arrange
+    bounds = (-85.0, 85.0, -180.0, 180.0)
+    screen_size = (1280, 800)
+
+    # Act
+    xs, ys = projection.get_xy_array(LATS, LONS, bounds, screen_size)
+
+    # Assert
+    expected = [
+        projection.get_xy(lat, lon, bounds, screen_size)
+        for lat, lon in zip(LATS.tolist(), LONS.tolist())
+    ]
+    assert list(zip(xs.tolist(), ys.tolist())) == expected
+
+
+def test_tile_nw_lat_lon__inverse() -> None:
+    # Arrange
+    xs, ys = projection.get_fractional_tile_coord_array(LONS, LATS, 12)
+
+    # Act
+    lats, lons = projection.tile_nw_lat_lon_array(xs, ys, 12)
+
+    # Assert
+    np.testing.assert_allclose(lats, LATS, atol=1e-9)
+    np.testing.assert_allclose(lons, LONS, atol=1e-9)
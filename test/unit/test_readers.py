@@ -0,0 +1,227 @@
+"""
+Unit tests for the position log readers, TrajectoryBuilder and FixPages
+"""
+
+from __future__ import annotations
+
+import io
+import os
+import random
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from osmviz.readers import (
+    FixPages,
+    TrajectoryBuilder,
+    parse_time,
+    read_csv,
+    read_gpx,
+    read_parquet,
+)
+from osmviz.trajectory import Trajectory
+
+GPX = b"""<?xml version="1.0" encoding="UTF-8"?>
+<gpx version="1.1" creator="test" xmlns="http://www.topografix.com/GPX/1/1">
+  <metadata><name>A day out</name></metadata>
+  <trk>
+    <name>Bus 1</name>
+    <trkseg>
+      <trkpt lat="60.1" lon="24.9"><time>2010-01-01T00:00:00Z</time></trkpt>
+      <trkpt lat="60.2" lon="25.0"><name>Stop</name></trkpt>
+      <trkpt lat="60.3" lon="25.1"><time>2010-01-01T00:01:00Z</time></trkpt>
+    </trkseg>
+  </trk>
+  <trk>
+    <trkseg>
+      <trkpt lat="61" lon="26"><time>2010-01-01T02:00:00+02:00</time></trkpt>
+    </trkseg>
+  </trk>
+</gpx>
+"""
+
+
+def make_fixes(objects=20, seed=0):
+    """
+    Returns interleaved (id, time, lat, lon) fixes, in time order for
+    each object, with gaps crossing many pages.
+    """
+    rng = random.Random(seed)
+    fixes = []
+    for number in range(objects):
+        time = rng.uniform(0, 500)
+        for _ in range(rng.randrange(1, 30)):
+            fixes.append(
+                (f"bus {number}", time, rng.uniform(60, 61), rng.uniform(24, 25))
+            )
+            time += rng.choice([0, rng.uniform(0, 50), rng.uniform(100, 400)])
+    # Interleave the objects, keeping each object's order
+    fixes.sort(key=lambda fix: fix[1])
+    return fixes
+
+
+def test_parse_time() -> None:
+    assert parse_time("12.5") == 12.5
+    assert parse_time(3) == 3.0
+    assert parse_time("1970-01-01T00:01:00Z") == 60
+    assert parse_time("1970-01-01T00:01:00") == 60
+    assert parse_time("1970-01-01T01:01:00+01:00") == 60
+
+
+def test_read_csv(tmp_path) -> None:
+    # Arrange
+    filename = tmp_path / "log.csv"
+    filename.write_text(
+        "ts;vehicle;lon;lat;speed\n"
+        "0;a;25.0;60.0;3\n"
+        "\n"
+        "1970-01-01T00:00:10Z;b;25.1;60.1;4\n"
+        "20;a;25.2;60.2;5\n"
+    )
+
+    # Act
+    chunks = list(
+        read_csv(
+            str(filename),
+            columns=("vehicle", "ts", "lat", "lon"),
+            chunk_size=2,
+            delimiter=";",
+        )
+    )
+
+    # Assert
+    assert chunks == [
+        [("a", 0.0, 60.0, 25.0), ("b", 10.0, 60.1, 25.1)],
+        [("a", 20.0, 60.2, 25.2)],
+    ]
+    with pytest.raises(ValueError):
+        list(read_csv(io.StringIO("id,time,lat\n")))
+
+
+def test_read_csv__empty() -> None:
+    with pytest.raises(ValueError, match="header row"):
+        list(read_csv(io.StringIO("")))
+
+
+def test_read_gpx() -> None:
+    # Act
+    chunks = list(read_gpx(io.BytesIO(GPX), chunk_size=2))
+
+    # Assert
+    assert chunks == [
+        [("Bus 1", 1262304000.0, 60.1, 24.9), ("Bus 1", 1262304060.0, 60.3, 25.1)],
+        [("track 2", 1262304000.0, 61.0, 26.0)],
+    ]
+
+
+def test_read_gpx__frees_points(monkeypatch) -> None:
+    # Arrange
+    points = b"".join(
+        b'<trkpt lat="60" lon="25"><time>%d</time></trkpt>' % i for i in range(20_000)
+    )
+    gpx = b"<gpx><trk><name>Bus 1</name><trkseg>%s</trkseg></trk></gpx>" % points
+    roots: list[ET.Element] = []
+    original_iterparse = ET.iterparse
+
+    def iterparse(*args, **kwargs):
+        for event, elem in original_iterparse(*args, **kwargs):
+            if not roots:
+                roots.append(elem)
+            yield event, elem
+
+    monkeypatch.setattr(ET, "iterparse", iterparse)
+
+    # Act
+    sizes = []
+    fixes = 0
+    for chunk in read_gpx(io.BytesIO(gpx), chunk_size=100):
+        fixes += len(chunk)
+        sizes.append(len(list(roots[0].iter())))
+
+    # Assert
+    assert fixes == 20_000
+    # The tree holds only the points parsed ahead, not those read before
+    assert max(sizes) < 2000
+
+
+def test_read_parquet(tmp_path) -> None:
+    # Arrange
+    pa = pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+    filename = str(tmp_path / "log.parquet")
+    table = pa.table(
+        {"id": ["a", "b", "a"], "time": [0, 5, 10], "lat": [60, 61, 62], "x": [1, 2, 3]}
+    )
+    pq.write_table(table.append_column("lon", pa.array([24.0, 25.0, 26.0])), filename)
+
+    # Act
+    chunks = list(read_parquet(filename, chunk_size=2))
+
+    # Assert
+    assert [fix for chunk in chunks for fix in chunk] == [
+        ("a", 0.0, 60.0, 24.0),
+        ("b", 5.0, 61.0, 25.0),
+        ("a", 10.0, 62.0, 26.0),
+    ]
+
+
+def test_trajectory_builder() -> None:
+    # Arrange
+    fixes = make_fixes()
+    shuffled = random.Random(1).sample(fixes, len(fixes))
+    builder = TrajectoryBuilder()
+
+    # Act
+    for i in range(0, len(shuffled), 7):
+        builder.add(shuffled[i : i + 7])
+    trajectories = builder.get_trajectories()
+
+    # Assert
+    _, times, lats, lons = zip(*fixes)
+    assert builder.time_window == (min(times), max(times))
+    assert builder.bounding_box == (min(lats), max(lats), min(lons), max(lons))
+    assert len(trajectories) == 20
+    for object_id, trajectory in trajectories.items():
+        own = [fix[1:] for fix in fixes if fix[0] == object_id]
+        assert trajectory.times == sorted(fix[0] for fix in own)
+
+
+def test_fix_pages(tmp_path) -> None:
+    # Arrange
+    fixes = make_fixes()
+    full = TrajectoryBuilder()
+    full.add(fixes)
+    expected = full.get_trajectories()
+
+    # Act
+    with FixPages(
+        (fixes[i : i + 50] for i in range(0, len(fixes), 50)),
+        page_duration=60,
+        directory=str(tmp_path),
+    ) as pages:
+        directory = pages.directory
+        assert pages.time_window == full.time_window
+        assert pages.bounding_box == full.bounding_box
+
+        # Assert
+        # Each page alone gives the same positions as the whole log
+        rng = random.Random(2)
+        times = [rng.uniform(-10, pages.time_window[1] + 10) for _ in range(300)]
+        for time in times + list(pages.time_window):
+            page = dict(pages.get_page(pages.get_page_number(time)))
+            for object_id, trajectory in expected.items():
+                position = trajectory(time)
+                if object_id not in page:
+                    assert position is None
+                    continue
+                paged = Trajectory(page[object_id])(time)
+                if position is None:
+                    assert paged is None
+                else:
+                    assert paged == pytest.approx(position)
+    assert not os.path.exists(directory)
+
+
+def test_fix_pages__out_of_order(tmp_path) -> None:
+    with pytest.raises(ValueError), FixPages(directory=str(tmp_path)) as pages:
+        pages.add([("a", 10, 60, 25), ("a", 5, 60, 25)])
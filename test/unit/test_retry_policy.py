@@ -0,0 +1,183 @@
+"""
+Unit tests for RetryPolicy
+"""
+
+from __future__ import annotations
+
+import time
+from email.message import Message
+
+import pytest
+
+from osmviz.manager import OSMManager, PILImageManager
+from osmviz.transport import CircuitOpenError, RetryPolicy, get_retry_after
+
+
+def make_headers(**headers) -> Message:
+    message = Message()
+    for name, value in headers.items():
+        message[name.replace("_", "-")] = value
+    return message
+
+
+@pytest.fixture()
+def osm_manager_factory(tile_server, tmp_path):
+    def factory(policy):
+        return OSMManager(
+            image_manager=PILImageManager("RGB"),
+            url=tile_server.url,
+            cache=str(tmp_path),
+            policy=policy,
+        )
+
+    return factory
+
+
+def test_get_retry_delay__backoff() -> None:
+    # Arrange
+    policy = RetryPolicy(backoff=1, max_backoff=5)
+
+    # Act
+    delays = [
+        [policy.get_retry_delay(attempt) for _ in range(50)] for attempt in range(5)
+    ]
+
+    # Assert
+    for attempt, attempt_delays in enumerate(delays):
+        assert all(0 <= delay <= min(2**attempt, 5) for delay in attempt_delays)
+    # Jittered
+    assert len(set(delays[0])) > 1
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("120", 120),
+        ("Wed, 21 Oct 2015 07:28:30 GMT", 30),
+        ("Wed, 21 Oct 2015 07:27:00 GMT", 0),
+        ("soon", None),
+    ],
+)
+def test_get_retry_after(value, expected) -> None:
+    # Arrange
+    now = 1445412480.0  # Wed, 21 Oct 2015 07:28:00 GMT
+
+    # Act
+    retry_after = get_retry_after(make_headers(Retry_After=value), now)
+
+    # Assert
+    assert retry_after == expected
+
+
+def test_get_retry_delay__retry_after() -> None:
+    # Arrange
+    policy = RetryPolicy(max_backoff=10)
+
+    # Act / Assert
+    assert policy.get_retry_delay(0, make_headers(Retry_After="3")) == 3
+    assert policy.get_retry_delay(0, make_headers(Retry_After="60")) == 10
+
+
+def test_circuit_breaker() -> None:
+    # Arrange
+    policy = RetryPolicy(failure_threshold=2, reset_after=0.1)
+
+    # Act / Assert
+    policy.before_request("a")
+    policy.record_failure("a")
+    policy.before_request("a")
+    policy.record_failure("a")
+    with pytest.raises(CircuitOpenError):
+        policy.before_request("a")
+    # Other hosts are unaffected
+    policy.before_request("b")
+    time.sleep(0.1)
+    # One trial request is let through
+    policy.before_request("a")
+    with pytest.raises(CircuitOpenError):
+        policy.before_request("a")
+    policy.record_success("a")
+    policy.before_request("a")
+    assert policy.get_metrics()["circuit_opens"] == 1
+    assert policy.get_metrics()["rejected"] == 2
+
+
+def test_rate_limit() -> None:
+    # Arrange
+    policy = RetryPolicy(rate=20)
+    start = time.monotonic()
+
+    # Act
+    for _ in range(5):
+        policy.before_request("a")
+    policy.before_request("b")
+
+    # Assert
+    assert time.monotonic() - start >= 0.15
+    assert policy.get_metrics()["throttle_seconds"] >= 0.15
+
+
+def test_retrieve_tile_image__retries(tile_server, osm_manager_factory) -> None:
+    # Arrange
+    tile_server.errors = [503, 502]
+    policy = RetryPolicy(backoff=0.01)
+    osm_manager = osm_manager_factory(policy)
+
+    # Act
+    filename = osm_manager.retrieve_tile_image((1, 2), 3)
+
+    # Assert
+    assert filename == osm_manager.get_local_tile_filename((1, 2), 3)
+    assert tile_server.requests == {"/3/1/2.png": 3}
+    metrics = policy.get_metrics()
+    assert metrics["requests"] == 3
+    assert metrics["retried"] == 2
+    assert metrics["failures"] == 0
+
+
+def test_retrieve_tile_image__retry_after(tile_server, osm_manager_factory) -> None:
+    # Arrange
+    tile_server.errors = [429]
+    tile_server.retry_after = "0.2"
+    policy = RetryPolicy(backoff=0.01)
+    osm_manager = osm_manager_factory(policy)
+    start = time.monotonic()
+
+    # Act
+    osm_manager.retrieve_tile_image((1, 2), 3)
+
+    # Assert
+    assert time.monotonic() - start >= 0.2
+    assert policy.get_metrics()["backoff_seconds"] == 0.2
+
+
+def test_retrieve_tile_image__gives_up(tile_server, osm_manager_factory) -> None:
+    # Arrange
+    tile_server.errors = [503] * 10
+    policy = RetryPolicy(retries=2, backoff=0.01, failure_threshold=2)
+    osm_manager = osm_manager_factory(policy)
+
+    # Act
+    with pytest.raises(OSError, match="503"):
+        osm_manager.retrieve_tile_image((1, 2), 3)
+    with pytest.raises(OSError, match="503"):
+        osm_manager.retrieve_tile_image((1, 2), 3)
+    with pytest.raises(CircuitOpenError):
+        osm_manager.retrieve_tile_image((1, 2), 3)
+
+    # Assert
+    assert tile_server.requests == {"/3/1/2.png": 6}
+    assert policy.get_metrics()["failures"] == 2
+
+
+def test_retrieve_tile_image__not_found(tile_server, osm_manager_factory) -> None:
+    # Arrange
+    tile_server.errors = [404]
+    policy = RetryPolicy(backoff=0.01)
+    osm_manager = osm_manager_factory(policy)
+
+    # Act / Assert
+    with pytest.raises(OSError, match="404"):
+        osm_manager.retrieve_tile_image((1, 2), 3)
+    assert sum(tile_server.requests.values()) == 1
+    assert policy.get_metrics()["retried"] == 0
@@ -0,0 +1,221 @@
+"""
+Unit tests for tile seeding
+"""
+
+from __future__ import annotations
+
+import json
+
+import pytest
+
+from osmviz.__main__ import main
+from osmviz.manager import ImageManager, OSMManager
+from osmviz.seed import box_intersects_polygon, point_in_polygon
+from osmviz.transport import TokenBucket
+
+BOUNDS = (59.9225115912, 60.297839409, 24.7828044415, 25.2544966708)
+TRIANGLE = [(0.0, 0.0), (10.0, 0.0), (0.0, 10.0)]
+
+
+@pytest.fixture()
+def osm_manager(tile_server, tmp_path):
+    osm_manager = OSMManager(
+        image_manager=ImageManager(),
+        url=tile_server.url,
+        cache=str(tmp_path),
+        workers=4,
+    )
+    yield osm_manager
+    osm_manager.close()
+
+
+def test_point_in_polygon() -> None:
+    # Act / Assert
+    assert point_in_polygon(2, 2, TRIANGLE)
+    assert not point_in_polygon(6, 6, TRIANGLE)
+
+
+@pytest.mark.parametrize(
+    "box, expected",
+    [
+        ((1, 2, 1, 2), True),  # inside
+        ((-1, 11, -1, 11), True),  # around
+        ((4, 6, -1, 1), True),  # across an edge
+        ((6, 8, 6, 8), False),  # outside
+    ],
+)
+def test_box_intersects_polygon(box, expected) -> None:
+    # Act / Assert
+    assert box_intersects_polygon(box, TRIANGLE) is expected
+
+
+def test_get_tile_coords__clamped(osm_manager) -> None:
+    # Act
+    tile_coords = osm_manager.get_tile_coords((-89, 89, -180, 180), 1)
+
+    # Assert
+    assert tile_coords == [(0, 0), (0, 1), (1, 0), (1, 1)]
+
+
+def test_get_area_tile_coords__polygon(osm_manager) -> None:
+    # Arrange
+    polygon = [(0.1, 0.1), (60.0, 0.1), (0.1, 120.0)]
+
+    # Act
+    tile_coords = osm_manager.get_area_tile_coords(3, polygons=[polygon])
+
+    # Assert
+    assert (4, 3) in tile_coords  # the corner at the origin
+    assert (6, 2) not in tile_coords  # outside the hypotenuse
+    assert len(tile_coords) < len(osm_manager.get_tile_coords((0.1, 60, 0.1, 120), 3))
+
+
+def test_seed_tiles(osm_manager, tile_server) -> None:
+    # Act
+    report1 = osm_manager.seed_tiles(range(8, 11), [BOUNDS])
+    report2 = osm_manager.seed_tiles(range(8, 11), [BOUNDS])
+
+    # Assert
+    assert report1.total == report1.downloaded == 2 + 2 + 6
+    assert report2.total == report2.skipped == 10
+    assert report2.downloaded == 0
+    assert len(tile_server.requests) == 10
+
+
+def test_seed_tiles__resume(osm_manager, tile_server, tmp_path) -> None:
+    # Arrange
+    progress_file = str(tmp_path / "progress.txt")
+    osm_manager.seed_tiles(9, [BOUNDS], progress_file=progress_file)
+
+    # Act
+    report = osm_manager.seed_tiles([9, 10], [BOUNDS], progress_file=progress_file)
+
+    # Assert
+    assert report.skipped == 2
+    assert report.downloaded == 6
+    with open(progress_file) as f:
+        assert len(f.readlines()) == 8
+
+
+def test_seed_tiles__resume_other_server(osm_manager, tile_server, tmp_path) -> None:
+    # Arrange
+    progress_file = str(tmp_path / "progress.txt")
+    osm_manager.seed_tiles(9, [BOUNDS], progress_file=progress_file)
+    other_server = OSMManager(
+        image_manager=ImageManager(),
+        url=tile_server.url.replace("127.0.0.1", "localhost"),
+        cache=str(tmp_path),
+    )
+    other_store = OSMManager(
+        image_manager=ImageManager(),
+        url=tile_server.url,
+        cache=str(tmp_path / "other"),
+    )
+
+    # Act
+    reports = [
+        manager.seed_tiles(9, [BOUNDS], progress_file=progress_file)
+        for manager in (other_server, other_store, osm_manager)
+    ]
+
+    # Assert
+    assert [report.downloaded for report in reports] == [2, 2, 0]
+    assert reports[2].skipped == 2
+
+
+def test_seed_tiles__numpy(osm_manager, tile_server) -> None:
+    # Arrange
+    np = pytest.importorskip("numpy")
+
+    # Act
+    report = osm_manager.seed_tiles(np.int64(8), [np.array(BOUNDS)])
+
+    # Assert
+    assert report.total == report.downloaded == 2
+
+
+def test_seed_tiles__failed(tmp_path) -> None:
+    # Arrange
+    osm_manager = OSMManager(
+        image_manager=ImageManager(),
+        url="http://127.0.0.1:9/{z}/{x}/{y}.png",
+        cache=str(tmp_path),
+    )
+
+    # Act
+    report = osm_manager.seed_tiles(8, [BOUNDS])
+
+    # Assert
+    assert report.failed == report.total == 2
+
+
+def test_token_bucket() -> None:
+    # Arrange
+    bucket = TokenBucket(rate=100, burst=2)
+
+    # Act
+    waits = [bucket.acquire() for _ in range(4)]
+
+    # Assert
+    assert waits[:2] == [0, 0]
+    assert waits[3] > 0
+
+
+def test_main_seed(tile_server, tmp_path) -> None:
+    # Arrange
+    polygon_file = tmp_path / "polygon.json"
+    polygon_file.write_text(json.dumps([[59.95, 24.8], [60.25, 24.8], [60.1, 25.2]]))
+    mbtiles = str(tmp_path / "tiles.mbtiles")
+
+    # Act
+    status = main(
+        [
+            "seed",
+            "--polygons",
+            str(polygon_file),
+            "--zoom",
+            "8-9",
+            "--url",
+            tile_server.url,
+            "--mbtiles",
+            mbtiles,
+            "--cache",
+            str(tmp_path),
+        ]
+    )
+
+    # Assert
+    assert status == 0
+    assert len(tile_server.requests) == 4
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ["seed", "--zoom", "8"],
+        ["seed", "--zoom", "8", "--bbox", "1", "2", "3", "4", "--mbtiles", "a"]
+        + ["--disk-cache", "b"],
+    ],
+)
+def test_main_seed__invalid(args, capsys) -> None:
+    # Act
+    with pytest.raises(SystemExit) as exc_info:
+        main(args)
+
+    # Assert
+    assert exc_info.value.code == 2
+    assert "error:" in capsys.readouterr().err
+
+
+def test_main_seed__invalid_polygon(tmp_path, capsys) -> None:
+    # Arrange
+    polygon_file = tmp_path / "polygon.json"
+    polygon_file.write_text(json.dumps([[59.95, 24.8], [60.25, 24.8]]))
+
+    # Act
+    with pytest.raises(SystemExit) as exc_info:
+        main(["seed", "--zoom", "8", "--polygons", str(polygon_file)])
+
+    # Assert
+    assert exc_info.value.code == 2
+    assert "3 points" in capsys.readouterr().err
@@ -0,0 +1,562 @@
+"""
+Unit tests for Simulation
+"""
+
+from __future__ import annotations
+
+import io
+import itertools
+import os
+import random
+
+import numpy as np
+import pytest
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+pygame = pytest.importorskip("pygame")
+
+from osmviz.animation import (  # noqa: E402
+    FrameClock,
+    PagedTrackingViz,
+    Simulation,
+    SimViz,
+    TrackingViz,
+    TrackingVizGroup,
+)
+from osmviz.manager import OSMManager, PygameImageManager  # noqa: E402
+from osmviz.readers import FixPages  # noqa: E402
+from osmviz.trajectory import Trajectory  # noqa: E402
+
+IMAGE = "test/images/train.png"
+BOX = (59.9225115912, 60.297839409, 24.7828044415, 25.2544966708)
+
+
+class CountingViz(SimViz):
+    """
+    A viz at a fixed place, counting its set_state() calls
+    """
+
+    def __init__(self, time_window, xy, label=None, drawing_order=0) -> None:
+        SimViz.__init__(self, drawing_order)
+        self.time_window = time_window
+        self.xy = xy
+        self.label = label
+        self.calls = 0
+
+    def get_time_interval(self):
+        return self.time_window
+
+    def get_bounding_box(self):
+        return BOX
+
+    def get_label(self):
+        return self.label
+
+    def set_state(self, sim_time, get_xy) -> None:
+        self.calls += 1
+
+    def draw_to_surface(self, surf) -> None:
+        pass
+
+    def mouse_intersect(self, mouse_x, mouse_y):
+        x, y = self.xy
+        return abs(x - mouse_x) < 8 and abs(y - mouse_y) < 8
+
+    def get_screen_rect(self):
+        x, y = self.xy
+        return x - 8, y - 8, 16, 16
+
+
+def make_tracking_viz(label, time_window, lat_lon, drawing_order=0) -> TrackingViz:
+    return TrackingViz(label, IMAGE, lambda t: lat_lon, time_window, BOX, drawing_order)
+
+
+def test_draw_frame__only_live_actors() -> None:
+    # Arrange
+    rng = random.Random(0)
+    vizs = []
+    for _ in range(300):
+        begin = rng.uniform(0, 1000)
+        vizs.append(CountingViz((begin, begin + rng.uniform(0, 200)), (0, 0)))
+    scene = CountingViz((-1, -1), (0, 0))
+    sim = Simulation(vizs, [scene])
+    surface = pygame.Surface((100, 100))
+
+    # Act / Assert
+    for time in [rng.uniform(0, 1200) for _ in range(50)] + [0, 1200, 600, 600]:
+        for viz in vizs:
+            viz.calls = 0
+        sim.set_time(time)
+        sim.draw_frame(surface, None, lambda lat, lon: (0, 0))
+        for viz in vizs:
+            begin, end = viz.time_window
+            assert viz.calls == (1 if begin <= sim.time <= end else 0)
+    # Scene vizs are always drawn
+    assert scene.calls == 54
+
+
+def test_draw_frame__mouse() -> None:
+    # Arrange
+    rng = random.Random(1)
+    vizs = [
+        CountingViz(
+            (0, 10),
+            (rng.randrange(0, 640), rng.randrange(0, 480)),
+            label=f"viz {i}",
+            drawing_order=rng.randrange(3),
+        )
+        for i in range(500)
+    ]
+    vizs.append(CountingViz((0, 10), (50, 50), label=None, drawing_order=9))
+    sim = Simulation(vizs, [])
+    surface = pygame.Surface((640, 480))
+
+    def linear_scan(x, y):
+        selected = None
+        for viz in sim.all_vizs:
+            if viz.get_label() and viz.mouse_intersect(x, y):
+                selected = viz
+        return selected
+
+    # Act / Assert
+    sim.draw_frame(surface, None, lambda lat, lon: (0, 0), (50, 50))
+    for _ in range(500):
+        x, y = rng.randrange(-10, 650), rng.randrange(-10, 490)
+        assert sim.get_viz_at(x, y) is linear_scan(x, y)
+
+
+def test_update_frame() -> None:
+    # Arrange
+    rng = random.Random(3)
+    vizs = []
+    for i in range(20):
+        begin = rng.uniform(0, 20)
+        lat1, lat2 = rng.uniform(*BOX[:2]), rng.uniform(*BOX[:2])
+        lon = rng.uniform(*BOX[2:])
+        vizs.append(
+            TrackingViz(
+                None,
+                [IMAGE, "test/images/bus.png"][i % 2],
+                Trajectory([(begin, lat1, lon), (begin + 20, lat2, lon)]),
+                drawing_order=rng.randrange(3),
+            )
+        )
+    sim = Simulation(vizs, [])
+    size = (800, 600)
+    get_xy = sim.make_get_xy(BOX, size)
+    background = pygame.Surface(size)
+    pygame.draw.line(background, (200, 100, 0), (0, 0), size, 5)
+    surface, expected = pygame.Surface(size), pygame.Surface(size)
+
+    # Act / Assert
+    sim.set_time(0)
+    assert sim.update_frame(surface, background, get_xy) == (None, None)
+    for time in [*range(1, 30), 29, 29, 5, 5.5]:
+        sim.set_time(time)
+        # A label, say, drawn over the last frame
+        junk = pygame.Rect(rng.randrange(800), rng.randrange(600), 30, 10)
+        surface.fill((255, 255, 255), junk)
+        _, rects = sim.update_frame(surface, background, get_xy, dirty=[junk])
+        sim.draw_frame(expected, background, get_xy)
+        assert rects is not None
+        assert pygame.image.tobytes(surface, "RGB") == pygame.image.tobytes(
+            expected, "RGB"
+        )
+    # Nothing moved
+    assert sim.update_frame(surface, background, get_xy)[1] == []
+    # Everything is redrawn after draw_frame(), or when much changed
+    sim.draw_frame(surface, background, get_xy)
+    assert sim.update_frame(surface, background, get_xy)[1] is None
+    assert (
+        sim.update_frame(surface, background, get_xy, dirty=[(0, 0, 800, 400)])[1]
+        is None
+    )
+    assert sim.update_frame(surface, pygame.Surface(size), get_xy)[1] is None
+
+
+def test_update_frame__group() -> None:
+    # Arrange
+    rng = np.random.default_rng(4)
+    tracks = []
+    for _ in range(30):
+        begin = rng.uniform(0, 20)
+        lats = np.sort(rng.uniform(*BOX[:2], 2))
+        lons = rng.uniform(*BOX[2:], 2)
+        tracks.append(np.column_stack([[begin, begin + 20], lats, lons]))
+    images = [IMAGE, "test/images/bus.png"] * 15
+    group = TrackingVizGroup(tracks, images, drawing_order=1)
+    other = make_tracking_viz(None, (0, 40), (60.1, 25.0))
+    sim = Simulation([group, other], [])
+    size = (800, 600)
+    get_xy = sim.make_get_xy(BOX, size)
+    background = pygame.Surface(size)
+    pygame.draw.line(background, (200, 100, 0), (0, 0), size, 5)
+    surface, expected = pygame.Surface(size), pygame.Surface(size)
+
+    # Act / Assert
+    sim.set_time(0)
+    assert sim.update_frame(surface, background, get_xy) == (None, None)
+    for time in [*range(1, 45), 44, 5, 5.5]:
+        sim.set_time(time)
+        _, rects = sim.update_frame(surface, background, get_xy)
+        sim.draw_frame(expected, background, get_xy)
+        # Only the objects which moved are redrawn
+        assert rects is not None
+        assert pygame.image.tobytes(surface, "RGB") == pygame.image.tobytes(
+            expected, "RGB"
+        )
+    assert sim.update_frame(surface, background, get_xy)[1] == []
+
+
+def test_tracking_viz_group__get_screen_rects() -> None:
+    # Arrange
+    group = TrackingVizGroup(
+        [[(0, 60.0, 25.0)], [(0, 60.1, 25.1)], [(5, 60.2, 25.2)]], IMAGE
+    )
+    width, height = pygame.image.load(IMAGE).get_size()
+
+    # Act
+    group.set_state(0, lambda lat, lon: (lon * 1000 - 25000, lat * 1000 - 60000))
+
+    # Assert
+    assert group.get_screen_rects() == pytest.approx(
+        [
+            (-width / 2, -height / 2, width, height),
+            (100 - width / 2, 100 - height / 2, width, height),
+        ]
+    )
+
+
+def test_update_frame__no_screen_rect() -> None:
+    # Arrange
+    viz = CountingViz((0, 10), (50, 50))
+    viz.get_screen_rect = lambda: None  # type: ignore[method-assign]
+    sim = Simulation([viz], [])
+    get_xy = sim.make_get_xy(BOX, (200, 200))
+    background, surface = pygame.Surface((200, 200)), pygame.Surface((200, 200))
+
+    # Act / Assert
+    for time in range(3):
+        sim.set_time(time)
+        assert sim.update_frame(surface, background, get_xy)[1] is None
+
+
+def test_draw_frame__tracking_viz() -> None:
+    # Arrange
+    early = make_tracking_viz("early", (0, 10), (60.0, 25.0))
+    late = make_tracking_viz("late", (5, 20), (60.0, 25.0), drawing_order=1)
+    sim = Simulation([early, late], [])
+    surface = pygame.Surface((200, 200))
+
+    def get_xy(lat, lon):
+        return 100, 100
+
+    # Act / Assert
+    sim.set_time(2)
+    assert sim.draw_frame(surface, None, get_xy, (100, 100)) is early
+    sim.set_time(7)
+    assert sim.draw_frame(surface, None, get_xy, (100, 100)) is late
+    assert sim.draw_frame(surface, None, get_xy, (0, 0)) is None
+    sim.set_time(15)
+    assert sim.draw_frame(surface, None, get_xy, (100, 100)) is late
+
+
+def test_tracking_viz__trajectory() -> None:
+    # Arrange
+    fixes = [(0, 60.0, 24.9), (50, 60.2, 25.1), (100, 60.1, 25.2)]
+    trajectory = Trajectory(fixes)
+    viz = TrackingViz("train", IMAGE, trajectory)
+    sim = Simulation([viz], [])
+    get_xy = sim.make_get_xy(BOX, (640, 480))
+
+    # Act / Assert
+    assert viz.get_time_interval() == (0, 100)
+    assert viz.get_bounding_box() == (60.0, 60.2, 24.9, 25.2)
+    for time in [0, 20, 50, 99.5, 100]:
+        viz.set_state(time, get_xy)
+        x, y = get_xy(*trajectory(time))
+        assert abs(viz.xy[0] - x) <= 1
+        assert abs(viz.xy[1] - y) <= 1
+    viz.set_state(101, get_xy)
+    assert viz.xy is None
+    with pytest.raises(ValueError):
+        TrackingViz("train", IMAGE, trajectory.get_lat_lon_at_time)
+
+
+def make_tracks(count, seed=2):
+    """
+    Returns tracks of (time, lat, lon) rows, within BOX, at random times.
+    """
+    rng = random.Random(seed)
+    tracks = []
+    for _ in range(count):
+        time = rng.uniform(0, 50)
+        rows = []
+        for _ in range(rng.randrange(1, 6)):
+            rows.append((time, rng.uniform(*BOX[:2]), rng.uniform(*BOX[2:])))
+            time += rng.choice([0, rng.uniform(1, 30)])
+        tracks.append(rows)
+    return tracks
+
+
+def interpolate(rows, time):
+    """
+    Returns the (lat, lon) of a track at time, or None, one row at a time.
+    """
+    if not rows[0][0] <= time <= rows[-1][0]:
+        return None
+    for (t0, lat0, lon0), (t1, lat1, lon1) in itertools.pairwise(rows):
+        if t0 <= time < t1:
+            f = (time - t0) / (t1 - t0)
+            return lat0 + f * (lat1 - lat0), lon0 + f * (lon1 - lon0)
+    return rows[-1][1:]
+
+
+def test_tracking_viz_group__get_lat_lon_at_time() -> None:
+    # Arrange
+    tracks = make_tracks(200)
+    group = TrackingVizGroup(tracks, IMAGE)
+
+    # Act / Assert
+    for time in [-1, 0, 7.5, 20, 33.3, 60, 200]:
+        index, lat, lon = group.get_lat_lon_at_time(time)
+        expected = {i: interpolate(rows, time) for i, rows in enumerate(tracks)}
+        assert index.tolist() == [i for i, ll in expected.items() if ll]
+        for i, la, lo in zip(index.tolist(), lat.tolist(), lon.tolist()):
+            assert (la, lo) == pytest.approx(expected[i])
+
+
+def test_tracking_viz_group__get_lat_lon_at_time__close_samples() -> None:
+    # Arrange
+    # Long tracks with samples closer in time than the rounding of the
+    # (track, time) keys used to search all the tracks at once
+    rng = np.random.default_rng(0)
+    tracks = []
+    for _ in range(50):
+        times = rng.choice([0.0, 1e-12, 0.5, 10.0], 400).cumsum()
+        tracks.append(np.column_stack([times, rng.uniform(60, 61, (400, 2))]))
+    group = TrackingVizGroup(tracks, IMAGE)
+    samples = np.concatenate([track[:, 0] for track in tracks])
+
+    # Act / Assert
+    for time in [*rng.choice(samples, 200), *rng.uniform(0, 2000, 100)]:
+        index, lat, _ = group.get_lat_lon_at_time(time)
+        for i, la in zip(index.tolist(), lat.tolist()):
+            times, lats = tracks[i][:, 0], tracks[i][:, 1]
+            # Interpolated from the last sample at or before time
+            k = np.searchsorted(times, time, side="right") - 1
+            assert la == pytest.approx(np.interp(time, times[k:][:2], lats[k:][:2]))
+
+
+def test_tracking_viz_group__draws_like_tracking_vizs() -> None:
+    # Arrange
+    tracks = make_tracks(300)
+    images = [IMAGE, "test/images/bus.png"] * 150
+    vizs = [
+        TrackingViz(
+            None, image, lambda t, rows=rows: interpolate(rows, t), (-1, 100), BOX
+        )
+        for rows, image in zip(tracks, images)
+    ]
+    group = TrackingVizGroup(tracks, images)
+    sim_vizs, sim_group = Simulation(vizs, []), Simulation([group], [])
+    get_xy = sim_group.make_get_xy(BOX, (400, 300))
+    surface1, surface2 = pygame.Surface((400, 300)), pygame.Surface((400, 300))
+
+    # Act / Assert
+    assert len(group.icons) == 2
+    assert group.get_bounding_box() == pytest.approx(sim_vizs.bounding_box, abs=0.1)
+    for time in [0, 12.5, 40]:
+        sim_vizs.time = sim_group.time = time
+        sim_vizs.draw_frame(surface1, None, get_xy)
+        sim_group.draw_frame(surface2, None, get_xy)
+        assert pygame.image.tobytes(surface1, "RGB") == pygame.image.tobytes(
+            surface2, "RGB"
+        )
+        # Projecting point by point gives the same positions
+        x, y = group.x, group.y
+        group.set_state(time, lambda lat, lon: get_xy(lat, lon))
+        assert group.x.tolist() == x.tolist()
+        assert group.y.tolist() == y.tolist()
+
+
+def test_tracking_viz_group__mouse() -> None:
+    # Arrange
+    tracks = [[(0, 60.0, 25.0)], [(0, 60.0, 25.0), (10, 60.0, 25.0)], [(0, 60, 25)]]
+    group = TrackingVizGroup(tracks, IMAGE, labels=["a", "b", None])
+    sim = Simulation([group], [])
+    surface = pygame.Surface((200, 200))
+
+    def get_xy(lat, lon):
+        return 100, 100
+
+    # Act / Assert
+    assert sim.draw_frame(surface, None, get_xy, (100, 100)) is group
+    assert group.get_label() == "b"
+    assert sim.get_viz_at(0, 0) is None
+    assert group.get_label() is None
+    sim.set_time(0)
+    assert sim.draw_frame(surface, None, get_xy, (101, 99)) is group
+    assert group.get_label() == "b"
+
+
+def test_tracking_viz_group__invalid() -> None:
+    with pytest.raises(ValueError):
+        TrackingVizGroup([[(0, 60, 25)], []], IMAGE)
+    with pytest.raises(ValueError):
+        TrackingVizGroup([[(0, 60, 25)], [(2, 60, 25), (1, 60, 25)]], IMAGE)
+    with pytest.raises(ValueError):
+        TrackingVizGroup([[(0, 60, 25)]], [IMAGE, IMAGE])
+
+
+def test_paged_tracking_viz(tmp_path) -> None:
+    # Arrange
+    tracks = make_tracks(100)
+    fixes = sorted(
+        ((f"obj {i}", *row) for i, rows in enumerate(tracks) for row in rows),
+        key=lambda fix: fix[1],
+    )
+    pages = FixPages([fixes], page_duration=5, directory=str(tmp_path))
+    paged = PagedTrackingViz(pages, IMAGE)
+    # In the order the objects first appear, as they are drawn from pages
+    group = TrackingVizGroup(sorted(tracks, key=lambda rows: rows[0][0]), IMAGE)
+    sim_paged, sim_group = Simulation([paged], []), Simulation([group], [])
+    get_xy = sim_paged.make_get_xy(BOX, (400, 300))
+    surface1, surface2 = pygame.Surface((400, 300)), pygame.Surface((400, 300))
+
+    # Act / Assert
+    assert sim_paged.time_window == sim_group.time_window
+    begin = sim_group.time_window[0]
+    for time in [0, 3, 4.99, 5, 12.5, 40, 41, 7]:
+        sim_paged.time = sim_group.time = begin + time
+        surface1.fill((0, 0, 0))
+        surface2.fill((0, 0, 0))
+        sim_paged.draw_frame(surface1, None, get_xy)
+        sim_group.draw_frame(surface2, None, get_xy)
+        assert paged.page == (begin + time) // 5
+        assert pygame.image.tobytes(surface1, "RGB") == pygame.image.tobytes(
+            surface2, "RGB"
+        )
+        assert sorted(paged.get_screen_rects()) == sorted(group.get_screen_rects())
+    page_group = paged.group
+    assert page_group is not None
+    x, y = int(page_group.x[0]), int(page_group.y[0])
+    assert sim_paged.get_viz_at(x, y) is paged
+    assert paged.get_label().startswith("obj ")
+    pages.close()
+
+
+class FakeTime:
+    """
+    A clock which only moves when slept on, or when work is done
+    """
+
+    def __init__(self) -> None:
+        self.now = 100.0
+        self.slept: list[float] = []
+
+    def clock(self) -> float:
+        return self.now
+
+    def sleep(self, seconds) -> None:
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def test_frame_clock() -> None:
+    # Arrange
+    fake = FakeTime()
+    clock = FrameClock(fps=10, clock=fake.clock, sleep=fake.sleep)
+    # Seconds of work before each tick
+    work = [0.02, 0.05, 0.25, 0.01, 0.09, 0.12, 0.03]
+
+    # Act
+    elapsed = [clock.tick()]
+    for seconds in work:
+        fake.now += seconds
+        elapsed.append(clock.tick())
+
+    # Assert
+    # Frames on the beat, except the slow one, and the one after it
+    # which is due sooner to keep to the beat
+    assert elapsed == pytest.approx([0, 0.1, 0.1, 0.25, 0.05, 0.1, 0.12, 0.08])
+    # Sim time kept with wall time
+    assert sum(elapsed) == pytest.approx(fake.now - 100)
+    assert clock.skipped == 1
+    stats = clock.get_stats()
+    assert stats["frames"] == 7
+    assert stats["fps"] == pytest.approx(7 / 0.8)
+    assert stats["frame_time"]["max"] == pytest.approx(0.25)
+    assert stats["frame_time"]["p50"] == pytest.approx(0.1)
+    assert stats["work_time"]["max"] == pytest.approx(0.25)
+    with pytest.raises(ValueError):
+        FrameClock(fps=0)
+
+
+@pytest.fixture()
+def sim_and_osm(tile_server, tmp_path):
+    viz = TrackingViz(
+        "train",
+        IMAGE,
+        lambda t: (BOX[0] + t / 100 * (BOX[1] - BOX[0]), BOX[2]),
+        (0, 100),
+        BOX,
+    )
+    osm = OSMManager(
+        image_manager=PygameImageManager(),
+        url=tile_server.url,
+        cache=str(tmp_path),
+        verbose=False,
+    )
+    return Simulation([viz], []), osm
+
+
+def test_render__image_sequence(sim_and_osm, tmp_path) -> None:
+    # Arrange
+    sim, osm = sim_and_osm
+    pattern = str(tmp_path / "frame{:03d}.png")
+
+    # Act
+    frames = sim.render(
+        pattern, dt=10, window_size=(320, 200), osm_zoom=10, osm_manager=osm
+    )
+
+    # Assert
+    assert frames == 11
+    assert sorted(os.listdir(tmp_path))[:2] == ["frame000.png", "frame001.png"]
+    first = pygame.image.load(pattern.format(0))
+    last = pygame.image.load(pattern.format(10))
+    assert first.get_height() == 200
+    assert pygame.image.tobytes(first, "RGB") != pygame.image.tobytes(last, "RGB")
+
+
+def test_render__raw_stream(sim_and_osm) -> None:
+    # Arrange
+    sim, osm = sim_and_osm
+    stream = io.BytesIO()
+    sizes = []
+
+    # Act
+    frames = sim.render(
+        stream, dt=25, window_size=(320, 200), osm_zoom=10, osm_manager=osm
+    )
+    sim.render(
+        lambda surface, frame: sizes.append(surface.get_size()),
+        dt=25,
+        start=50,
+        window_size=(320, 200),
+        osm_zoom=10,
+        osm_manager=osm,
+    )
+
+    # Assert
+    assert frames == 5
+    width, height = sizes[0]
+    assert len(stream.getvalue()) == frames * width * height * 3
+    assert len(sizes) == 3
+
+
+def test_render__needs_positive_dt(sim_and_osm) -> None:
+    sim, osm = sim_and_osm
+    with pytest.raises(ValueError):
+        sim.render(io.BytesIO(), dt=0, osm_manager=osm)
@@ -0,0 +1,102 @@
+"""
+Unit tests for Stats
+"""
+
+from __future__ import annotations
+
+import json
+
+import pytest
+
+from osmviz.manager import OSMManager, PILImageManager
+from osmviz.stats import Stats
+
+
+def test_count_and_time() -> None:
+    # Arrange
+    stats = Stats()
+    events = []
+    stats.add_listener(lambda *event: events.append(event))
+
+    # Act
+    stats.count("tile_hits")
+    stats.count("tile_hits")
+    stats.count("download_bytes", 1000)
+    stats.add_time("decode", 0.5)
+    stats.add_time("decode", 1.5)
+    with stats.timer("paste"):
+        pass
+
+    # Assert
+    snapshot = stats.get_snapshot()
+    assert snapshot["counters"] == {"tile_hits": 2, "download_bytes": 1000}
+    assert snapshot["timers"]["decode"] == {"count": 2, "total": 2.0, "max": 1.5}
+    assert snapshot["timers"]["paste"]["count"] == 1
+    assert events[:3] == [
+        ("count", "tile_hits", 1),
+        ("count", "tile_hits", 1),
+        ("count", "download_bytes", 1000),
+    ]
+    assert events[-1][:2] == ("time", "paste")
+
+
+def test_timer__exception() -> None:
+    # Arrange
+    stats = Stats()
+
+    # Act
+    with pytest.raises(ValueError), stats.timer("paste"):
+        raise ValueError
+
+    # Assert
+    assert stats.get_snapshot()["timers"] == {}
+
+
+def test_exports() -> None:
+    # Arrange
+    stats = Stats()
+    stats.count("tile_misses", 3)
+    stats.add_time("download", 0.25)
+
+    # Act
+    text = stats.to_prometheus()
+    data = json.loads(stats.to_json())
+
+    # Assert
+    assert text == (
+        "# TYPE osmviz_tile_misses_total counter\n"
+        "osmviz_tile_misses_total 3\n"
+        "# TYPE osmviz_download_seconds summary\n"
+        "osmviz_download_seconds_count 1\n"
+        "osmviz_download_seconds_sum 0.25\n"
+    )
+    assert data == stats.get_snapshot()
+
+
+def test_osm_manager_stats(tile_server, tmp_path, capsys) -> None:
+    # Arrange
+    bounds = (59.9225115912, 60.297839409, 24.7828044415, 25.2544966708)
+    osm_manager = OSMManager(
+        image_manager=PILImageManager("RGB"),
+        url=tile_server.url,
+        cache=str(tmp_path),
+        verbose=False,
+    )
+
+    # Act
+    osm_manager.create_osm_image(bounds, 11)
+    osm_manager.manager.destroy_image()
+    osm_manager.create_osm_image(bounds, 11)
+
+    # Assert
+    snapshot = osm_manager.stats.get_snapshot()
+    counters, timers = snapshot["counters"], snapshot["timers"]
+    assert counters["tile_misses"] == 20
+    assert counters["tile_hits"] == 20
+    assert counters["download_bytes"] > 0
+    assert timers["download"]["count"] == 20
+    assert timers["decode"]["count"] == 40
+    assert timers["paste"]["count"] == 40
+    assert timers["render"]["count"] == 2
+    assert osm_manager.manager.stats is osm_manager.stats
+    assert capsys.readouterr() == ("", "")
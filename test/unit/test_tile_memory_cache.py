@@ -0,0 +1,91 @@
+"""
+Unit tests for TileMemoryCache
+"""
+
+from __future__ import annotations
+
+import pytest
+
+from osmviz.cache import TileMemoryCache
+
+
+@pytest.fixture()
+def cache():
+    yield TileMemoryCache(max_bytes=300)
+
+
+def test_get__miss(cache) -> None:
+    # Act
+    img = cache.get(("abc", 1, 0, 0))
+
+    # Assert
+    assert img is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_put_get(cache) -> None:
+    # Arrange
+    cache.put(("abc", 1, 0, 0), "tile", 100)
+
+    # Act
+    img = cache.get(("abc", 1, 0, 0))
+
+    # Assert
+    assert img == "tile"
+    assert cache.stats() == {
+        "hits": 1,
+        "misses": 0,
+        "evictions": 0,
+        "entries": 1,
+        "bytes": 100,
+        "max_bytes": 300,
+    }
+
+
+def test_put__evicts_least_recently_used(cache) -> None:
+    # Arrange
+    for x in range(3):
+        cache.put(("abc", 1, x, 0), f"tile{x}", 100)
+    cache.get(("abc", 1, 0, 0))
+
+    # Act
+    cache.put(("abc", 1, 3, 0), "tile3", 100)
+
+    # Assert
+    assert ("abc", 1, 0, 0) in cache
+    assert ("abc", 1, 1, 0) not in cache
+    assert len(cache) == 3
+    assert cache.evictions == 1
+    assert cache.current_bytes == 300
+
+
+def test_put__larger_than_budget(cache) -> None:
+    # Act
+    cache.put(("abc", 1, 0, 0), "huge", 301)
+
+    # Assert
+    assert len(cache) == 0
+
+
+def test_put__replace(cache) -> None:
+    # Arrange
+    cache.put(("abc", 1, 0, 0), "old", 200)
+
+    # Act
+    cache.put(("abc", 1, 0, 0), "new", 50)
+
+    # Assert
+    assert cache.get(("abc", 1, 0, 0)) == "new"
+    assert cache.current_bytes == 50
+
+
+def test_clear(cache) -> None:
+    # Arrange
+    cache.put(("abc", 1, 0, 0), "tile", 100)
+
+    # Act
+    cache.clear()
+
+    # Assert
+    assert len(cache) == 0
+    assert cache.current_bytes == 0
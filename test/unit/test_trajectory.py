@@ -0,0 +1,114 @@
+"""
+Unit tests for Trajectory
+"""
+
+from __future__ import annotations
+
+import itertools
+import random
+
+import pytest
+
+from osmviz import projection
+from osmviz.trajectory import Trajectory
+
+BOUNDS = (59.9225115912, 60.297839409, 24.7828044415, 25.2544966708)
+FIXES = [
+    (0, 60.0, 25.0),
+    (10, 60.1, 25.0),
+    (10, 60.2, 25.1),
+    (30, 60.2, 25.2),
+    (31, 60.0, 24.8),
+]
+
+
+def expected_lat_lon(time):
+    """
+    Interpolates FIXES at time the slow way, or returns None.
+    """
+    if not FIXES[0][0] <= time <= FIXES[-1][0]:
+        return None
+    for (t0, lat0, lon0), (t1, lat1, lon1) in itertools.pairwise(FIXES):
+        if t0 <= time < t1:
+            f = (time - t0) / (t1 - t0)
+            return lat0 + f * (lat1 - lat0), lon0 + f * (lon1 - lon0)
+    return FIXES[-1][1:]
+
+
+def test_get_lat_lon_at_time() -> None:
+    # Arrange
+    trajectory = Trajectory(FIXES)
+    rng = random.Random(0)
+    # Advancing steadily, then jumping about
+    times = [t / 4 for t in range(-4, 130)] + [rng.uniform(-5, 35) for _ in range(200)]
+
+    # Act / Assert
+    for time in times:
+        expected = expected_lat_lon(time)
+        if expected is None:
+            assert trajectory(time) is None
+        else:
+            assert trajectory.get_lat_lon_at_time(time) == pytest.approx(expected)
+
+
+def test_find_fix() -> None:
+    # Arrange
+    trajectory = Trajectory(FIXES)
+
+    # Act / Assert
+    assert [trajectory.find_fix(t) for t in [0, 5, 10, 20, 30, 31]] == [
+        0,
+        0,
+        2,
+        2,
+        3,
+        4,
+    ]
+    assert trajectory.find_fix(31.5) is None
+    assert trajectory.find_fix(5) == 0
+    assert trajectory.find_fix(-1) is None
+
+
+def test_get_xy_at_time() -> None:
+    # Arrange
+    trajectory = Trajectory(FIXES)
+    calls = []
+
+    def get_xy(lat, lon):
+        calls.append((lat, lon))
+        return projection.get_xy(lat, lon, BOUNDS, (1280, 800))
+
+    # Act
+    positions = [trajectory.get_xy_at_time(t / 3, get_xy) for t in range(94)]
+    projected = len(calls)
+    # A different get_xy (another window) projects the fixes again
+    moved = trajectory.get_xy_at_time(3, lambda lat, lon: (7, 7))
+
+    # Assert
+    assert projected == len(FIXES)
+    assert moved == (7, 7)
+    assert trajectory.get_xy_at_time(40, get_xy) is None
+    for t, (x, y) in zip(range(94), positions):
+        expected_x, expected_y = get_xy(*expected_lat_lon(t / 3))
+        assert abs(x - expected_x) <= 1
+        assert abs(y - expected_y) <= 1
+
+
+def test_bounds() -> None:
+    # Act
+    trajectory = Trajectory([(5, 60.0, 25.0)])
+
+    # Assert
+    assert len(trajectory) == 1
+    assert trajectory.get_time_interval() == (5, 5)
+    assert trajectory.get_bounding_box() == (60, 60, 25, 25)
+    assert trajectory(5) == (60, 25)
+    assert trajectory(5.1) is None
+    assert Trajectory(FIXES).get_bounding_box() == (60.0, 60.2, 24.8, 25.2)
+
+
+def test_invalid() -> None:
+    with pytest.raises(ValueError):
+        Trajectory([])
+    with pytest.raises(ValueError):
+        Trajectory([(1, 60, 25), (0, 60, 25)])